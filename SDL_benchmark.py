@@ -0,0 +1,520 @@
+import io
+import os
+import time
+import tracemalloc
+import contextlib
+import numpy as np
+import scipy.sparse as sp
+from scipy.special import expit
+
+from sklearn.decomposition import SparseCoder, TruncatedSVD
+
+from src.kernels import update_code_within_radius, recons_error, logistic_loss_grad, sq_norm, sparse_code_batched
+from src.kernels import subspace_svd
+from src.SDL_BCD import SDL_BCD
+from src.SDL_SVP import SDL_SVP
+
+
+def update_code_within_radius_legacy(X, W, H0, r, a1=0, a2=0,
+                                     sub_iter=[2], stopping_grad_ratio=0.0001,
+                                     subsample_ratio=None, nonnegativity=True):
+    '''
+    Copy of the row-wise projected gradient code update before src.kernels
+    (one H1.copy() and new ones/zeros vectors per row), kept for benchmarking
+    '''
+    if H0 is None:
+        H0 = np.random.rand(W.shape[1], X.shape[1])
+    H1 = H0.copy()
+    i = 0
+
+    A = W.T @ W
+    B = W.T @ X
+
+    while (i < np.random.choice(sub_iter)):
+        for k in np.arange(H0.shape[0]):
+            grad = np.dot(A[k, :], H1) - B[k, :]
+            grad += a1 * np.sign(H1[k, :]) * np.ones(H0.shape[1]) + a2 * H1[k, :]
+            grad_norm = np.linalg.norm(grad, 2)
+
+            step_size = 1/(A[k,k]+1)
+            if r is not None:
+                d = step_size * grad_norm
+                step_size = (r / max(r, d)) * step_size
+
+            H1_temp = H1.copy()
+            H1_temp[k, :] = H1[k, :] - step_size * grad
+            if nonnegativity:
+                H1_temp[k,:] = np.maximum(H1_temp[k,:], np.zeros(shape=(H1.shape[1],)))  # nonnegativity constraint
+            H1 = H1_temp
+
+        i = i + 1
+
+    return H1
+
+
+def profile(f, *args, n_repeat=3, **kwargs):
+    '''
+    Returns (output, best wall-clock time, peak traced memory in MB) of f(*args, **kwargs)
+    '''
+    times = []
+    for j in range(n_repeat):
+        np.random.seed(j)
+        t0 = time.time()
+        out = f(*args, **kwargs)
+        times.append(time.time() - t0)
+    tracemalloc.start()
+    f(*args, **kwargs)
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return out, min(times), peak
+
+
+def benchmark_code_update(p=100, r=20, n=100000, n_repeat=3):
+    '''
+    Microbenchmark of update_code_within_radius against the legacy copy at n columns.
+    Peak memory excludes the inputs X, W, H0 (allocated before tracing starts).
+    '''
+    rng = np.random.RandomState(0)
+    X = rng.rand(p, n)
+    W = rng.rand(p, r)
+    H0 = rng.rand(r, n)
+
+    print('update_code_within_radius: p=%i, r=%i, n=%i' % (p, r, n))
+    results = {}
+    for name, f in [('legacy', update_code_within_radius_legacy), ('kernel', update_code_within_radius)]:
+        for a1 in [0, 0.1]:
+            H, t, peak = profile(f, X, W, H0, r=1, a1=a1, n_repeat=n_repeat)
+            results[(name, a1)] = H
+            print('  %-7s a1=%-4s time %.3fs  peak alloc %.1f MB' % (name, a1, t, peak))
+    for a1 in [0, 0.1]:
+        H_old, H_new = results[('legacy', a1)], results[('kernel', a1)]
+        print('  a1=%-4s relative difference %.2e' % (a1, np.linalg.norm(H_old - H_new) / np.linalg.norm(H_old)))
+
+
+def benchmark_chunked_code_update(p=100, r=20, n=200000, chunk_size=20000, n_jobs_list=[1, 2, 4, 8], n_repeat=3):
+    '''
+    update_code_within_radius on column chunks of chunk_size in a pool of n_jobs threads against one thread
+    at the same chunking (the results must be bitwise identical) and the unchunked call.
+    '''
+    rng = np.random.RandomState(0)
+    X = rng.rand(p, n)
+    W = rng.rand(p, r)
+    H0 = rng.rand(r, n)
+
+    print('chunked update_code_within_radius: p=%i, r=%i, n=%i, chunk_size=%i, %i CPUs' % (p, r, n, chunk_size, os.cpu_count()))
+    _, t, _ = profile(update_code_within_radius, X, W, H0, r=1, n_repeat=n_repeat)
+    print('  %-10s time %.3fs' % ('unchunked', t))
+    H_serial = None
+    for n_jobs in n_jobs_list:
+        H, t, _ = profile(update_code_within_radius, X, W, H0, r=1, chunk_size=chunk_size, n_jobs=n_jobs, n_repeat=n_repeat)
+        H_serial = H if H_serial is None else H_serial
+        print('  n_jobs=%-3i time %.3fs  identical to n_jobs=%i: %s' % (n_jobs, t, n_jobs_list[0], np.array_equal(H, H_serial)))
+
+
+def benchmark_objective(p=10000, r=20, n=2000, n_repeat=3):
+    '''
+    Cost of one training-loss evaluation (reconstruction + logistic loss) as logged in time_error:
+    the legacy (d x n) residual and log(1+exp) against kernels.recons_error with the statistics
+    |X|^2, W.T @ X, W.T @ W, H @ H.T that fit already caches, and kernels.logistic_loss_grad
+    '''
+    rng = np.random.RandomState(0)
+    X = rng.rand(p, n)
+    W = rng.rand(p, r)
+    H = rng.rand(r, n)
+    Y = (rng.rand(1, n) < 0.5).astype(float)
+    beta = rng.randn(1, r + 1)
+    X_sq, WtX, WtW, HHt = sq_norm(X), W.T @ X, W.T @ W, H @ H.T
+    X0_ext = np.vstack((np.ones(n), WtX))
+
+    def legacy():
+        error_data = np.linalg.norm((X - W @ H).reshape(-1, 1), ord=2)**2
+        error_label = np.sum(np.log(1+np.exp(beta @ X0_ext))) - Y @ (beta @ X0_ext).T
+        return error_data, error_label[0][0]
+
+    def cached():
+        return recons_error(X, W, H, X_sq=X_sq, WtX=WtX, WtW=WtW, HHt=HHt), logistic_loss_grad(beta, X0_ext, Y, compute_grad=False)[0]
+
+    print('training loss evaluation: p=%i, r=%i, n=%i' % (p, r, n))
+    for name, f in [('legacy', legacy), ('cached', cached)]:
+        out, t, peak = profile(f, n_repeat=n_repeat)
+        print('  %-7s time %.4fs  peak alloc %.1f MB  [data, label] = [%.6e, %.6e]' % (name, t, peak, out[0], out[1]))
+
+
+def benchmark_logistic_grad(p=100, d2=5, n=100000, n_repeat=3):
+    '''
+    Logistic loss and gradient wrt the coefficients as used in the beta and dictionary updates:
+    separate sigmoid, log(1+exp) and residual temporaries against the fused kernels.logistic_loss_grad,
+    then both at logits scaled by 10^4 where 1/(1+exp(-D)) and log(1+exp(D)) overflow
+    '''
+    rng = np.random.RandomState(0)
+    H = rng.rand(p, n)
+    Y = (rng.rand(d2, n) < 0.5).astype(float)
+    W = rng.randn(d2, p) / p
+
+    def legacy(W):
+        P = 1 / (1 + np.exp(-W @ H))
+        loss = np.sum(np.log(1 + np.exp(W @ H))) - np.sum(Y * (W @ H))
+        return loss, (P - Y) @ H.T
+
+    def fused(W):
+        loss, _, grad = logistic_loss_grad(W, H, Y)
+        return loss, grad
+
+    print('logistic loss and gradient: p=%i, d2=%i, n=%i' % (p, d2, n))
+    out = {}
+    for name, f in [('legacy', legacy), ('fused', fused)]:
+        out[name], t, peak = profile(f, W, n_repeat=n_repeat)
+        print('  %-7s time %.4fs  peak alloc %.1f MB  loss %.6e' % (name, t, peak, out[name][0]))
+    print('  relative difference of the gradients %.2e' % (np.linalg.norm(out['legacy'][1] - out['fused'][1]) / np.linalg.norm(out['fused'][1])))
+    with np.errstate(over='ignore', invalid='ignore'):
+        for name, f in [('legacy', legacy), ('fused', fused)]:
+            loss, grad = f(1e4 * W)
+            print('  %-7s logits x1e4: loss %.6e, finite gradient %s' % (name, loss, np.all(np.isfinite(grad))))
+
+
+def benchmark_sparse_code(d=100, r=20, n=50000, alpha=0.1):
+    '''
+    sparse_code: sklearn SparseCoder(lasso_lars, positive_code=True), one LARS path per sample,
+    against kernels.sparse_code_batched (shared Gram matrix, coordinate descent on all columns),
+    cold and warm started from the code under a slightly perturbed dictionary.
+    Both minimize 0.5 |X - WH|^2 + alpha |H|_1 over H >= 0.
+    '''
+    rng = np.random.RandomState(0)
+    W = rng.rand(d, r)
+    X = W @ np.maximum(rng.randn(r, n), 0) + 0.1 * rng.randn(d, n)
+    objective = lambda H: 0.5 * recons_error(X, W, H) + alpha * np.sum(np.abs(H))
+
+    coder = SparseCoder(dictionary=W.T, transform_alpha=alpha, transform_algorithm='lasso_lars', positive_code=True)
+    start = time.time()
+    H_lars = coder.transform(X.T).T
+    t_lars = time.time() - start
+    H_prev = sparse_code_batched(X, W * (1 + 0.01 * rng.randn(d, r)), alpha=alpha)
+
+    print('sparse coding: d=%i, r=%i, n=%i, alpha=%s' % (d, r, n, alpha))
+    print('  %-10s time %7.2fs  objective %.8e' % ('lasso_lars', t_lars, objective(H_lars)))
+    for name, H0 in [('batched', None), ('warm', H_prev)]:
+        start = time.time()
+        H = sparse_code_batched(X, W, alpha=alpha, H0=H0)
+        t = time.time() - start
+        print('  %-10s time %7.2fs  objective %.8e  speedup %5.1fx  relative difference to lasso_lars %.2e'
+              % (name, t, objective(H), t_lars / t, np.linalg.norm(H - H_lars) / np.linalg.norm(H_lars)))
+
+
+def benchmark_svp_projection(p=2000, n=5000, r=10, n_steps=10, step=0.01, svd_iter_list=[0, 1, 2]):
+    '''
+    Rank-r projections of a sequence of matrices M_t = M_{t-1} + step * (random p x n), as the SVP iterates of
+    SDL_SVP: TruncatedSVD(n_iter=7) from scratch every step (previous rank_r_projection) against
+    kernels.subspace_svd warm-started from the previous singular subspace with svd_iter iterations.
+    Reports the time per projection and the largest relative excess of the projection error over TruncatedSVD.
+    '''
+    rng = np.random.RandomState(0)
+    M = [rng.rand(p, r) @ rng.rand(r, n) + 0.1 * rng.rand(p, n)]
+    for t in np.arange(n_steps - 1):
+        M.append(M[-1] + step * rng.randn(p, n))
+
+    def error(C, u, s, v):
+        return np.linalg.norm(C - (u * s) @ v)
+
+    print('rank-r projection of %i SVP-like iterates: p=%i, n=%i, r=%i' % (n_steps, p, n, r))
+    errors, start = [], time.time()
+    for C in M:
+        svd = TruncatedSVD(n_components=r, n_iter=7, random_state=42)
+        u = svd.fit_transform(C) / svd.singular_values_
+        errors.append(error(C, u, svd.singular_values_, svd.components_))
+    print('  %-22s time %.3fs per projection' % ('TruncatedSVD', (time.time() - start) / n_steps))
+    for svd_iter in svd_iter_list:
+        V, excess, start = None, 0, time.time()
+        for C, e in zip(M, errors):
+            u, s, v, V = subspace_svd(C, r, V0=V, n_iter=7 if V is None else svd_iter)
+            excess = max(excess, error(C, u, s, v) / e - 1)
+        print('  warm, svd_iter=%-7i time %.3fs per projection, error excess %.1e' % (svd_iter, (time.time() - start) / n_steps, excess))
+
+
+def sim_data(p=200, r=2, n=1000, noise_std=0.1, test_size=0.5, random_seed=1):
+    '''
+    Simulation data from the generative model of SDL_simulation.sim_data_gen:
+    X = W_true H_true + noise, Y ~ Bernoulli(sigmoid(Beta_true W_true.T X)) (centered logits)
+    Returns X_train, X_test, Y_train, Y_test with samples as columns
+    '''
+    rng = np.random.RandomState(random_seed)
+    W_true = 1 - 2 * rng.rand(p, r)
+    W_true /= np.sum(abs(W_true), axis=1)[:, np.newaxis]
+    H_true = rng.rand(r, n)
+    H_true[:2, :] *= 10
+    Beta_true = 1 - 2 * rng.rand(1, r)
+    Beta_true[0, :2] = [2, -2]
+    X = W_true @ H_true + noise_std * rng.randn(p, n)
+    logit = Beta_true @ (W_true.T @ X)
+    Y = (rng.rand(1, n) < expit(logit - np.mean(logit))).astype(float)
+    n_train = int(n * (1 - test_size))
+    return X[:, :n_train], X[:, n_train:], Y[:, :n_train], Y[:, n_train:]
+
+
+def load_data(data_type, test_size=0.2, n_max=None, random_seed=1):
+    '''
+    Real data sets of the experiment scripts as X_train, X_test, Y_train, Y_test (samples as columns):
+    'MNIST' : digits 4 vs. 7 from openml (as in SDL_simulation_MNIST), X = pixels / 255
+    'fakejob' : word frequencies of the job descriptions and fraud labels (Data/ files of SDL_simulation_fakejob)
+    Returns None if the data set cannot be loaded (no network or missing files).
+    '''
+    from sklearn.model_selection import train_test_split
+    try:
+        if data_type == 'MNIST':
+            from sklearn.datasets import fetch_openml
+            X, y = fetch_openml('mnist_784', version=1, return_X_y=True)
+            X, y = np.asarray(X) / 255., np.asarray(y)
+            idx = np.nonzero((y == '4') | (y == '7'))[0]
+            X, Y = X[idx], (y[idx] == '7').astype(float)
+        elif data_type == 'fakejob':
+            import pandas as pd
+            Y = np.asarray(pd.read_csv("Data/fake_job_postings.csv", delimiter=',')['fraudulent'], dtype=float)
+            X = pd.read_csv("Data/results_data_description2.csv", delimiter=',').values
+            X = X - np.min(X)  # word frequency array
+    except Exception as e:
+        print('  %s not available (%s: %s)' % (data_type, type(e).__name__, e))
+        return None
+    if n_max is not None:
+        X, Y = X[:n_max], Y[:n_max]
+    X_train, X_test, Y_train, Y_test = train_test_split(X, Y, test_size=test_size, random_state=random_seed)
+    return X_train.T, X_test.T, Y_train[np.newaxis, :], Y_test[np.newaxis, :]
+
+
+def time_to_target(time_error, xi, target):
+    '''
+    First logged time at which the training loss xi * data + label (time_error = [time, data, label]) is <= target
+    '''
+    loss = xi * time_error[1] + time_error[2]
+    reached = np.nonzero(loss <= target)[0]
+    return time_error[0][reached[0]] if len(reached) > 0 else np.inf
+
+
+def benchmark_code_step(data_types=['simulation', 'MNIST', 'fakejob'], n_components=20, iter=50, n_max=10000,
+                        rel_gaps=[1e-2, 3e-3, 1e-3]):
+    '''
+    Time to target training loss of filter-mode SDL_BCD.fit with the default code step (one radius-limited
+    projected gradient sweep per iteration, code_update_mode='row') against the exact NNLS code step
+    (code_update_mode='exact'). Targets are the best final loss of the two runs times 1 + rel_gap.
+    Uses at most n_max samples of each data set.
+    '''
+    print('filter-mode code step: time to target loss (r=%i, %i iterations)' % (n_components, iter))
+    for data_type in data_types:
+        if data_type == 'simulation':
+            data = sim_data(p=500, r=n_components, n=n_max, test_size=0.2)
+        else:
+            data = load_data(data_type, n_max=n_max)
+        if data is None:
+            continue
+        X_train, X_test, Y_train, Y_test = data
+        runs = {}
+        for mode in ['row', 'exact']:
+            np.random.seed(1)
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                model = SDL_BCD(X=[X_train, Y_train], X_test=[X_test, Y_test], n_components=n_components, xi=1)
+                result = model.fit(iter=iter, option='filter', search_radius_const=iter * np.sqrt(sq_norm(X_train)),
+                                   if_compute_recons_error=True, code_update_mode=mode)
+            runs[mode] = (result.get('time_error'), result.get('Accuracy'))
+        best = min(model.xi * time_error[1][-1] + time_error[2][-1] for time_error, _ in runs.values())
+        print('  %s: X %s, best final loss %.6e' % (data_type, X_train.shape, best))
+        for mode, (time_error, accuracy) in runs.items():
+            times = ['%7.3fs' % time_to_target(time_error, model.xi, (1 + gap) * best) for gap in rel_gaps]
+            print('    %-6s time to loss within %s: %s  (total %.3fs, test accuracy %.3f)' %
+                  (mode, '/'.join('%g' % gap for gap in rel_gaps), ' '.join(times), time_error[0][-1], accuracy))
+
+
+def benchmark_solver(data_types=['simulation', 'MNIST', 'fakejob'], options=['filter', 'feature'], n_components=10,
+                     iter=30, lbfgs_iter=300, n_max=10000, rel_gaps=[1e-2, 3e-3, 1e-3]):
+    '''
+    Time to target training loss of SDL_BCD.fit with the projected gradient blocks (solver='pgd') against
+    the accelerated proximal gradient blocks (solver='fista'), for both SDL options, and against
+    joint L-BFGS-B (solver='lbfgs', lbfgs_iter iterations) for the filter option.
+    Targets are the best final loss of the two runs times 1 + rel_gap; uses at most n_max samples of each data set.
+    '''
+    print('dictionary/code solver: time to target loss (r=%i, %i iterations)' % (n_components, iter))
+    for data_type in data_types:
+        if data_type == 'simulation':
+            data = sim_data(p=500, r=n_components, n=n_max, test_size=0.2)
+        else:
+            data = load_data(data_type, n_max=n_max)
+        if data is None:
+            continue
+        X_train, X_test, Y_train, Y_test = data
+        for option in options:
+            runs = {}
+            for solver in ['pgd', 'fista'] + (['lbfgs'] if option == 'filter' else []):
+                np.random.seed(1)
+                with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                    model = SDL_BCD(X=[X_train, Y_train], X_test=[X_test, Y_test], n_components=n_components, xi=1)
+                    result = model.fit(iter=iter if solver != 'lbfgs' else lbfgs_iter, option=option,
+                                       search_radius_const=iter * np.sqrt(sq_norm(X_train)),
+                                       if_compute_recons_error=True, solver=solver)
+                runs[solver] = (result.get('time_error'), result.get('Accuracy'))
+            best = min(model.xi * time_error[1][-1] + time_error[2][-1] for time_error, _ in runs.values())
+            print('  %s (%s): X %s, best final loss %.6e' % (data_type, option, X_train.shape, best))
+            for solver, (time_error, accuracy) in runs.items():
+                times = ['%7.3fs' % time_to_target(time_error, model.xi, (1 + gap) * best) for gap in rel_gaps]
+                print('    %-6s time to loss within %s: %s  (final loss %.6e, total %.3fs, test accuracy %.3f)' %
+                      (solver, '/'.join('%g' % gap for gap in rel_gaps), ' '.join(times),
+                       model.xi * time_error[1][-1] + time_error[2][-1], time_error[0][-1], accuracy))
+
+
+def benchmark_feature_code_step(data_types=['simulation', 'MNIST', 'fakejob'], n_components=10, iter=20, n_max=100000,
+                                rel_gaps=[1e-2, 3e-3, 1e-3]):
+    '''
+    Time to target training loss of feature-mode SDL_BCD.fit with the code/beta block solved by the Newton beta fit
+    and the subsampled row-wise code step (code_update_mode='row', default), the full-gradient block code step
+    ('block') or the stochastic variance-reduced solver ('svrg', kernels.svrg_code_beta).
+    Targets are the best final loss of the runs times 1 + rel_gap; uses at most n_max samples of each data set.
+    '''
+    print('feature-mode code/beta step: time to target loss (r=%i, %i iterations)' % (n_components, iter))
+    for data_type in data_types:
+        if data_type == 'simulation':
+            data = sim_data(p=100, r=n_components, n=n_max, test_size=0.2)
+        else:
+            data = load_data(data_type, n_max=n_max)
+        if data is None:
+            continue
+        X_train, X_test, Y_train, Y_test = data
+        runs = {}
+        for mode in ['row', 'block', 'svrg']:
+            np.random.seed(1)
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                model = SDL_BCD(X=[X_train, Y_train], X_test=[X_test, Y_test], n_components=n_components, xi=1)
+                result = model.fit(iter=iter, option='feature', search_radius_const=iter * np.sqrt(sq_norm(X_train)),
+                                   if_compute_recons_error=True, code_update_mode=mode)
+            runs[mode] = (result.get('time_error'), result.get('Accuracy'))
+        best = min(model.xi * time_error[1][-1] + time_error[2][-1] for time_error, _ in runs.values())
+        print('  %s: X %s, best final loss %.6e' % (data_type, X_train.shape, best))
+        for mode, (time_error, accuracy) in runs.items():
+            times = ['%7.3fs' % time_to_target(time_error, model.xi, (1 + gap) * best) for gap in rel_gaps]
+            print('    %-6s time to loss within %s: %s  (final loss %.6e, total %.3fs, test accuracy %.3f)' %
+                  (mode, '/'.join('%g' % gap for gap in rel_gaps), ' '.join(times),
+                   model.xi * time_error[1][-1] + time_error[2][-1], time_error[0][-1], accuracy))
+
+
+def benchmark_parallel(n_jobs_list=[1, 2, 4, 8], p=500, r=10, n=200000, iter=10):
+    '''
+    Time per iteration of SDL_BCD.fit with n_jobs worker processes (fit_parallel) against one process, for both
+    SDL options on the simulation data (code_update_mode='block', so that the runs are deterministic and the final
+    training losses must agree).
+    '''
+    X_train, X_test, Y_train, Y_test = sim_data(p=p, r=r, n=n, test_size=0.2)
+    print('data-parallel fit: X %s, r=%i, %i iterations, %i CPUs' % (X_train.shape, r, iter, os.cpu_count()))
+    for option in ['filter', 'feature']:
+        for n_jobs in n_jobs_list:
+            np.random.seed(1)
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                model = SDL_BCD(X=[X_train, Y_train], X_test=[X_test, Y_test], n_components=r, xi=1)
+                t0 = time.time()
+                result = model.fit(iter=iter, option=option, search_radius_const=iter * np.sqrt(sq_norm(X_train)),
+                                   if_compute_recons_error=True, code_update_mode='block', n_jobs=n_jobs)
+                t = time.time() - t0
+            time_error = result.get('time_error')
+            print('  %-7s n_jobs=%i: %.3fs per iteration (total with start-up %.2fs), final loss %.6e' %
+                  (option, n_jobs, time_error[0][-1] / iter, t, model.xi * time_error[1][-1] + time_error[2][-1]))
+
+
+def benchmark_admm(n_jobs=4, rho_list=[10, 100, 1000], p=500, r=10, n=200000, iter=10, local_iter=5, address=None):
+    '''
+    Consensus ADMM fit (SDL_BCD.fit_admm, iter communication rounds of local_iter local iterations on n_jobs shards)
+    against the per-iteration all-reduce fit (fit_parallel, iter iterations) on the simulation data.
+    address = (host, port) runs the workers over local sockets instead of shared memory.
+    '''
+    X_train, X_test, Y_train, Y_test = sim_data(p=p, r=r, n=n, test_size=0.2)
+    print('consensus ADMM: X %s, r=%i, %i rounds x %i local iterations, %i shards' % (X_train.shape, r, iter, local_iter, n_jobs))
+    for option in ['filter', 'feature']:
+        for rho in [None] + rho_list:
+            np.random.seed(1)
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                model = SDL_BCD(X=[X_train, Y_train], X_test=[X_test, Y_test], n_components=r, xi=1)
+                t0 = time.time()
+                if rho is None:
+                    result = model.fit(iter=iter, option=option, search_radius_const=iter * np.sqrt(sq_norm(X_train)),
+                                       if_compute_recons_error=True, code_update_mode='block', n_jobs=n_jobs)
+                else:
+                    result = model.fit_admm(iter=iter, option=option, local_iter=local_iter, rho=rho,
+                                            search_radius_const=iter * np.sqrt(sq_norm(X_train)),
+                                            if_compute_recons_error=True, n_jobs=n_jobs, address=address)
+                t = time.time() - t0
+            time_error = result.get('time_error')
+            print('  %-7s %-14s %.2fs, relative reconstruction error %.4f, accuracy %.3f' %
+                  (option, 'all-reduce' if rho is None else 'ADMM rho=%g' % rho, t,
+                   time_error[1][-1] / sq_norm(X_train), result.get('Accuracy')))
+
+
+def benchmark_svp_factored(p=2000, r=5, n=3300, iter=20, density=0.05):
+    '''
+    SDL_SVP.fit with B = W H stored dense against factored=True (rank-r factors, no p x n buffers besides X):
+    time per step, peak traced memory (excluding the data; includes the final validation on a small test set)
+    and final training loss, for both SDL options, with X dense and with a CSR X of the given density.
+    '''
+    X_train, X_test, Y_train, Y_test = sim_data(p=p, r=r, n=n, test_size=0.1)
+    X_train, X_test = X_train / 10, X_test / 10
+    mask = np.random.RandomState(1).rand(*X_train.shape) < density
+    X_csr = sp.csr_matrix(X_train * mask)
+    print('SDL_SVP dense vs factored B: X %s, r=%i, %i steps (X is %.1f MB, CSR X with density %.2f is %.1f MB)' %
+          (X_train.shape, r, iter, X_train.nbytes / 2**20, density,
+           (X_csr.data.nbytes + X_csr.indices.nbytes + X_csr.indptr.nbytes) / 2**20))
+    for X_name, X in [('dense', X_train), ('csr', X_csr)]:
+        for option in ['filter', 'feature']:
+            for factored in [False, True]:
+                with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                    def fit():
+                        np.random.seed(1)
+                        model = SDL_SVP(X=[X, Y_train], X_test=[X_test, Y_test], n_components=r, xi=1)
+                        return model.fit(iter=iter, beta=0, nu=0, search_radius_const=0.01, SDL_option=option,
+                                         if_compute_recons_error=True, factored=factored,
+                                         prediction_method_list=['filter' if option == 'filter' else 'naive'])
+                    result, t, peak = profile(fit, n_repeat=1)
+                time_error = result.get('time_error')
+                print('  X %-5s %-7s factored=%-5s %.4fs per step, peak alloc %7.1f MB, final loss %.8e' %
+                      (X_name, option, factored, time_error[0][-1] / iter, peak,
+                       result.get('xi') * time_error[1][-1] + time_error[2][-1]))
+
+
+def benchmark_svp_solver(p=500, r=5, n=2000, iter=200):
+    '''
+    SDL_SVP.fit with the fixed step size schedule (solver='pgd') against accelerated projected gradient with
+    backtracking and restart (solver='apg', factored B): steps and time until the final training loss of the
+    pgd run is reached, for both SDL options.
+    '''
+    X_train, X_test, Y_train, Y_test = sim_data(p=p, r=r, n=n, test_size=0.5)
+    X_train, X_test = X_train / 10, X_test / 10
+    print('SDL_SVP pgd vs apg: X %s, r=%i, at most %i steps' % (X_train.shape, r, iter))
+    for option in ['filter', 'feature']:
+        results = {}
+        for solver in ['pgd', 'apg']:
+            np.random.seed(1)
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                model = SDL_SVP(X=[X_train, Y_train], X_test=[X_test, Y_test], n_components=r, xi=1)
+                results[solver] = model.fit(iter=iter, beta=0, nu=0, search_radius_const=0.01 if solver == 'pgd' else 0.1,
+                                            SDL_option=option, if_compute_recons_error=True, solver=solver,
+                                            factored=(solver == 'apg'),
+                                            prediction_method_list=['filter' if option == 'filter' else 'naive'])
+        target = results['pgd']['time_error'][1][-1] + results['pgd']['time_error'][2][-1]
+        for solver, result in results.items():
+            time_error = result['time_error']
+            loss = time_error[1] + time_error[2]
+            reached = np.nonzero(loss <= target)[0]
+            print('  %-7s %s: %4s steps, %.2fs to the pgd loss %.4e (final %.4e after %i steps), accuracy %.3f' %
+                  (option, solver, reached[0] + 1 if len(reached) > 0 else '-', time_to_target(time_error, 1, target),
+                   target, loss[-1], len(loss), result.get('Accuracy (filter)' if option == 'filter' else 'Accuracy (naive)')))
+
+
+def main():
+    benchmark_code_update()
+    benchmark_chunked_code_update()
+    benchmark_objective()
+    benchmark_logistic_grad()
+    benchmark_sparse_code()
+    benchmark_svp_projection()
+    benchmark_code_step()
+    benchmark_solver()
+    benchmark_feature_code_step()
+    benchmark_parallel()
+    benchmark_admm()
+    benchmark_svp_factored()
+    benchmark_svp_solver()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,8 @@ import pandas as pd
 
 from tqdm import trange
 import matplotlib.pyplot as plt
-from src.SNMF import SNMF, update_code_within_radius
+from src.SNMF import SNMF, update_code_within_radius, safe_vstack
+from src.kernels import sq_norm, recons_error
 from src.LMF import LMF
 from src.SDL_SVP import SDL_SVP
 
@@ -13,6 +14,7 @@ from sklearn.model_selection import train_test_split
 from sklearn.model_selection import StratifiedKFold
 from sklearn.linear_model import LogisticRegression
 from scipy.interpolate import interp1d
+import scipy.sparse as sp
 
 import matplotlib.gridspec as gridspec
 from mpl_toolkits.axes_grid1 import make_axes_locatable
@@ -60,7 +62,7 @@ def coding(X, W, H0,
         idx = np.random.randint(X.shape[1], size=X.shape[1]//subsample_ratio)
     A = W.T @ W ## Needed for gradient computation
 
-    grad = W.T @ (W @ H0 - X)
+    grad = A @ H0 - W.T @ X  # = W.T @ (W @ H0 - X), also for scipy.sparse X
     while (i < np.random.choice(sub_iter)):
         step_size = (1 / (((i + 1) ** (1)) * (np.trace(A) + 1)))
         H1 -= step_size * grad
@@ -250,8 +252,8 @@ def run_methods(data,
     if "LR" in methods_list:
 
         if data_aux is not None:
-            X0_train = np.vstack([covariate_train, X_train])
-            X0_test = np.vstack([covariate_test, X_test])
+            X0_train = safe_vstack([covariate_train, X_train])
+            X0_test = safe_vstack([covariate_test, X_test])
             print('X0_train.T.shape', X0_train.T.shape)
             clf = LogisticRegression(random_state=0).fit(X0_train.T, Y_train[0,:])
             P_train = clf.predict_proba(X0_train.T)
@@ -309,9 +311,9 @@ def run_methods(data,
 
             coder = SparseCoder(dictionary=W.T, transform_n_nonzero_coefs=None,
                                     transform_alpha=0, transform_algorithm='lasso_lars', positive_code=True)
-            H1 = coder.transform(X_test.T).T
-            error_data = np.linalg.norm((X_test - W @ H1).reshape(-1, 1), ord=2)**2
-            rel_error_data = error_data / np.linalg.norm(X_test.reshape(-1, 1), ord=2)**2
+            H1 = coder.transform(X_test.toarray().T if sp.issparse(X_test) else X_test.T).T  # SparseCoder needs dense input
+            error_data = recons_error(X_test, W, H1)
+            rel_error_data = error_data / sq_norm(X_test)
             results.update({'Relative_reconstruction_loss (test)': rel_error_data})
             results.update({'xi': None})
             results.update({'beta': None})
@@ -361,7 +363,7 @@ def run_methods(data,
 
                     results_dict_new = SNMF_class_new.train_logistic(iter=iteration, subsample_size=None,
                                                             beta = beta,
-                                                            search_radius_const=iteration*np.linalg.norm(X_train),
+                                                            search_radius_const=iteration*np.sqrt(sq_norm(X_train)),
                                                             update_nuance_param=False,
                                                             if_compute_recons_error=True, if_validate=False)
 
@@ -415,7 +417,7 @@ def run_methods(data,
 
                     results_dict_new = LMF_class_new.train_logistic(iter=iteration, subsample_size=None,
                                                             beta = beta,
-                                                            search_radius_const=iteration*np.linalg.norm(X_train),
+                                                            search_radius_const=iteration*np.sqrt(sq_norm(X_train)),
                                                             fine_tune_beta=True,
                                                             update_nuance_param=False,
                                                             prediction_method_list = prediction_method_list,
@@ -434,6 +436,11 @@ def run_methods(data,
                         np.save(save_path, results_dict_list)
 
 
+    # SDL_SVP works on dense arrays
+    X_train_dense, X_test_dense = X_train, X_test
+    if sp.issparse(X_train) and (("SDL-conv-filt" in methods_list) or ("SDL-conv-feat" in methods_list)):
+        X_train_dense, X_test_dense = X_train.toarray(), X_test.toarray()
+
     # SDL_SVP_filter
     if "SDL-conv-filt" in methods_list:
         data_scale=10
@@ -443,8 +450,8 @@ def run_methods(data,
             for i in range(iter_avg):
                 print("SDL-conv-filt..")
                 if data_aux is not None:
-                    SDL_SVP_class = SDL_SVP(X=[X_train/data_scale, Y_train],  # data, label
-                        X_test=[X_test/data_scale, Y_test],
+                    SDL_SVP_class = SDL_SVP(X=[X_train_dense/data_scale, Y_train],  # data, label
+                        X_test=[X_test_dense/data_scale, Y_test],
                         X_auxiliary = covariate_train/data_scale,
                         X_test_aux = covariate_test/data_scale,
                         n_components=r,  # =: r = number of columns in dictionary matrices W, W'
@@ -457,8 +464,8 @@ def run_methods(data,
 
 
                 else:
-                    SDL_SVP_class = SDL_SVP(X=[X_train/data_scale, Y_train],  # data, label
-                                            X_test=[X_test/data_scale, Y_test],
+                    SDL_SVP_class = SDL_SVP(X=[X_train_dense/data_scale, Y_train],  # data, label
+                                            X_test=[X_test_dense/data_scale, Y_test],
                                             #X_auxiliary = covariate_train/data_scale,
                                             #X_test_aux = covariate_test/data_scale,
                                             n_components=r,  # =: r = number of columns in dictionary matrices W, W'
@@ -498,8 +505,8 @@ def run_methods(data,
                 print("SDL-conv-feat..")
                 data_scale=500
                 if data_aux is not None:
-                    SDL_SVP_class = SDL_SVP(X=[X_train/data_scale, Y_train],  # data, label
-                                            X_test=[X_test/data_scale, Y_test],
+                    SDL_SVP_class = SDL_SVP(X=[X_train_dense/data_scale, Y_train],  # data, label
+                                            X_test=[X_test_dense/data_scale, Y_test],
                                             X_auxiliary = covariate_train/data_scale,
                                             X_test_aux = covariate_test/data_scale,
                                             n_components=r,  # =: r = number of columns in dictionary matrices W, W'
@@ -510,8 +517,8 @@ def run_methods(data,
                                             L1_reg = [0,0,0], # L1 regularizer for code H, dictionary W[0], reg param W[1]
                                             L2_reg = [0,0,0]) # L2 regularizer for code H, dictionary W[0], reg param W[1]
                 else:
-                    SDL_SVP_class = SDL_SVP(X=[X_train/data_scale, Y_train],  # data, label
-                                            X_test=[X_test/data_scale, Y_test],
+                    SDL_SVP_class = SDL_SVP(X=[X_train_dense/data_scale, Y_train],  # data, label
+                                            X_test=[X_test_dense/data_scale, Y_test],
                                             #X_auxiliary = covariate_train/data_scale,
                                             #X_test_aux = covariate_test/data_scale,
                                             n_components=r,  # =: r = number of columns in dictionary matrices W, W'
@@ -965,7 +972,7 @@ def main(data_type = "MNIST",
             print('Y.shape', Y.shape)
 
             text = text.values
-            text = text - np.min(text) # word frequency array
+            text = sp.csr_matrix(text - np.min(text)) # sparse word frequency array
             print('text.shape', text.shape) # words x docs
 
             covariate = others.get(others.keys()[2])
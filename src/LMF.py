@@ -15,9 +15,11 @@ from sklearn.metrics import precision_recall_curve
 from sklearn.metrics import accuracy_score
 from sklearn.metrics import confusion_matrix
 import scipy.sparse as sp
-from sklearn.decomposition import SparseCoder
 from sklearn.linear_model import LogisticRegression
 from scipy.linalg import block_diag
+from src.kernels import update_code_joint_logistic, radius_scale, scale_toward, update_code_within_radius
+from src.kernels import fit_logistic_newton, sq_norm, recons_error, as_dtype, logistic_loss_grad, sigmoid
+from src.kernels import sparse_code_batched
 
 
 
@@ -53,22 +55,27 @@ class LMF():
                  L1_reg=[0,0,0], # L1 regularizer for code H, dictioanry W[0], and regression params W[1]
                  L2_reg=[0,0,0], # L2 regularizer for code H, dictioanry W[0], and regression params W[1]
                  nonnegativity=[True,True,False], # nonnegativity constraints on code H, dictionary W[0], reg params W[1]
-                 full_dim=False): # if true, dictionary matrix W[0] is Id with size d1 x d1 -- no dimension reduction
+                 full_dim=False, # if true, dictionary matrix W[0] is Id with size d1 x d1 -- no dimension reduction
+                 dtype=np.float64): # floating point type of data, loading, code and all intermediates (e.g. np.float32)
 
-        self.X = X
+        self.dtype = dtype
+        self.X = [as_dtype(X[0], dtype), as_dtype(X[1], dtype)]
+        X_auxiliary = as_dtype(X_auxiliary, dtype)
         self.X_auxiliary = X_auxiliary
         self.d3 = 0 # auxiliary data dim
         self.nonnegativity = nonnegativity
         if X_auxiliary is not None:
             self.d3 = X_auxiliary.shape[0]
 
+        if X_test is not None:
+            X_test = [as_dtype(X_test[0], dtype), as_dtype(X_test[1], dtype)]
         self.X_test = X_test
-        self.X_test_aux = X_test_aux
+        self.X_test_aux = as_dtype(X_test_aux, dtype)
         self.n_components = n_components
         self.iterations = iterations
-        self.ini_code = ini_code
+        self.ini_code = as_dtype(ini_code, dtype)
         if ini_code is None:
-            self.ini_code = np.random.rand(n_components, X[0].shape[1])
+            self.ini_code = np.random.rand(n_components, X[0].shape[1]).astype(dtype)
 
         self.loading = ini_loading
         if ini_loading is None:
@@ -77,12 +84,13 @@ class LMF():
             r = n_components
             self.loading = [np.random.rand(X[0].shape[0], r), np.random.rand(X[1].shape[0], r + 1 + self.d3)]  # additional first column for constant terms in Logistic Regression
             # add additional d3 columns of regression coefficients for the auxiliary variables
+        self.loading = [as_dtype(W, dtype) for W in self.loading]
         print('initial loading beta', self.loading[1])
 
         self.xi = xi
         self.L1_reg = L1_reg
         self.L2_reg = L2_reg
-        self.code = np.zeros(shape=(n_components, X[0].shape[1]))
+        self.code = np.zeros(shape=(n_components, X[0].shape[1]), dtype=dtype)
         self.full_dim = full_dim
         self.result_dict = {}
         self.result_dict.update({'xi' : self.xi})
@@ -92,7 +100,7 @@ class LMF():
         self.result_dict.update({'n_components' : self.n_components})
 
 
-    def sparse_code(self, X, W, sparsity=0):
+    def sparse_code(self, X, W, sparsity=0, H0=None):
         # Same function as OMF
 
         '''
@@ -102,6 +110,7 @@ class LMF():
         args:
             X (numpy array): data matrix with dimensions: features (d) x samples (n)
             W (numpy array): dictionary matrix with dimensions: features (d) x topics (r)
+            H0 (numpy array): warm start for the code (e.g. the code of the previous iteration)
 
         returns:
             H (numpy array): code matrix with dimensions: topics (r) x samples(n)
@@ -114,21 +123,17 @@ class LMF():
             print('X.shape:', X.shape)
             print('W.shape:', W.shape, '\n')
 
-        # initialize the SparseCoder with W as its dictionary
-        # then find H such that X \approx W*H
-        coder = SparseCoder(dictionary=W.T, transform_n_nonzero_coefs=None,
-                            transform_alpha=sparsity, transform_algorithm='lasso_lars', positive_code=True)
-        # alpha = L1 regularization parameter.
-        H = coder.transform(X.T)
+        # find H >= 0 such that X \approx W*H, with the same objective as SparseCoder(lasso_lars)
+        # alpha = L1 regularization parameter. All columns share the Gram matrix W.T @ W (dense or sparse X).
+        H = sparse_code_batched(X, W, alpha=sparsity, H0=H0, nonnegativity=True)
 
-        # transpose H before returning to undo the preceding transpose on X
         #print('!!! sparse_code: Start')
-        return H.T
+        return H.astype(W.dtype, copy=False)
 
 
-    def update_beta_logistic(self, Y, W0, H, r, a1=0, sub_iter=2, stopping_diff=0.1, nonnegativity=True, history=1):
+    def update_beta_logistic(self, Y, W0, H, r, a1=0, sub_iter=2, stopping_diff=0.1, nonnegativity=True, history=1, radius_norm='spectral'):
         '''
-        Y = (p' x n), W = (p' x (r+1)), H = (r' x n), H' = np.vstack((np.ones(n), H))
+        Y = (p' x n), W = (p' x (r+1)), H = (r' x n), H' = np.vstack((np.ones(n, dtype=self.dtype), H))
         W0 = [W_beta  W_beta_aux]
         H = [H               ]
             [self.X_auxiliary]
@@ -136,33 +141,45 @@ class LMF():
         MLE -->
         Find \hat{W} = argmin_W ( sum_j ( log(1+exp(W H_j) ) - Y (W H).T ) ) within radius r from W0
         Use row-wise projected gradient descent
+        radius_norm = 'spectral' (default), 'fro' or 'row' : norm in which the radius r is measured (see kernels.radius_scale)
         '''
 
         d1 = self.X[0].shape[0] # data dim
-        H = np.vstack((np.ones(Y.shape[1]), H))
+        H = np.vstack((np.ones(Y.shape[1], dtype=self.dtype), H))
 
         if self.d3 > 0:
             H = np.vstack((H, self.X_auxiliary)) # add additional rows for the auxiliary explanatory variables
 
         A = H @ H.T
 
-        P = 1/(1+np.exp(-W0 @ H))  # probability matrix, same shape as Y
+        _, P, grad_W = logistic_loss_grad(W0, H, Y, compute_loss=False)  # P = probability matrix, same shape as Y
 
         W1 = W0.copy()
+        W_center = W0
+        row_dist = np.zeros(W1.shape[0], dtype=W1.dtype)  # squared distances |W1[k] - W_center[k]|^2 for radius_norm='fro'
         i = history
         dist = 1
         while (i < sub_iter) and (dist > stopping_diff):
             # W1_old = W1.copy()
             for k in np.arange(W0.shape[0]):
-                grad = H @ (P[k,:] - Y[k,:]).T + a1 * np.ones(W0.shape[1])
+                grad = grad_W[k, :] + a1  # = H @ (P[k,:] - Y[k,:]).T + a1
                 # H1[k, :] = H1[k,:] - (1 / (A[k, k] + np.linalg.norm(grad, 2))) * grad
                 W1[k, :] = W1[k, :] - (1 / (((i + 10) ** (0.5)) * (A[k, k] + 1))) * grad
                 if nonnegativity:
-                    W1[k, :] = np.maximum(W1[k, :], np.zeros(shape=(W1.shape[1],)))  # nonnegativity constraint
+                    W1[k, :] = np.maximum(W1[k, :], 0)  # nonnegativity constraint
 
                 if r is not None:  # usual sparse coding without radius restriction
-                    d = np.linalg.norm(W1 - W0, 2)
-                    W1 = W0 + (r / max(r, d)) * (W1 - W0)
+                    if radius_norm == 'spectral':
+                        d = np.linalg.norm(W1 - W0, 2)
+                        W1 = W0 + (r / max(r, d)) * (W1 - W0)
+                    elif radius_norm == 'fro':
+                        row_dist[k] = np.sum((W1[k, :] - W_center[k, :]) ** 2)
+                        c = radius_scale(np.sqrt(np.sum(row_dist)), r)
+                        if c < 1:
+                            scale_toward(W1, W_center, c)
+                            row_dist *= c ** 2
+                    elif radius_norm == 'row':
+                        scale_toward(W1[k, :], W_center[k, :], radius_scale(np.linalg.norm(W1[k, :] - W_center[k, :]), r))
                 W0 = W1
 
             # dist = np.linalg.norm(W1 - W1_old, 2) / np.linalg.norm(W1_old, 2)
@@ -198,14 +215,14 @@ class LMF():
         while (i < sub_iter) and (dist > stopping_diff):
             H1_old = H1.copy()
 
-            H1_ext = np.vstack((np.ones(X[0].shape[1]), H1_old))
+            H1_ext = np.vstack((np.ones(X[0].shape[1], dtype=self.dtype), H1_old))
             if self.X_auxiliary is not None:
                 H1_ext = np.vstack((H1_ext, self.X_auxiliary[:,:]))
                 # add additional rows for the auxiliary explanatory variables
 
             # P = probability matrix, same shape as X1
             D = W[1] @ H1_ext # (d2 x (r+1)) x ((r+1) x n) = (d2 x n)
-            P = 1 / (1 + np.exp(-D))
+            P = sigmoid(D)
 
             if not self.full_dim:
                 grad_MF = W[0].T @ (W[0] @ H1 - X[0])
@@ -240,67 +257,28 @@ class LMF():
                                    a1=0, a2=0, sub_iter=2,
                                    stopping_diff=0.1, nonnegativity=True,
                                    xi = 0,
-                                   subsample_size=None):
+                                   subsample_size=None,
+                                   mode='row',
+                                   radius_norm='spectral'):
         '''
         X = [X0, X1]
         W = [W0, W1+W2]
         Find \hat{H} = argmin_H ( xi * || X0 - W0 H||^2 + alpha|H| + Logistic_Loss(X1, [W1|W2], H)) within radius r from H0
-        Use row-wise projected gradient descent
+        mode = 'row' : row-wise projected gradient descent
+        mode = 'block' : projected gradient descent on all rows of H at once
+        radius_norm = 'spectral' (default), 'fro' or 'row' : norm in which the radius r is measured (see kernels.radius_scale)
         '''
 
-        if H0 is None:
-            H0 = np.random.rand(W[0].shape[1], X[0].shape[1])
-            # print('!!! H0.shape', H0.shape)
-
-        if not self.full_dim:
-            A = W[0].T @ W[0]
-            B = W[0].T @ X[0]
-
-        H1 = H0.copy()
-        i = 0
-        dist = 1
-        idx = np.arange(X[0].shape[1])
-        while (i < sub_iter) and (dist > stopping_diff):
-            H1_old = H1.copy()
-            for k in np.arange(H1.shape[0]):
-                if subsample_size is not None:
-                    idx = np.random.randint(X[0].shape[1], size=subsample_size)
-
-                H1_ext = np.vstack((np.ones(len(idx)), H1[:,idx]))
-                if self.X_auxiliary is not None:
-                    H1_ext = np.vstack((H1_ext, self.X_auxiliary[:,idx]))
-                    # add additional rows for the auxiliary explanatory variables
-
-                # P = probability matrix, same shape as X1
-                D = W[1] @ H1_ext
-                P = 1 / (1 + np.exp(-D))
-
-                if self.full_dim:
-                    grad = np.diag(W[1][:,k]) @ (P-X[1][:,idx])
-                    H1[k, idx] = H1[k, idx] - (1 / (((i + 10) ** (0.5)) * (0 + 1))) * grad
-                else:
-                    grad_MF = (np.dot(A[k, :], H1[:,idx]) - B[k, idx])
-                    #print('W[1].shape', W[1].shape)
-                    grad_pred = np.diag(W[1][:,k+1]) @ (P-X[1][:,idx])
-                    grad =  xi * grad_MF + grad_pred + a1 * np.sign(H1[k,idx])*np.ones(len(idx)) + a2 * H1[k, idx]
-                    H1[k, idx] = H1[k, idx] - (1 / (((i + 10) ** (0.5)) * (A[k, k] + 1))) * grad
-
-                if nonnegativity:
-                    H1[k, idx] = np.maximum(H1[k, idx], np.zeros(shape=(len(idx),)))  # nonnegativity constraint
-
-                if r is not None:  # usual sparse coding without radius restriction
-                    d = np.linalg.norm(H1 - H0, 2)
-                    H1 = H0 + (r / max(r, d)) * (H1 - H0)
-                H0 = H1
-
-            dist = np.linalg.norm(H1 - H1_old, 2) / np.linalg.norm(H1_old, 2)
-            # print('!!! dist', dist)
-            # H1_old = H1
-            i = i + 1
-            # print('!!!! i', i)  # mostly the loop finishes at i=1 except the first round
-
-
-        return H1
+        return update_code_joint_logistic(X, W, H0, r,
+                                          X_auxiliary=self.X_auxiliary,
+                                          a1=a1, a2=a2, sub_iter=sub_iter,
+                                          stopping_diff=stopping_diff,
+                                          nonnegativity=nonnegativity,
+                                          xi=xi,
+                                          subsample_size=subsample_size,
+                                          full_dim=self.full_dim,
+                                          mode=mode,
+                                          radius_norm=radius_norm)
 
 
     def update_code_joint_logistic_old(self, X, W, H0, r, sub_iter=2, a1=0, a2=0, nonnegativity=True, stopping_grad_ratio=0.01, subsample_size=None):
@@ -331,14 +309,14 @@ class LMF():
                 if subsample_size is not None:
                     idx = np.random.randint(X[0].shape[1], size=subsample_size)
 
-                H1_ext = np.vstack((np.ones(len(idx)), H1[:,idx]))
+                H1_ext = np.vstack((np.ones(len(idx), dtype=self.dtype), H1[:,idx]))
                 if self.X_auxiliary is not None:
                     H1_ext = np.vstack((H1_ext, self.X_auxiliary[:,idx]))
                     # add additional rows for the auxiliary explanatory variables
 
                 # P = probability matrix, same shape as X1
                 D = W[1] @ H1_ext
-                P = 1 / (1 + np.exp(-D))
+                P = sigmoid(D)
 
                 if self.full_dim:
                     grad = np.diag(W[1][:,k]) @ (P-X[1][:,idx])
@@ -390,11 +368,11 @@ class LMF():
             # print('!!! W[1].shape', W[1].shape)
 
             W_stacked = np.vstack((W[0], np.sqrt(self.xi) * W[1]))
-            H = self.sparse_code(X_stacked, W_stacked, sparsity=self.a1)
+            H = self.sparse_code(X_stacked, W_stacked, sparsity=self.a1, H0=H if step > 0 else None)
 
             # Fix H and find W = [dict, beta]
-            W[0] = self.sparse_code(X[0].T, H.T, sparsity=0).T
-            W[1] = self.sparse_code(X[1].T, H.T, sparsity=self.a2).T
+            W[0] = self.sparse_code(X[0].T, H.T, sparsity=0, H0=W[0].T if step > 0 else None).T
+            W[1] = self.sparse_code(X[1].T, H.T, sparsity=self.a2, H0=W[1].T if step > 0 else None).T
 
             end = time.time()
             elapsed_time += end - start
@@ -427,15 +405,22 @@ class LMF():
                         update_nuance_param=False,
                         if_validate=False,
                         prediction_method_list = ["naive", "exhaustive"],
-                        fine_tune_beta=True):
+                        fine_tune_beta=True,
+                        code_update_mode='row',
+                        radius_norm='spectral'):
         '''
         Given input X = [data, label] and initial loading dictionary W_ini, find W = [dict, beta] and code H
         by two-block coordinate descent: [dict, beta] --> H, H--> [dict, beta]
         Use Logistic MF model
+        code_update_mode = 'row' or 'block' : row-wise or all-rows-at-once code update
+        radius_norm = 'spectral' (default), 'fro' or 'row' : norm of the code search radius (see kernels.radius_scale)
+        if_compute_recons_error = True logs the training loss [time, data, label] in time_error every iteration
+        (see kernels.recons_error); AUC and early stopping every 20 iterations
         '''
         X = self.X
         r = self.n_components
         n = X[0].shape[1]
+        X_sq = sq_norm(X[0])
 
         #H = np.random.rand(r, n)
         #W = [np.random.rand(X[0].shape[0], r), np.random.rand(X[1].shape[0], r + 1 + self.d3)]  # additional first column for constant terms in Logistic Regression
@@ -445,7 +430,7 @@ class LMF():
 
         if self.full_dim:
             r = X[0].shape[0]
-            W = [1, np.random.rand(X[1].shape[0], r + 1 + self.d3)] # don't use np.identity(r) for efficient computation
+            W = [1, np.random.rand(X[1].shape[0], r + 1 + self.d3).astype(self.dtype)] # don't use np.identity(r) for efficient computation
             H = X[0]
 
         time_error = np.zeros(shape=[0, 3])
@@ -455,7 +440,7 @@ class LMF():
         for step in trange(int(iter)):
             start = time.time()
             if beta is not None:
-                search_radius = search_radius_const * (float(step + 1)) ** (-beta) / np.log(float(step + 2))
+                search_radius = float(search_radius_const * (float(step + 1)) ** (-beta) / np.log(float(step + 2)))
             else:
                 search_radius = None
 
@@ -475,12 +460,10 @@ class LMF():
 
 
                 # Beta
-                H1 = H.copy()
+                H1 = H
                 if self.X_auxiliary is not None:
                     H1 = np.vstack((H, self.X_auxiliary[:,:]))
-                clf = LogisticRegression(random_state=0).fit(H1.T, self.X[1][0,:])
-                W[1][0,1:] = clf.coef_[0]
-                W[1][0,0] = clf.intercept_[0]
+                W[1] = fit_logistic_newton(self.X[1], H1, W[1])  # warm start from the previous beta
 
                 # H
                 H = self.update_code_joint_logistic(X, W, H, r=search_radius,
@@ -489,11 +472,13 @@ class LMF():
                                                     sub_iter=2,
                                                     stopping_diff=0.0001,
                                                     nonnegativity=self.nonnegativity[0],
-                                                    subsample_size=int(X[0].shape[1]//10))
+                                                    subsample_size=int(X[0].shape[1]//10) if code_update_mode == 'row' else None,
+                                                    mode=code_update_mode,
+                                                    radius_norm=radius_norm)
 
 
             if update_nuance_param:
-                self.xi = (1/(2*r*n)) * np.linalg.norm((X[0] - W[0] @ H).reshape(-1, 1), ord=2)**2
+                self.xi = (1/(2*r*n)) * recons_error(X[0], W[0], H, X_sq=X_sq)
                 print('xi updated by MLE:', self.xi)
 
             end = time.time()
@@ -512,23 +497,24 @@ class LMF():
 
             #print('W[0] norm', np.linalg.norm(W[0]))
 
-            if (step % 20) == 0:
-                if if_compute_recons_error:
-                    # print the error every 50 iterations
-                    if self.full_dim:
-                        error_data = np.linalg.norm((X[0] - H).reshape(-1, 1), ord=2) ** 2
-                    else:
-                        error_data = np.linalg.norm((X[0] - W[0] @ H).reshape(-1, 1), ord=2) ** 2
+            if if_compute_recons_error:
+                # training loss every iteration without forming the (d x n) residual
+                if self.full_dim:
+                    error_data = np.linalg.norm((X[0] - H).reshape(-1, 1), ord=2) ** 2
+                else:
+                    error_data = recons_error(X[0], W[0], H, X_sq=X_sq)
 
-                    H_ext = np.vstack((np.ones(X[1].shape[1]), H))
-                    if self.d3>0:
-                        H_ext = np.vstack((H_ext, self.X_auxiliary))
+                H_ext = np.vstack((np.ones(X[1].shape[1], dtype=self.dtype), H))
+                if self.d3>0:
+                    H_ext = np.vstack((H_ext, self.X_auxiliary))
+                error_label, P_pred, _ = logistic_loss_grad(W[1], H_ext, X[1], compute_grad=False)
+                total_error_new = error_label + self.xi * error_data
 
-                    #print('H_ext.shape', H_ext.shape)
-                    #print('W[1].shape', W[1].shape)
+                time_error = np.append(time_error, np.array([[elapsed_time, error_data, error_label]]), axis=0)
+                self.result_dict.update({'time_error': time_error.T})
 
-                    P_pred = np.matmul(W[1], H_ext)
-                    P_pred = 1 / (np.exp(-P_pred) + 1)
+            if (step % 20) == 0:
+                if if_compute_recons_error:
                     # print('!!! error norm', np.linalg.norm(X[1][0, :]-P_pred[0,:])/X[1].shape[1])
                     fpr, tpr, thresholds = metrics.roc_curve(X[1][0, :], P_pred[0,:], pos_label=None)
                     mythre = thresholds[np.argmax(tpr - fpr)]
@@ -538,14 +524,7 @@ class LMF():
                     self.result_dict.update({'AUC (training)': myauc})
 
                     print('--- Training --- [threshold, AUC] = ', [np.round(mythre,3), np.round(myauc,3)])
-                    error_label = np.sum(np.log(1+np.exp(W[1] @ H_ext))) - X[1] @ (W[1] @ H_ext).T
-                    error_label = error_label[0][0]
-
-                    total_error_new = error_label + self.xi * error_data
-
-                    time_error = np.append(time_error, np.array([[elapsed_time, error_data, error_label]]), axis=0)
                     print('--- Iteration %i: Training loss --- [Data, Label, Total] = [%f.3, %f.3, %f.3]' % (step, error_data, error_label, total_error_new))
-                    self.result_dict.update({'time_error': time_error.T})
 
                     # stopping criterion
                     if (total_error > 0) and (total_error_new > 1.001 * total_error):
@@ -594,7 +573,7 @@ class LMF():
 
         if self.full_dim:
             r = X[0].shape[0]
-            W = [1, np.random.rand(X[1].shape[0], r + 1 + self.d3)] # don't use np.identity(r) for efficient computation
+            W = [1, np.random.rand(X[1].shape[0], r + 1 + self.d3).astype(self.dtype)] # don't use np.identity(r) for efficient computation
             H = X[0]
 
         result_dict = {}
@@ -607,7 +586,7 @@ class LMF():
         else: # logistic regression **after** dimension reduction
             for step in trange(int(iter)):
                 start = time.time()
-                search_radius = search_radius_const * (float(step + 1)) ** (-beta) / np.log(float(step + 2))
+                search_radius = float(search_radius_const * (float(step + 1)) ** (-beta) / np.log(float(step + 2)))
                 #print('!!! search_radius', search_radius)
 
 
@@ -629,7 +608,7 @@ class LMF():
                                              nonnegativity=self.nonnegativity[2], history=1)
             """
             # Now that W[0] and H are fixed, further optimize the regression coefficients W[1]
-            H1 = np.vstack((np.ones(H.shape[1]), H))
+            H1 = np.vstack((np.ones(H.shape[1], dtype=self.dtype), H))
             clf = LogisticRegression(random_state=0).fit(H1.T, self.X[1][0,:])
             W[1] = clf.coef_
 
@@ -654,7 +633,7 @@ class LMF():
             else:
                 error_data = np.linalg.norm((X[0] - W[0] @ H).reshape(-1, 1), ord=2) ** 2
 
-            H_ext = np.vstack((np.ones(X[1].shape[1]), H))
+            H_ext = np.vstack((np.ones(X[1].shape[1], dtype=self.dtype), H))
             if self.d3>0:
                 H_ext = np.vstack((H_ext, self.X_auxiliary))
 
@@ -662,7 +641,7 @@ class LMF():
             #print('W[1].shape', W[1].shape)
 
             P_pred = np.matmul(W[1], H_ext)
-            P_pred = 1 / (np.exp(-P_pred) + 1)
+            P_pred = sigmoid(P_pred)
             # print('!!! error norm', np.linalg.norm(X[1][0, :]-P_pred[0,:])/X[1].shape[1])
             fpr, tpr, thresholds = metrics.roc_curve(X[1][0, :], P_pred[0,:], pos_label=None)
             mythre = thresholds[np.argmax(tpr - fpr)]
@@ -671,7 +650,7 @@ class LMF():
             results_dict.update({'AUC (training)': myauc})
 
             print('--- Training --- [threshold, AUC] = ', [np.round(mythre,3), np.round(myauc,3)])
-            error_label = np.sum(np.log(1+np.exp(W[1] @ H_ext))) - X[1] @ (W[1] @ H_ext).T
+            error_label = logistic_loss_grad(W[1], H_ext, X[1], compute_grad=False)[0]
 
 
             time_error = np.append(time_error, np.array([[elapsed_time, error_data, error_label]]), axis=0)
@@ -759,8 +738,8 @@ class LMF():
 
             # Compute test data reconstruction loss
             H_test = self.sparse_code(X_test[0], W[0])
-            error_data = np.linalg.norm((X_test[0] - W[0] @ H_test).reshape(-1, 1), ord=2)
-            rel_error_data = error_data / np.linalg.norm(X_test[0].reshape(-1, 1), ord=2)
+            error_data = np.sqrt(recons_error(X_test[0], W[0], H_test))
+            rel_error_data = error_data / np.sqrt(sq_norm(X_test[0]))
 
             # Save results
             result_dict.update({'Relative_reconstruction_loss (test)': rel_error_data})
@@ -804,12 +783,12 @@ class LMF():
 
         if pred_threshold is None:
             # Get threshold from training set
-            X0_comp = self.sparse_code(self.X[0], W[0])
-            X0_ext = np.vstack((np.ones(self.X[1].shape[1]), X0_comp))
+            X0_comp = self.sparse_code(self.X[0], W[0], H0=self.code)
+            X0_ext = np.vstack((np.ones(self.X[1].shape[1], dtype=self.dtype), X0_comp))
             if self.d3>0:
                 X0_ext = np.vstack((X0_ext, self.X_auxiliary))
             P_pred = np.matmul(W[1], X0_ext)
-            P_pred = 1 / (np.exp(-P_pred) + 1)
+            P_pred = sigmoid(P_pred)
             # print('!!! error norm', np.linalg.norm(X[1][0, :]-P_pred[0,:])/X[1].shape[1])
             fpr, tpr, thresholds = metrics.roc_curve(self.X[1][0, :], P_pred[0,:], pos_label=None)
             pred_threshold = thresholds[np.argmax(tpr - fpr)]
@@ -828,11 +807,11 @@ class LMF():
             # Prediction for test set
             H = self.sparse_code(X_test, W[0])
             #print('---- H naive shape', H.shape)
-            H_ext = np.vstack((np.ones(X_test.shape[1]), H))
+            H_ext = np.vstack((np.ones(X_test.shape[1], dtype=self.dtype), H))
             if X_test_aux is not None:
                 H_ext = np.vstack((H_ext, X_test_aux))
             P_pred = np.matmul(W[1], H_ext)
-            P_pred = 1 / (np.exp(-P_pred) + 1)
+            P_pred = sigmoid(P_pred)
 
             # threshold predictive probabilities to get predictions
             Y_hat = P_pred.copy()
@@ -844,8 +823,8 @@ class LMF():
 
         elif method == 'alt':
             #print('alternating prection..')
-            H = np.random.rand(r,n)
-            Y_hat = np.random.rand(self.X[1].shape[0], X_test.shape[1])
+            H = np.random.rand(r,n).astype(self.dtype)
+            Y_hat = np.random.rand(self.X[1].shape[0], X_test.shape[1]).astype(self.dtype)
             for step in trange(int(200)):
                 X = [X_test, Y_hat]
 
@@ -853,13 +832,13 @@ class LMF():
                 radius = 10/(step+1)
                 H = self.update_code_joint_logistic(X, W, H, r=radius, sub_iter = 2, stopping_diff=0.0001)
                 # Update the missing label P_pred
-                H_ext = np.vstack((np.ones(X_test.shape[1]), H))
+                H_ext = np.vstack((np.ones(X_test.shape[1], dtype=self.dtype), H))
 
                 if X_test_aux is not None:
                     H_ext = np.vstack((H_ext, X_test_aux))
 
                 P_pred = np.matmul(W[1], H_ext)
-                P_pred = 1 / (np.exp(-P_pred) + 1)
+                P_pred = sigmoid(P_pred)
                 Y_hat = P_pred
 
                 # threshold predictive probabilities to get predictions
@@ -877,17 +856,17 @@ class LMF():
             for i in trange(n):
                 loss_list = []
                 h_list = []
-                x_test = X_test[:,i][:,np.newaxis]
+                x_test = X_test[:,[i]]
 
                 for j in np.arange(2):
                     y_guess = np.asarray([[j]])
                     x_guess = [x_test, y_guess]
                     h = self.update_code_joint_logistic(x_guess, W, xi=self.xi, sub_iter=40,
                                                         stopping_diff=0.001, H0=None, r=None)
-                    h_ext = np.vstack((np.ones(1), h))
-                    error_data = np.linalg.norm((x_test - W[0] @ h).reshape(-1, 1), ord=2) ** 2
-                    error_label = np.sum(np.log(1+np.exp(W[1] @ h_ext))) - y_guess @ (W[1] @ h_ext).T
-                    loss = (error_label + self.xi * error_data)[0,0]
+                    h_ext = np.vstack((np.ones(1, dtype=self.dtype), h))
+                    error_data = recons_error(x_test, W[0], h)
+                    error_label = logistic_loss_grad(W[1], h_ext, y_guess, compute_grad=False)[0]
+                    loss = error_label + self.xi * error_data
                     # print('[j, loss] = ', [j, loss])
                     loss_list.append(loss)
                     h_list.append(h)
@@ -905,9 +884,9 @@ class LMF():
             #print('--- Y_hat', Y_hat)
             H = np.asarray(H).T
             H -= np.mean(H)
-            H_ext = np.vstack((np.ones(X_test.shape[1]), H))
+            H_ext = np.vstack((np.ones(X_test.shape[1], dtype=self.dtype), H))
             P_pred = np.matmul(W[1], H_ext)
-            P_pred = 1 / (np.exp(-P_pred) + 1)
+            P_pred = sigmoid(P_pred)
             P_pred = P_pred[0,:]
 
         self.result_dict.update({'code_test': H})
@@ -932,86 +911,6 @@ def safe_vstack(Xs):
         return np.vstack(Xs)
 
 
-def update_code_within_radius(X, W, H0, r, a1=0, a2=0,
-                              sub_iter=[2], stopping_grad_ratio=0.0001,
-                              subsample_ratio=None, nonnegativity=True,
-                              use_line_search=False):
-    '''
-    Find \hat{H} = argmin_H ( | X - WH| + alpha|H| ) within radius r from H0
-    Use row-wise projected gradient descent
-    Do NOT sparsecode the whole thing and then project -- instable
-    12/5/2020 Lyu
-
-    For NTF problems, X is usually tall and thin so it is better to subsample from rows
-    12/25/2020 Lyu
-
-    Apply single round of AdaGrad for rows, stop when gradient norm is small and do not make update
-    12/27/2020 Lyu
-    '''
-
-    # print('!!!! X.shape', X.shape)
-    # print('!!!! W.shape', W.shape)
-    # print('!!!! H0.shape', H0.shape)
-    if H0 is None:
-        H0 = np.random.rand(W.shape[1], X.shape[1])
-    H1 = H0.copy()
-    i = 0
-    dist = 1
-    idx = np.arange(X.shape[0])
-    H1_old = H1.copy()
-
-    A = W.T @ W
-    B = W.T @ X
-
-    while (i < np.random.choice(sub_iter)):
-        if_continue = np.ones(H0.shape[0])  # indexed by rows of H
-
-        for k in [k for k in np.arange(H0.shape[0]) if if_continue[k]>0.5]:
-
-            grad = (np.dot(A[k, :], H1) - B[k, :])
-            grad += a1 * np.sign(H1[k, :]) * np.ones(H0.shape[1]) + a2 * H1[k, :]
-            grad_norm = np.linalg.norm(grad, 2)
-
-            # Initial step size
-            step_size = 1/(A[k,k]+1)
-            # step_size = 1 / (np.trace(A)) # use the whole trace
-            # step_size = 1
-            if r is not None:  # usual sparse coding without radius restriction
-                d = step_size * grad_norm
-                step_size = (r / max(r, d)) * step_size
-
-            H1_temp = H1.copy()
-            # loss_old = np.linalg.norm(X - W @ H1)**2
-            H1_temp[k, :] = H1[k, :] - step_size * grad
-            if nonnegativity:
-                H1_temp[k,:] = np.maximum(H1_temp[k,:], np.zeros(shape=(H1.shape[1],)))  # nonnegativity constraint
-            #loss_new = np.linalg.norm(X - W @ H1_temp)**2
-            #if loss_old > loss_new:
-
-                # print('recons_loss:' , np.linalg.norm(X - W @ H1, ord=2) / np.linalg.norm(X, ord=2))
-
-            if use_line_search:
-            # Armijo backtraking line search
-                m = grad.T @ H1[k,:]
-                H1_temp = H1.copy()
-                loss_old = np.linalg.norm(X - W @ H1)**2
-                loss_new = 0
-                count = 0
-                while (count==0) or (loss_old - loss_new < 0.1 * step_size * m):
-                    step_size /= 2
-                    H1_temp[k, :] = H1[k, :] - step_size * grad
-                    if nonnegativity:
-                        H1_temp[k,:] = np.maximum(H1_temp[k,:], np.zeros(shape=(H1.shape[1],)))  # nonnegativity constraint
-                    loss_new = np.linalg.norm(X - W @ H1_temp)**2
-                    count += 1
-
-            H1 = H1_temp
-
-        i = i + 1
-
-
-    return H1
-
 def update_code_within_radius_old(X, W, H0=None, r=None, a1=0, a2=0,
                               sub_iter=[5], stopping_grad_ratio=0.02,
                               subsample_ratio=None, nonnegativity=True,
@@ -15,9 +15,21 @@ from sklearn.metrics import precision_recall_curve
 from sklearn.metrics import accuracy_score
 from sklearn.metrics import confusion_matrix
 import scipy.sparse as sp
-from sklearn.decomposition import SparseCoder
 from sklearn.linear_model import LogisticRegression
 from scipy.linalg import block_diag
+from scipy.optimize import minimize, Bounds
+from src.kernels import update_code_joint_logistic, radius_scale, scale_toward, update_code_within_radius
+from src.kernels import fit_logistic_newton, sq_norm, recons_error, update_logistic_online, as_dtype
+from src.kernels import logistic_loss_grad, sigmoid, sparse_code_batched, nnls_block_pivot, ridge_factor, ridge_solve
+from src.kernels import power_iteration, update_code_fista, update_dict_joint_logistic_fista, sdl_filter_loss_grad
+from src.kernels import svrg_code_beta, fit_logistic_newton_sum, share_array, attach_array, logistic_hessian
+import os
+import multiprocessing
+import multiprocessing.connection
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:  # optional: the BLAS pools of the worker processes are then not limited (fit with n_jobs)
+    threadpool_limits = None
 
 
 
@@ -62,26 +74,31 @@ class SDL_BCD():
                  L1_reg=[0,0,0], # L1 regularizer for code H, dictioanry W[0], and regression params W[1]
                  L2_reg=[0,0,0], # L2 regularizer for code H, dictioanry W[0], and regression params W[1]
                  nonnegativity=[True,True,False], # nonnegativity constraints on code H, dictionary W[0], reg params W[1]
-                 full_dim=False): # if true, dictionary matrix W[0] is Id with size d1 x d1 -- no dimension reduction
+                 full_dim=False, # if true, dictionary matrix W[0] is Id with size d1 x d1 -- no dimension reduction
+                 dtype=np.float64): # floating point type of data, loading, code and all intermediates (e.g. np.float32)
 
-        self.X = X
+        self.dtype = dtype
+        self.X = [as_dtype(X[0], dtype), as_dtype(X[1], dtype)]
+        X_auxiliary = as_dtype(X_auxiliary, dtype)
         self.X_auxiliary = X_auxiliary
         self.d3 = 0 # auxiliary data dim
         self.nonnegativity = nonnegativity
         if X_auxiliary is not None:
             self.d3 = X_auxiliary.shape[0]
             if ini_loading is not None:
-                Beta_aux = np.zeros((X[1].shape[0], n_components + 1 + self.d3))
+                Beta_aux = np.zeros((X[1].shape[0], n_components + 1 + self.d3), dtype=dtype)
                 Beta_aux[: , :ini_loading[-1].shape[1]] = ini_loading[-1]
                 ini_loading[-1] = Beta_aux
 
+        if X_test is not None:
+            X_test = [as_dtype(X_test[0], dtype), as_dtype(X_test[1], dtype)]
         self.X_test = X_test
-        self.X_test_aux = X_test_aux
+        self.X_test_aux = as_dtype(X_test_aux, dtype)
         self.n_components = n_components
         self.iterations = iterations
-        self.ini_code = ini_code
+        self.ini_code = as_dtype(ini_code, dtype)
         if ini_code is None:
-            self.ini_code = np.random.rand(n_components, X[0].shape[1])
+            self.ini_code = np.random.rand(n_components, X[0].shape[1]).astype(dtype)
 
         self.loading = ini_loading
         if ini_loading is None:
@@ -90,12 +107,13 @@ class SDL_BCD():
             r = n_components
             self.loading = [np.random.rand(X[0].shape[0], r), 1-2*np.random.rand(X[1].shape[0], r + 1 + self.d3)]  # additional first column for constant terms in Logistic Regression
             # add additional d3 columns of regression coefficients for the auxiliary variables
+        self.loading = [as_dtype(W, dtype) for W in self.loading]
         print('initial loading beta', self.loading[1])
 
         self.xi = xi
         self.L1_reg = L1_reg
         self.L2_reg = L2_reg
-        self.code = np.zeros(shape=(n_components, X[0].shape[1]))
+        self.code = np.zeros(shape=(n_components, X[0].shape[1]), dtype=dtype)
         self.full_dim = full_dim
         self.result_dict = {}
         self.result_dict.update({'xi' : self.xi})
@@ -104,8 +122,50 @@ class SDL_BCD():
         self.result_dict.update({'nonnegativity' : self.nonnegativity})
         self.result_dict.update({'n_components' : self.n_components})
 
+        # cache of sufficient statistics (see sufficient_stat), keyed on version counters of W[0] and H
+        self.W_version = 0
+        self.H_version = 0
+        self.stats = {}
 
-    def sparse_code(self, X, W, sparsity=0):
+
+    def sufficient_stat(self, name, W0=None, H=None):
+        '''
+        Sufficient statistics of the dictionary W0 = W[0] and code H, computed once per change of the factor
+        they depend on and shared by the code, dictionary, regression and loss computations
+            'WtW' = W0.T @ W0, 'WtX' = W0.T @ X0, 'X0_comp' = [W0.T @ X0; X_auxiliary]  (keyed on self.W_version)
+            'WtW_factor' = kernels.ridge_factor(W0.T @ W0, L2_reg[0])  (keyed on self.W_version)
+            'X_norm_sq' = lambda_max(X0 X0.T) by power iteration  (computed once)
+            'HHt' = H @ H.T, 'XHt' = X0 @ H.T  (keyed on self.H_version)
+        Increase self.W_version (resp. self.H_version) whenever W[0] (resp. H) changes.
+        Returned arrays are shared, do not modify them in place.
+        '''
+        version = self.W_version if name in ['WtW', 'WtX', 'X0_comp', 'WtW_factor'] else self.H_version
+        if name == 'X_norm_sq':
+            version = 0
+        if (name in self.stats) and (self.stats[name][0] == version):
+            return self.stats[name][1]
+
+        if name == 'WtW':
+            value = W0.T @ W0
+        elif name == 'WtX':
+            value = W0.T @ self.X[0]
+        elif name == 'X_norm_sq':
+            value = power_iteration(self.X[0].T, gram=False)
+        elif name == 'WtW_factor':
+            value = ridge_factor(self.sufficient_stat('WtW', W0=W0), self.L2_reg[0])
+        elif name == 'X0_comp':
+            value = self.sufficient_stat('WtX', W0=W0)
+            if self.X_auxiliary is not None:
+                value = np.vstack((value, self.X_auxiliary))
+        elif name == 'HHt':
+            value = H @ H.T
+        elif name == 'XHt':
+            value = self.X[0] @ H.T
+        self.stats.update({name: (version, value)})
+        return value
+
+
+    def sparse_code(self, X, W, sparsity=0, H0=None):
         # Same function as OMF
 
         '''
@@ -115,6 +175,7 @@ class SDL_BCD():
         args:
             X (numpy array): data matrix with dimensions: features (d) x samples (n)
             W (numpy array): dictionary matrix with dimensions: features (d) x topics (r)
+            H0 (numpy array): warm start for the code (e.g. the code of the previous iteration)
 
         returns:
             H (numpy array): code matrix with dimensions: topics (r) x samples(n)
@@ -127,21 +188,17 @@ class SDL_BCD():
             print('X.shape:', X.shape)
             print('W.shape:', W.shape, '\n')
 
-        # initialize the SparseCoder with W as its dictionary
-        # then find H such that X \approx W*H
-        coder = SparseCoder(dictionary=W.T, transform_n_nonzero_coefs=None,
-                            transform_alpha=sparsity, transform_algorithm='lasso_lars', positive_code=True)
-        # alpha = L1 regularization parameter.
-        H = coder.transform(X.T)
+        # find H >= 0 such that X \approx W*H, with the same objective as SparseCoder(lasso_lars)
+        # alpha = L1 regularization parameter. All columns share the Gram matrix W.T @ W (dense or sparse X).
+        H = sparse_code_batched(X, W, alpha=sparsity, H0=H0, nonnegativity=True)
 
-        # transpose H before returning to undo the preceding transpose on X
         # print('!!! sparse_code: Start')
-        return H.T
+        return H.astype(W.dtype, copy=False)
 
 
-    def update_beta_logistic(self, Y, W0, input, r, a1=0, sub_iter=2, stopping_diff=0.1, nonnegativity=True, history=1):
+    def update_beta_logistic(self, Y, W0, input, r, a1=0, sub_iter=2, stopping_diff=0.1, nonnegativity=True, history=1, radius_norm='spectral'):
         '''
-        Y = (p' x n), W = (p' x (r+1)), H = (r' x n), H' = np.vstack((np.ones(n), H))
+        Y = (p' x n), W = (p' x (r+1)), H = (r' x n), H' = np.vstack((np.ones(n, dtype=self.dtype), H))
         W0 = [W_beta  W_beta_aux]
         H = [H               ]
             [self.X_auxiliary]
@@ -149,10 +206,11 @@ class SDL_BCD():
         MLE -->
         Find \hat{W} = argmin_W ( sum_j ( log(1+exp(W H_j) ) - Y (W H).T ) ) within radius r from W0
         Use row-wise projected gradient descent
+        radius_norm = 'spectral' (default), 'fro' or 'row' : norm in which the radius r is measured (see kernels.radius_scale)
         '''
 
         d1 = self.X[0].shape[0] # data dim
-        H = np.vstack((np.ones(Y.shape[1]), input))
+        H = np.vstack((np.ones(Y.shape[1], dtype=self.dtype), input))
         #H -= np.mean(H)
         #H /= np.std(H)
 
@@ -160,24 +218,35 @@ class SDL_BCD():
             H = np.vstack((H, self.X_auxiliary)) # add additional rows for the auxiliary explanatory variables
 
         A = H @ H.T
-        P = 1/(1+np.exp(-W0 @ H))  # probability matrix, same shape as Y
+        _, P, grad_W = logistic_loss_grad(W0, H, Y, compute_loss=False)  # P = probability matrix, same shape as Y
 
         W1 = W0.copy()
+        W_center = W0
+        row_dist = np.zeros(W1.shape[0], dtype=W1.dtype)  # squared distances |W1[k] - W_center[k]|^2 for radius_norm='fro'
         i = history
         dist = 1
         while (i < sub_iter) and (dist > stopping_diff):
             # W1_old = W1.copy()
             for k in np.arange(W0.shape[0]):
-                grad = H @ (P[k,:] - Y[k,:]).T + a1 * np.ones(W0.shape[1])
+                grad = grad_W[k, :] + a1  # = H @ (P[k,:] - Y[k,:]).T + a1
                 # H1[k, :] = H1[k,:] - (1 / (A[k, k] + np.linalg.norm(grad, 2))) * grad
                 W1[k, :] = W1[k, :] - (1 / (((i + 10) ** (0.5)) * (A[k, k] + 1))) * grad
 
                 if nonnegativity:
-                    W1[k, :] = np.maximum(W1[k, :], np.zeros(shape=(W1.shape[1],)))  # nonnegativity constraint
+                    W1[k, :] = np.maximum(W1[k, :], 0)  # nonnegativity constraint
 
                 if r is not None:  # usual sparse coding without radius restriction
-                    d = np.linalg.norm(W1 - W0, 2)
-                    W1 = W0 + (r / max(r, d)) * (W1 - W0)
+                    if radius_norm == 'spectral':
+                        d = np.linalg.norm(W1 - W0, 2)
+                        W1 = W0 + (r / max(r, d)) * (W1 - W0)
+                    elif radius_norm == 'fro':
+                        row_dist[k] = np.sum((W1[k, :] - W_center[k, :]) ** 2)
+                        c = radius_scale(np.sqrt(np.sum(row_dist)), r)
+                        if c < 1:
+                            scale_toward(W1, W_center, c)
+                            row_dist *= c ** 2
+                    elif radius_norm == 'row':
+                        scale_toward(W1[k, :], W_center[k, :], radius_scale(np.linalg.norm(W1[k, :] - W_center[k, :]), r))
 
                 W0 = W1
 
@@ -187,44 +256,69 @@ class SDL_BCD():
             # print('!!!! i', i)  # mostly the loop finishes at i=1 except the first round
         return W1
 
-    def update_dict_joint_logistic(self, X, H, W0, r, a1=0, a2=0, sub_iter=2, stopping_diff=0.1, nonnegativity=True, subsample_size=None):
+    def update_dict_joint_logistic(self, X, H, W0, r, a1=0, a2=0, sub_iter=2, stopping_diff=0.1, nonnegativity=True, subsample_size=None,
+                                   A=None, XHt=None, X0_comp=None, X_auxiliary=None, solver='pgd', grad_pred_fn=None):
         '''
         X = [X0, X1]
         W = [W0, W1+W2]
         Find \hat{W} = argmin_W ( || X0 - W0 H||^2 + alpha|H| + Logistic_Loss(W[0].T @ X1, W[1])) within radius r from W0
         Compressed data = W[0].T @ X0 instead of H
+        A, XHt, X0_comp : precomputed H @ H.T, X0 @ H.T and W0[0].T @ X0 (see sufficient_stat), computed if None
+        X_auxiliary : auxiliary covariates of the columns of X (default self.X_auxiliary)
+        solver = 'pgd' : at most sub_iter projected gradient steps with diminishing step size,
+                         stopping when the relative change of W0 is below stopping_diff
+                 'fista' : accelerated proximal gradient with Lipschitz step size and adaptive restart,
+                           same stopping rule (see kernels.update_dict_joint_logistic_fista)
+        grad_pred_fn : (pgd) function W1 -> X0 @ (P - X1).T @ beta_code giving the logistic part of the gradient
+                       (e.g. summed over the column shards of fit_parallel); X and H are then not used
+                       and A, XHt must be given
         '''
 
+        if X_auxiliary is None:
+            X_auxiliary = self.X_auxiliary
+
+        if solver == 'fista':
+            return update_dict_joint_logistic_fista(X, H, W0, r, xi=self.xi, a1=a1, a2=a2, nonnegativity=nonnegativity,
+                                                    X_auxiliary=X_auxiliary, A=A, XHt=XHt,
+                                                    X_norm_sq=self.sufficient_stat('X_norm_sq') if X[0] is self.X[0] else None,
+                                                    max_iter=sub_iter, tol=stopping_diff)
+
         if W0 is None:
             W0 = np.random.rand(X[0].shape[0], self.n_components)
             print('!!! W0.shape', W0.shape)
 
         #if not self.full_dim:
-        A = H @ H.T
+        if A is None:
+            A = H @ H.T
+        if (XHt is None) and (not self.full_dim):
+            XHt = X[0] @ H.T
 
         W1 = W0[0].copy()
         i = 0
         dist = 1
-        idx = np.arange(X[0].shape[0])
         while (i < sub_iter) and (dist > stopping_diff):
             W1_old = W1.copy()
 
             # Regression Parameters Update
 
-            X0_comp = W1.T @ X[0]
-            H1_ext = np.vstack((np.ones(X[1].shape[1]), X0_comp))
-            if self.X_auxiliary is not None:
-                H1_ext = np.vstack((H1_ext, self.X_auxiliary[:,:]))
-                # add additional rows for the auxiliary explanatory variables
+            if grad_pred_fn is None:
+                if (i > 0) or (X0_comp is None):
+                    X0_comp = W1.T @ X[0]
+                H1_ext = np.vstack((np.ones(X[1].shape[1], dtype=self.dtype), X0_comp))
+                if X_auxiliary is not None:
+                    H1_ext = np.vstack((H1_ext, X_auxiliary[:,:]))
+                    # add additional rows for the auxiliary explanatory variables
 
-            # P = probability matrix, same shape as X1
-            D = W0[1] @ H1_ext
-            P = 1 / (1 + np.exp(-D))
+                # P = probability matrix, same shape as X1, grad_ext = W0[1].T @ (P - X1)
+                _, P, grad_ext = logistic_loss_grad(W0[1], H1_ext, X[1], wrt='H', compute_loss=False)
 
             if not self.full_dim:
-                grad_MF = (W1 @ H - X[0]) @ H.T
-                grad_pred = X[0] @ (P-X[1]).T @ W0[1][:, 1:self.n_components+1] # exclude the first column of W[1] (intercept terms)
-                grad = self.xi * grad_MF + grad_pred + a1 * np.sign(W1)*np.ones(shape=W1.shape) + a2 * W1
+                grad_MF = W1 @ A - XHt  # = (W1 @ H - X[0]) @ H.T
+                if grad_pred_fn is None:
+                    grad_pred = X[0] @ grad_ext[1:self.n_components+1].T # exclude the first row (intercept terms)
+                else:
+                    grad_pred = grad_pred_fn(W1)
+                grad = self.xi * grad_MF + grad_pred + a1 * np.sign(W1) + a2 * W1
                 # grad = grad_MF
 
                 W1 -= (1 / (((i + 10) ** (0.5)) * (np.trace(A) + 1))) * grad
@@ -235,10 +329,9 @@ class SDL_BCD():
             W0[0] = W1
 
             if nonnegativity:
-                W1 = np.maximum(W1, np.zeros(shape=W1.shape))  # nonnegativity constraint
+                W1 = np.maximum(W1, 0)  # nonnegativity constraint
 
-            dist = np.linalg.norm(W1 - W1_old, 2) / np.linalg.norm(W1_old, 2)
-            dist = 1
+            dist = np.linalg.norm(W1 - W1_old) / np.linalg.norm(W1_old)
             # print('!!! dist', dist)
             # H1_old = H1
             i = i + 1
@@ -251,67 +344,32 @@ class SDL_BCD():
                                    a1=0, a2=0, sub_iter=2,
                                    stopping_diff=0.1, nonnegativity=True,
                                    xi = 0,
-                                   subsample_size=None):
+                                   subsample_size=None,
+                                   mode='row',
+                                   radius_norm='spectral',
+                                   A=None, B=None):
         '''
         X = [X0, X1]
         W = [W0, W1+W2]
         Find \hat{H} = argmin_H ( xi * || X0 - W0 H||^2 + alpha|H| + Logistic_Loss(X1, [W1|W2], H)) within radius r from H0
-        Use row-wise projected gradient descent
+        mode = 'row' : row-wise projected gradient descent
+        mode = 'block' : projected gradient descent on all rows of H at once
+        mode = 'fista' : accelerated proximal gradient to tolerance stopping_diff (at most sub_iter iterations)
+        radius_norm = 'spectral' (default), 'fro' or 'row' : norm in which the radius r is measured (see kernels.radius_scale)
+        A, B : precomputed W[0].T @ W[0] and W[0].T @ X0 (see sufficient_stat), computed if None
         '''
 
-        if H0 is None:
-            H0 = np.random.rand(W[0].shape[1], X[0].shape[1])
-            # print('!!! H0.shape', H0.shape)
-
-        if not self.full_dim:
-            A = W[0].T @ W[0]
-            B = W[0].T @ X[0]
-
-        H1 = H0.copy()
-        i = 0
-        dist = 1
-        idx = np.arange(X[0].shape[1])
-        while (i < sub_iter) and (dist > stopping_diff):
-            H1_old = H1.copy()
-            for k in np.arange(H1.shape[0]):
-                if subsample_size is not None:
-                    idx = np.random.randint(X[0].shape[1], size=subsample_size)
-
-                H1_ext = np.vstack((np.ones(len(idx)), H1[:,idx]))
-                if self.X_auxiliary is not None:
-                    H1_ext = np.vstack((H1_ext, self.X_auxiliary[:,idx]))
-                    # add additional rows for the auxiliary explanatory variables
-
-                # P = probability matrix, same shape as X1
-                D = W[1] @ H1_ext
-                P = 1 / (1 + np.exp(-D))
-
-                if self.full_dim:
-                    grad = np.diag(W[1][:,k]) @ (P-X[1][:,idx])
-                    H1[k, idx] = H1[k, idx] - (1 / (((i + 10) ** (0.5)) * (0 + 1))) * grad
-                else:
-                    grad_MF = (np.dot(A[k, :], H1[:,idx]) - B[k, idx])
-                    #print('W[1].shape', W[1].shape)
-                    grad_pred = np.diag(W[1][:,k+1]) @ (P-X[1][:,idx])
-                    grad =  xi * grad_MF + grad_pred + a1 * np.sign(H1[k,idx])*np.ones(len(idx)) + a2 * H1[k, idx]
-                    H1[k, idx] = H1[k, idx] - (1 / (((i + 10) ** (0.5)) * (A[k, k] + 1))) * grad
-
-                if nonnegativity:
-                    H1[k, idx] = np.maximum(H1[k, idx], np.zeros(shape=(len(idx),)))  # nonnegativity constraint
-
-                if r is not None:  # usual sparse coding without radius restriction
-                    d = np.linalg.norm(H1 - H0, 2)
-                    H1 = H0 + (r / max(r, d)) * (H1 - H0)
-                H0 = H1
-
-            dist = np.linalg.norm(H1 - H1_old, 2) / np.linalg.norm(H1_old, 2)
-            # print('!!! dist', dist)
-            # H1_old = H1
-            i = i + 1
-            # print('!!!! i', i)  # mostly the loop finishes at i=1 except the first round
-
-
-        return H1
+        return update_code_joint_logistic(X, W, H0, r,
+                                          X_auxiliary=self.X_auxiliary,
+                                          a1=a1, a2=a2, sub_iter=sub_iter,
+                                          stopping_diff=stopping_diff,
+                                          nonnegativity=nonnegativity,
+                                          xi=xi,
+                                          subsample_size=subsample_size,
+                                          full_dim=self.full_dim,
+                                          mode=mode,
+                                          radius_norm=radius_norm,
+                                          A=A, B=B)
 
 
     def fit(self,
@@ -325,7 +383,13 @@ class SDL_BCD():
             if_compute_recons_error=False,
             update_nuance_param=False,
             auxiliary_training=False,
-            if_validate=False):
+            if_validate=False,
+            fine_tune_beta=True,
+            prediction_method_list=None,
+            code_update_mode='row',
+            radius_norm='spectral',
+            solver='pgd',
+            n_jobs=None):
         '''
         Given input X = [data, label] and initial loading dictionary W_ini, find W = [dict, beta] and code H
         by two-block coordinate descent: [dict, beta] --> H, H--> [dict, beta]
@@ -333,33 +397,100 @@ class SDL_BCD():
         option = 'filter' : filter-based SDL
         option = 'feature' : feature-based SDL
         update_nuance_param = True means self.xi is updated by the MLE (sample variance) each iteration
+        if_validate = True validates on X_test every 10 iterations and stops once the accuracy exceeds 0.99
+        fine_tune_beta = True refits beta by Newton's method on the final compressed data W[0].T @ X[0]
+        prediction_method_list : prediction methods of the validation, default ['filter'] or ['naive'] (feature mode)
+        code_update_mode = 'row' or 'block' : row-wise or all-rows-at-once code update in feature mode
+                           'svrg' : (feature mode) code and beta together by the stochastic variance-reduced
+                                    solver kernels.svrg_code_beta (2 epochs per iteration) over contiguous
+                                    mini-batches of subsample_size columns (default 1000), instead of the
+                                    Newton beta fit and the subsampled code step
+                           'exact' : (filter mode) solve the nonnegative least squares code step to tolerance by
+                                     block principal pivoting (kernels.nnls_block_pivot) instead of one
+                                     radius-limited projected gradient sweep; ValueError unless nonnegativity[0]
+        radius_norm = 'spectral' (default), 'fro' or 'row' : norm of the feature-mode code search radius; 'fro' and 'row'
+                      are measured from the code at the start of the step, so the iterates differ (see kernels.radius_scale)
+        solver = 'pgd' : projected gradient steps with diminishing step sizes for the dictionary and code (default)
+                 'fista' : accelerated proximal gradient for the dictionary and code blocks, with Lipschitz step
+                           sizes from power iteration, adaptive restart and a relative-change stopping rule
+                           (up to fista_iter iterations per block); code_update_mode 'exact' and the closed-form
+                           ridge code take precedence for the code
+                 'lbfgs' : (filter mode) joint L-BFGS-B over (W[0], H, beta) instead of block coordinate descent,
+                           at most iter L-BFGS iterations (see fit_lbfgs); no validation, xi update or dict_update_freq
+                 'admm' : consensus ADMM over n_jobs (default 2) data shards that synchronize once per round,
+                          iter rounds of 5 local iterations (see fit_admm); dict_update_freq must be 1 and xi > 0
+                 ValueError for option combinations the chosen solver does not support
+        n_jobs : number of worker processes for the data-parallel fit (see fit_parallel; solver 'pgd' only),
+                 None or 1 = this process; ValueError for options the parallel fit does not support
+        With nonnegativity[0] False and L1_reg[0] = 0 the filter-mode code step is the closed-form ridge solution
+        (kernels.ridge_solve, factorization cached per dictionary version), kept within the search radius
+        if_compute_recons_error = True logs the training loss [time, data, label] in time_error every iteration
+        (from cached sufficient statistics, see kernels.recons_error); AUC and early stopping every 10 iterations
         '''
+        if solver == 'admm':
+            if self.full_dim or (code_update_mode not in ['row', 'block']) or (dict_update_freq != 1):
+                raise ValueError("solver='admm' needs full_dim=False, code_update_mode 'row' or 'block' and dict_update_freq=1 "
+                                 "(got full_dim=%r, code_update_mode=%r, dict_update_freq=%r)"
+                                 % (self.full_dim, code_update_mode, dict_update_freq))
+            if (self.xi is None) or (self.xi <= 0):
+                raise ValueError("solver='admm' needs xi > 0 (got xi=%r)" % self.xi)
+            return self.fit_admm(option=option, iter=iter, beta=beta, search_radius_const=search_radius_const,
+                                 if_compute_recons_error=if_compute_recons_error,
+                                 update_nuance_param=update_nuance_param, if_validate=if_validate,
+                                 fine_tune_beta=fine_tune_beta, prediction_method_list=prediction_method_list,
+                                 code_update_mode=code_update_mode, radius_norm=radius_norm,
+                                 n_jobs=n_jobs if n_jobs is not None else 2)
+
+        if (n_jobs is not None) and (n_jobs > 1):
+            if (solver != 'pgd') or (code_update_mode not in ['row', 'block']) or self.full_dim:
+                raise ValueError("n_jobs > 1 needs solver='pgd', code_update_mode 'row' or 'block' and full_dim=False "
+                                 "(got solver=%r, code_update_mode=%r, full_dim=%r)" % (solver, code_update_mode, self.full_dim))
+            return self.fit_parallel(option=option, iter=iter, beta=beta, dict_update_freq=dict_update_freq,
+                                     search_radius_const=search_radius_const,
+                                     if_compute_recons_error=if_compute_recons_error,
+                                     update_nuance_param=update_nuance_param, if_validate=if_validate,
+                                     fine_tune_beta=fine_tune_beta, prediction_method_list=prediction_method_list,
+                                     code_update_mode=code_update_mode, radius_norm=radius_norm, n_jobs=n_jobs)
+
+        if solver == 'lbfgs':
+            if (option != 'filter') or self.full_dim or if_validate or update_nuance_param or (dict_update_freq != 1):
+                raise ValueError("solver='lbfgs' needs option='filter', full_dim=False, if_validate=False, "
+                                 "update_nuance_param=False and dict_update_freq=1")
+            return self.fit_lbfgs(iter=iter, if_compute_recons_error=if_compute_recons_error,
+                                  fine_tune_beta=fine_tune_beta, prediction_method_list=prediction_method_list)
+
+        if (code_update_mode == 'exact') and ((option != 'filter') or self.full_dim or (not self.nonnegativity[0])):
+            raise ValueError("code_update_mode='exact' needs option='filter', full_dim=False and nonnegativity[0]=True "
+                             "(got option=%r, full_dim=%r, nonnegativity[0]=%r)" % (option, self.full_dim, self.nonnegativity[0]))
+
         X = self.X
         r = self.n_components
         n = X[0].shape[1]
+        X_sq = sq_norm(X[0])
 
         #H = np.random.rand(r, n)
         #W = [np.random.rand(X[0].shape[0], r), np.random.rand(X[1].shape[0], r + 1 + self.d3)]  # additional first column for constant terms in Logistic Regression
         H = self.ini_code
         W = self.loading
 
-        prediction_method_list = ['filter']
-        if option == 'feature':
-            prediction_method_list = ['naive']
+        if prediction_method_list is None:
+            prediction_method_list = ['filter'] if option == 'filter' else ['naive']
 
         if self.full_dim:
             r = X[0].shape[0]
-            W = [1, np.random.rand(X[1].shape[0], r + 1 + self.d3)] # don't use np.identity(r) for efficient computation
+            W = [1, np.random.rand(X[1].shape[0], r + 1 + self.d3).astype(self.dtype)] # don't use np.identity(r) for efficient computation
             H = X[0]
 
         time_error = np.zeros(shape=[0, 3])
         elapsed_time = 0
         total_error = 0
+        self.stats = {}
+        fista_iter = 10  # maximal number of FISTA iterations per block (solver='fista')
 
         for step in trange(int(iter)):
             start = time.time()
             if beta is not None:
-                search_radius = search_radius_const * (float(step + 1)) ** (-beta) / np.log(float(step + 2))
+                search_radius = float(search_radius_const * (float(step + 1)) ** (-beta) / np.log(float(step + 2)))  # Python float, keeps float32 iterates float32
             else:
                 search_radius = None
 
@@ -370,59 +501,113 @@ class SDL_BCD():
                 # Dictionary Update
                 if step % dict_update_freq == 0:
                     W[0] = self.update_dict_joint_logistic(X, H, W, stopping_diff=0.0001,
-                                                     sub_iter = 5,
+                                                     sub_iter = 5 if solver == 'pgd' else fista_iter,
                                                      r=search_radius, nonnegativity=self.nonnegativity[1],
                                                      a1=self.L1_reg[1], a2=self.L2_reg[1],
-                                                     subsample_size = None)
+                                                     subsample_size = None,
+                                                     A=self.sufficient_stat('HHt', H=H),
+                                                     XHt=self.sufficient_stat('XHt', H=H),
+                                                     X0_comp=self.sufficient_stat('WtX', W0=W[0]),
+                                                     solver=solver)
 
                     W[0] /= np.linalg.norm(W[0])
+                    self.W_version += 1
 
 
                 # Code Update
-                H = update_code_within_radius(X[0], W[0], H, r=search_radius,
-                                            a1=self.L1_reg[0], a2=self.L2_reg[0],
-                                            nonnegativity=self.nonnegativity[0])
+                if code_update_mode == 'exact':
+                    # exact minimizer of |X0 - W0 H|^2 / 2 + a1 |H|_1 + a2 |H|^2 / 2 over H >= 0 on the cached
+                    # Gram matrix, warm started from the support of the previous code (no search radius)
+                    H = nnls_block_pivot(self.sufficient_stat('WtW', W0=W[0]) + self.L2_reg[0] * np.identity(r, dtype=self.dtype),
+                                         self.sufficient_stat('WtX', W0=W[0]) - self.L1_reg[0],
+                                         H0=H).astype(self.dtype, copy=False)
+                elif (not self.nonnegativity[0]) and (self.L1_reg[0] == 0):
+                    # ridge code in closed form, (W0.T W0 + a2 I) H = W0.T X0 with the factorization cached
+                    # per dictionary version (reused while W[0] is unchanged, dict_update_freq > 1),
+                    # then pulled back within the search radius from the previous code
+                    H1 = ridge_solve(self.sufficient_stat('WtW_factor', W0=W[0]), self.sufficient_stat('WtX', W0=W[0]))
+                    if search_radius is not None:
+                        H1 = scale_toward(H1, H, radius_scale(np.linalg.norm(H1 - H), search_radius))
+                    H = H1
+                elif solver == 'fista':
+                    H = update_code_fista(X[0], W[0], H, r=search_radius,
+                                          a1=self.L1_reg[0], a2=self.L2_reg[0],
+                                          nonnegativity=self.nonnegativity[0],
+                                          A=self.sufficient_stat('WtW', W0=W[0]),
+                                          B=self.sufficient_stat('WtX', W0=W[0]),
+                                          max_iter=fista_iter, tol=0.0001)
+                else:
+                    H = update_code_within_radius(X[0], W[0], H, r=search_radius,
+                                                a1=self.L1_reg[0], a2=self.L2_reg[0],
+                                                nonnegativity=self.nonnegativity[0],
+                                                A=self.sufficient_stat('WtW', W0=W[0]),
+                                                B=self.sufficient_stat('WtX', W0=W[0]))
+                self.H_version += 1
 
 
                 # Regression Parameters Update
-                X0_comp = W[0].T @ X[0]
-                if self.X_auxiliary is not None:
-                    #print('np.linalg.norm(X0_comp)', np.linalg.norm(X0_comp))
-                    #print('np.linalg.norm(self.X_auxiliary)', np.linalg.norm(self.X_auxiliary))
-                    X0_comp = np.vstack((X0_comp, self.X_auxiliary))
-                clf = LogisticRegression(random_state=0).fit(X0_comp.T, self.X[1][0,:])
-                W[1][0,1:] = clf.coef_[0]
-                W[1][0,0] = clf.intercept_[0]
+                X0_comp = self.sufficient_stat('X0_comp', W0=W[0])
+                W[1] = fit_logistic_newton(self.X[1], X0_comp, W[1])  # warm start from the previous beta
 
             elif option == "feature":
-                if (step % dict_update_freq == 0):
+                if (step % dict_update_freq == 0) and (solver == 'fista'):
+                    W[0] = update_code_fista(X[0].T, H.T, W[0].T,
+                                             r=search_radius, nonnegativity=self.nonnegativity[1],
+                                             a1=self.L1_reg[1], a2=self.L2_reg[1],
+                                             A=self.sufficient_stat('HHt', H=H),
+                                             B=self.sufficient_stat('XHt', H=H).T,
+                                             max_iter=fista_iter, tol=0.0001).T
+
+                    W[0] /= np.linalg.norm(W[0])
+                    self.W_version += 1
+
+                elif (step % dict_update_freq == 0):
 
                     W[0] = update_code_within_radius(X[0].T, H.T, W[0].T, stopping_grad_ratio=0.01,
                                                      r=search_radius, nonnegativity=self.nonnegativity[1],
-                                                     a1=self.L1_reg[1], a2=self.L2_reg[1]).T
+                                                     a1=self.L1_reg[1], a2=self.L2_reg[1],
+                                                     A=self.sufficient_stat('HHt', H=H),
+                                                     B=self.sufficient_stat('XHt', H=H).T).T
 
                     W[0] /= np.linalg.norm(W[0])
+                    self.W_version += 1
 
 
-                # Beta
-                H1 = H.copy()
-                if self.X_auxiliary is not None:
-                    H1 = np.vstack((H, self.X_auxiliary[:,:]))
-                clf = LogisticRegression(random_state=0).fit(H1.T, self.X[1][0,:])
-                W[1][0,1:] = clf.coef_[0]
-                W[1][0,0] = clf.intercept_[0]
+                if code_update_mode == 'svrg':
+                    H, W[1] = svrg_code_beta(X, W, H, r=search_radius, X_auxiliary=self.X_auxiliary,
+                                             xi=self.xi, a1=self.L1_reg[0], a2=self.L2_reg[0],
+                                             nonnegativity=self.nonnegativity[0],
+                                             A=self.sufficient_stat('WtW', W0=W[0]),
+                                             B=self.sufficient_stat('WtX', W0=W[0]),
+                                             n_epochs=2, batch_size=subsample_size if subsample_size is not None else 1000)
+                    W[1] = W[1].astype(self.dtype, copy=False)
 
-                # H
-                H = self.update_code_joint_logistic(X, W, H, r=search_radius,
-                                                    a1=self.L1_reg[0], a2=self.L2_reg[0],
-                                                    xi = self.xi,
-                                                    sub_iter=2,
-                                                    stopping_diff=0.0001,
-                                                    nonnegativity=self.nonnegativity[0],
-                                                    subsample_size=int(X[0].shape[1]//10))
+                else:
+                    # Beta
+                    H1 = H
+                    if self.X_auxiliary is not None:
+                        H1 = np.vstack((H, self.X_auxiliary[:,:]))
+                    W[1] = fit_logistic_newton(self.X[1], H1, W[1])  # warm start from the previous beta
+
+                    # H
+                    H = self.update_code_joint_logistic(X, W, H, r=search_radius,
+                                                        a1=self.L1_reg[0], a2=self.L2_reg[0],
+                                                        xi = self.xi,
+                                                        sub_iter=2 if solver == 'pgd' else fista_iter,
+                                                        stopping_diff=0.0001,
+                                                        nonnegativity=self.nonnegativity[0],
+                                                        subsample_size=int(X[0].shape[1]//10) if (code_update_mode == 'row') and (solver == 'pgd') else None,
+                                                        mode=code_update_mode if solver == 'pgd' else 'fista',
+                                                        radius_norm=radius_norm,
+                                                        A=self.sufficient_stat('WtW', W0=W[0]),
+                                                        B=self.sufficient_stat('WtX', W0=W[0]))
+                self.H_version += 1
 
             if update_nuance_param:
-                self.xi = (1/(2*r*n)) * np.linalg.norm((X[0] - W[0] @ H).reshape(-1, 1), ord=2)**2
+                self.xi = (1/(2*r*n)) * recons_error(X[0], W[0], H, X_sq=X_sq,
+                                                     WtX=self.sufficient_stat('WtX', W0=W[0]),
+                                                     WtW=self.sufficient_stat('WtW', W0=W[0]),
+                                                     HHt=self.sufficient_stat('HHt', H=H))
                 print('xi updated by MLE:', self.xi)
 
             end = time.time()
@@ -439,21 +624,32 @@ class SDL_BCD():
 
 
 
+            if if_compute_recons_error:
+                # training loss every iteration: O(r^2 n) given the cached statistics (the next
+                # dictionary update reuses H @ H.T), no (d x n) residual
+                if self.full_dim:
+                    error_data = np.linalg.norm((X[0] - H).reshape(-1, 1), ord=2)**2
+                else:
+                    error_data = recons_error(X[0], W[0], H, X_sq=X_sq,
+                                              WtX=self.sufficient_stat('WtX', W0=W[0]),
+                                              WtW=self.sufficient_stat('WtW', W0=W[0]),
+                                              HHt=self.sufficient_stat('HHt', H=H))
+                rel_error_data = error_data / X_sq
+
+                X0_comp = self.sufficient_stat('WtX', W0=W[0])
+                X0_ext = np.vstack((np.ones(X[1].shape[1], dtype=self.dtype), X0_comp))
+                if self.d3>0:
+                    X0_ext = np.vstack((X0_ext, self.X_auxiliary))
+                error_label, P_pred, _ = logistic_loss_grad(W[1], X0_ext, X[1], compute_grad=False)
+                total_error_new = error_label + self.xi * error_data
+
+                time_error = np.append(time_error, np.array([[elapsed_time, error_data, error_label]]), axis=0)
+                self.result_dict.update({'Relative_reconstruction_loss (training)': rel_error_data})
+                self.result_dict.update({'Classification_loss (training)': error_label})
+                self.result_dict.update({'time_error': time_error.T})
+
             if (step % 10) == 0:
                 if if_compute_recons_error:
-                    # print the error every 50 iterations
-                    if self.full_dim:
-                        error_data = np.linalg.norm((X[0] - H).reshape(-1, 1), ord=2)**2
-                    else:
-                        error_data = np.linalg.norm((X[0] - W[0] @ H).reshape(-1, 1), ord=2)**2
-                    rel_error_data = error_data / np.linalg.norm(X[0].reshape(-1, 1), ord=2)**2
-
-                    X0_comp = W[0].T @ X[0]
-                    X0_ext = np.vstack((np.ones(X[1].shape[1]), X0_comp))
-                    if self.d3>0:
-                        X0_ext = np.vstack((X0_ext, self.X_auxiliary))
-                    P_pred = np.matmul(W[1], X0_ext)
-                    P_pred = 1 / (np.exp(-P_pred) + 1)
                     # print('!!! error norm', np.linalg.norm(X[1][0, :]-P_pred[0,:])/X[1].shape[1])
                     fpr, tpr, thresholds = metrics.roc_curve(X[1][0, :], P_pred[0,:], pos_label=None)
                     mythre = thresholds[np.argmax(tpr - fpr)]
@@ -461,18 +657,8 @@ class SDL_BCD():
                     self.result_dict.update({'Training_threshold':mythre})
                     self.result_dict.update({'Training_AUC':myauc})
                     print('--- Training --- [threshold, AUC] = ', [np.round(mythre,3), np.round(myauc,3)])
-                    error_label = np.sum(np.log(1+np.exp(W[1] @ X0_ext))) - X[1] @ (W[1] @ X0_ext).T
-                    error_label = error_label[0][0]
-
-                    total_error_new = error_label + self.xi * error_data
-
-                    time_error = np.append(time_error, np.array([[elapsed_time, error_data, error_label]]), axis=0)
                     print('--- Iteration %i: Training loss --- [Data, Label, Total] = [%f.3, %f.3, %f.3]' % (step, error_data, error_label, total_error_new))
 
-                    self.result_dict.update({'Relative_reconstruction_loss (training)': rel_error_data})
-                    self.result_dict.update({'Classification_loss (training)': error_label})
-                    self.result_dict.update({'time_error': time_error.T})
-
                     # stopping criterion
                     if (total_error > 0) and (total_error_new > 1.1 * total_error):
                         print("Early stopping: training loss increased")
@@ -494,12 +680,9 @@ class SDL_BCD():
                         break
 
         ### fine-tune beta
-        X0_comp = W[0].T @ X[0]
-        if self.X_auxiliary is not None:
-            X0_comp = np.vstack((X0_comp, self.X_auxiliary[:,:]))
-        clf = LogisticRegression(random_state=0).fit(X0_comp.T, self.X[1][0,:])
-        W[1][0,1:] = clf.coef_[0]
-        W[1][0,0] = clf.intercept_[0]
+        if fine_tune_beta:
+            X0_comp = self.sufficient_stat('X0_comp', W0=W[0])
+            W[1] = fit_logistic_newton(self.X[1], X0_comp, W[1])
 
         self.validation(result_dict = self.result_dict, prediction_method_list=prediction_method_list)
         #threshold = self.result_dict.get('Opt_threshold')
@@ -508,6 +691,459 @@ class SDL_BCD():
 
         return self.result_dict
 
+
+    def fit_lbfgs(self,
+                  iter=100,
+                  if_compute_recons_error=False,
+                  fine_tune_beta=True,
+                  prediction_method_list=None,
+                  stopping_diff=1e-9):
+        '''
+        Filter-based SDL by bound-constrained L-BFGS (scipy.optimize, method 'L-BFGS-B') on the joint objective
+            xi |X0 - W0 H|^2 / 2 + Logistic_Loss(X1, beta [1; W0.T X0; X_auxiliary])
+                + L1_reg[0] |H|_1 + L2_reg[0] |H|^2 / 2 + L1_reg[1] |W0|_1 + L2_reg[1] |W0|^2 / 2
+        over the concatenated parameters (W0, H, beta), instead of alternating the dictionary, code and
+        regression sub-solves. Blocks with nonnegativity constraints get the bound >= 0 (their L1 term is then
+        linear); L1 on an unconstrained block is not smooth and is ignored. Beta is unconstrained.
+        Objective and gradient come from kernels.sdl_filter_loss_grad (W0.T @ X0 shared by all terms).
+        At most iter L-BFGS iterations, stopping_diff is the relative objective decrease for L-BFGS-B (ftol).
+        No search radius. W0 is normalized at the end (H and the code part of beta rescaled, so W0 H and the logits
+        are unchanged) and beta is fine-tuned by Newton's method as in fit (fine_tune_beta).
+        if_compute_recons_error = True logs [time, data, label] in time_error after every L-BFGS iteration
+        (time excludes the logging).
+        '''
+        X = self.X
+        r = self.n_components
+        X_sq = sq_norm(X[0])
+        self.stats = {}
+
+        W = [self.loading[0], self.loading[1]]
+        H = self.ini_code
+        # balance the scales of W0 and H (W0 H and the logits unchanged), L-BFGS is sensitive to badly scaled blocks
+        c = np.sqrt(np.linalg.norm(H) / np.linalg.norm(W[0]))
+        W = [W[0] * c, W[1].copy()]
+        W[1][:, 1:r+1] /= c
+        H = H / c
+        shapes = [W[0].shape, H.shape, W[1].shape]
+        sizes = [int(np.prod(shape)) for shape in shapes]
+        nonnegativity = [self.nonnegativity[1], self.nonnegativity[0], False]  # W0, H, beta
+        a1 = [self.L1_reg[1], self.L1_reg[0], 0]
+        a2 = [self.L2_reg[1], self.L2_reg[0], 0]
+        for k in [0, 1]:
+            if (a1[k] != 0) and (not nonnegativity[k]):
+                print('!!! fit_lbfgs: L1 regularizer ignored for the unconstrained', ['dictionary', 'code'][k])
+                a1[k] = 0
+
+        def unpack(x):
+            blocks = np.split(x, np.cumsum(sizes)[:-1])
+            return [b.reshape(shape).astype(self.dtype, copy=False) for b, shape in zip(blocks, shapes)]
+
+        last = {}
+        def fun(x):
+            V = unpack(x)
+            loss, grads, error_data, error_label = sdl_filter_loss_grad(X, V[0], V[1], V[2], xi=self.xi,
+                                                                        X_auxiliary=self.X_auxiliary, X_sq=X_sq)
+            for k in [0, 1]:
+                if a1[k] != 0:
+                    loss += a1[k] * np.sum(V[k])
+                    grads[k] += a1[k]
+                if a2[k] != 0:
+                    loss += a2[k] * np.sum(V[k] ** 2) / 2
+                    grads[k] += a2[k] * V[k]
+            last.update({'x': x.copy(), 'error_data': error_data, 'error_label': error_label})
+            return float(loss), np.concatenate([G.ravel() for G in grads]).astype(np.float64)
+
+        lb = np.concatenate([np.full(size, 0 if nonneg else -np.inf) for size, nonneg in zip(sizes, nonnegativity)])
+        x0 = np.concatenate([np.asarray(V, dtype=np.float64).ravel() for V in [W[0], H, W[1]]])
+
+        time_error = np.zeros(shape=[0, 3])
+        elapsed_time = 0
+        start = time.time()
+        def callback(xk):
+            nonlocal time_error, elapsed_time, start
+            elapsed_time += time.time() - start
+            if if_compute_recons_error:
+                if not np.array_equal(xk, last['x']):
+                    fun(xk)
+                time_error = np.append(time_error, np.array([[elapsed_time, last['error_data'], last['error_label']]]), axis=0)
+            start = time.time()
+
+        res = minimize(fun, x0, jac=True, method='L-BFGS-B', bounds=Bounds(lb, np.inf), callback=callback,
+                       options={'maxiter': int(iter), 'ftol': stopping_diff})
+        print('--- L-BFGS-B: %i iterations, %i evaluations, objective %f (%s)' % (res.nit, res.nfev, res.fun, res.message))
+
+        W0, H, beta = unpack(res.x)
+        c = np.linalg.norm(W0)
+        W = [W0 / c, beta.copy()]
+        H = H * c
+        W[1][:, 1:r+1] *= c
+        self.W_version += 1
+        self.H_version += 1
+
+        ### fine-tune beta
+        if fine_tune_beta:
+            X0_comp = self.sufficient_stat('X0_comp', W0=W[0])
+            W[1] = fit_logistic_newton(self.X[1], X0_comp, W[1])
+
+        self.loading = W
+        self.code = H
+        self.result_dict.update({'loading': W})
+        self.result_dict.update({'code': H})
+        self.result_dict.update({'iter': res.nit})
+        self.result_dict.update({'n_components': self.n_components})
+        if if_compute_recons_error:
+            self.result_dict.update({'Relative_reconstruction_loss (training)': time_error[-1, 1] / X_sq if len(time_error) > 0 else None})
+            self.result_dict.update({'Classification_loss (training)': time_error[-1, 2] if len(time_error) > 0 else None})
+            self.result_dict.update({'time_error': time_error.T})
+
+        self.validation(result_dict = self.result_dict,
+                        prediction_method_list=['filter'] if prediction_method_list is None else prediction_method_list)
+        return self.result_dict
+
+
+    def fit_parallel(self,
+                     option="filter", #or "feature"
+                     iter=100,
+                     beta=1,
+                     dict_update_freq=1,
+                     search_radius_const=1000,
+                     if_compute_recons_error=False,
+                     update_nuance_param=False,
+                     if_validate=False,
+                     fine_tune_beta=True,
+                     prediction_method_list=None,
+                     code_update_mode='row',
+                     radius_norm='spectral',
+                     n_jobs=2):
+        '''
+        Data-parallel version of fit (solver='pgd') over n_jobs worker processes (see sdl_worker).
+        The columns of X = [X0, X1], X_auxiliary and the code H are split into n_jobs contiguous shards that are
+        copied once into shared memory (kernels.share_array, see start_sdl_workers); the workers update their
+        code shards in place and the code is gathered at the end. Each outer iteration:
+            1. dictionary: H H.T and X0 H.T summed over the shards; in filter mode every projected gradient step
+               also sums the logistic part X0 (P - X1).T beta_code of the shards (update_dict_joint_logistic
+               with grad_pred_fn); in feature mode the dictionary step only needs the summed statistics
+            2. code: each worker updates its shard (the code is column-separable) within radius
+               r sqrt(n_shard / n), so that the whole update stays within r
+            3. beta: Newton's method on the logistic loss, Hessians and gradients summed over the shards
+               (kernels.fit_logistic_newton_sum)
+        Per iteration only (d x r) and (r x r) matrices and the regression parameters are sent between processes.
+        Each worker limits its BLAS pool to cpu_count / n_jobs threads (threadpoolctl, if installed).
+        if_compute_recons_error = True logs [time, data, label] in time_error every iteration (time excludes the
+        logging). if_validate, fine_tune_beta and prediction_method_list as in fit. Returns self.result_dict as fit.
+        '''
+        X = self.X
+        r = self.n_components
+        n = X[0].shape[1]
+        X_sq = sq_norm(X[0])
+        self.stats = {}
+        W = [np.array(self.loading[0], dtype=self.dtype), np.array(self.loading[1], dtype=self.dtype)]
+        if prediction_method_list is None:
+            prediction_method_list = ['filter'] if option == 'filter' else ['naive']
+
+        workers, handles = start_sdl_workers(X, self.X_auxiliary, np.asarray(self.ini_code, dtype=self.dtype), n_jobs)
+        try:
+            call = lambda name, *args: worker_call(workers, name, *args)
+            all_reduce = lambda name, *args: worker_all_reduce(workers, name, *args)
+
+            def fit_beta(W1, design):
+                evaluate = lambda B, compute_hess: all_reduce('logistic', B, design, W[0], self.W_version, compute_hess)
+                return fit_logistic_newton_sum(evaluate, W1).astype(self.dtype, copy=False)
+
+            time_error = np.zeros(shape=[0, 3])
+            elapsed_time = 0
+            for step in trange(int(iter)):
+                start = time.time()
+                if beta is not None:
+                    search_radius = float(search_radius_const * (float(step + 1)) ** (-beta) / np.log(float(step + 2)))
+                else:
+                    search_radius = None
+
+                # Dictionary Update
+                if step % dict_update_freq == 0:
+                    HHt, XHt = all_reduce('stats')
+                    if option == 'filter':
+                        W[0] = self.update_dict_joint_logistic(X, None, W, stopping_diff=0.0001, sub_iter=5,
+                                                               r=search_radius, nonnegativity=self.nonnegativity[1],
+                                                               a1=self.L1_reg[1], a2=self.L2_reg[1], A=HHt, XHt=XHt,
+                                                               grad_pred_fn=lambda W1: all_reduce('dict_grad', W1, W[1]))
+                    else:
+                        W[0] = update_code_within_radius(None, None, W[0].T, stopping_grad_ratio=0.01,
+                                                         r=search_radius, nonnegativity=self.nonnegativity[1],
+                                                         a1=self.L1_reg[1], a2=self.L2_reg[1], A=HHt, B=XHt.T).T
+                    W[0] /= np.linalg.norm(W[0])
+                    self.W_version += 1
+
+                # Code Update (and beta before the code in feature mode, as in fit)
+                if option == 'feature':
+                    W[1] = fit_beta(W[1], 'feature')
+                call('code', option, W, self.W_version, W[0].T @ W[0], search_radius, n,
+                     {'a1': self.L1_reg[0], 'a2': self.L2_reg[0], 'nonnegativity': self.nonnegativity[0],
+                      'xi': self.xi, 'mode': code_update_mode, 'radius_norm': radius_norm})
+                self.H_version += 1
+                if option == 'filter':
+                    W[1] = fit_beta(W[1], 'filter')
+
+                if update_nuance_param:
+                    self.xi = (1/(2*r*n)) * all_reduce('loss', W[0], self.W_version, W[1])[0]
+                    print('xi updated by MLE:', self.xi)
+
+                elapsed_time += time.time() - start
+
+                if if_compute_recons_error:
+                    error_data, error_label = all_reduce('loss', W[0], self.W_version, W[1])
+                    time_error = np.append(time_error, np.array([[elapsed_time, error_data, error_label]]), axis=0)
+                    self.result_dict.update({'Relative_reconstruction_loss (training)': error_data / X_sq})
+                    self.result_dict.update({'Classification_loss (training)': error_label})
+                    self.result_dict.update({'time_error': time_error.T})
+                    if (step % 10) == 0:
+                        print('--- Iteration %i: Training loss --- [Data, Label, Total] = [%f.3, %f.3, %f.3]' %
+                              (step, error_data, error_label, error_label + self.xi * error_data))
+
+                if if_validate and (step % 10 == 0) and (step > 1):
+                    self.loading = W
+                    self.result_dict.update({'loading': W})
+                    self.validation(result_dict = self.result_dict,
+                                    prediction_method_list=prediction_method_list,
+                                    verbose=True)
+                    threshold = self.result_dict.get('Opt_threshold')
+                    ACC = self.result_dict.get('Accuracy')
+                    if ACC>0.99:
+                        print('!!! --- Validation (Stopped) --- [threshold, ACC] = ', [np.round(threshold,3), np.round(ACC,3)])
+                        break
+
+            ### fine-tune beta
+            if fine_tune_beta:
+                W[1] = fit_beta(W[1], 'filter')
+            self.code = np.hstack(call('get_code'))
+        finally:
+            stop_sdl_workers(workers, handles)
+
+        self.loading = W
+        self.result_dict.update({'loading': W})
+        self.result_dict.update({'code': self.code})
+        self.result_dict.update({'iter': iter})
+        self.result_dict.update({'n_components': self.n_components})
+        self.result_dict.update({'dict_update_freq' : dict_update_freq})
+        self.result_dict.update({'n_jobs' : n_jobs})
+        self.validation(result_dict = self.result_dict, prediction_method_list=prediction_method_list)
+        return self.result_dict
+
+
+    def fit_admm(self,
+                 option="filter", #or "feature"
+                 iter=20,
+                 local_iter=5,
+                 rho=100,
+                 beta=1,
+                 search_radius_const=1000,
+                 if_compute_recons_error=False,
+                 update_nuance_param=False,
+                 if_validate=False,
+                 fine_tune_beta=True,
+                 prediction_method_list=None,
+                 code_update_mode='block',
+                 radius_norm='spectral',
+                 n_jobs=2,
+                 address=None):
+        '''
+        Consensus ADMM version of fit over n_jobs worker processes, each holding a contiguous column shard of
+        X = [X0, X1], X_auxiliary and the code (see start_sdl_workers). Every worker keeps a local copy
+        [W_p, beta_p] of the loading and runs local_iter block coordinate descent iterations per round with the
+        existing local solvers (see worker_admm); the shards only synchronize once per round through the consensus
+            Z = mean_p (x_p + U_p),  W part projected to nonnegativity[1]
+        so iter is the number of communication rounds. rho = weight of the consensus penalty rho |x_p - Z + U_p|^2 / 2
+        (in units of the loss, which grows with the shard size)
+        address=None : processes on this machine with shared memory and pipes
+        address=(host, port) : workers connect over sockets (multiprocessing.connection) and receive their shards
+        Codes are updated within the shard radius of the schedule search_radius_const (step+1)^(-beta) / log(step+2).
+        if_compute_recons_error = True logs [time, data, label] at Z every round (time excludes the logging; label loss
+        of the filter or feature design of option).
+        update_nuance_param, if_validate and prediction_method_list as in fit, evaluated at Z after every round.
+        At the end the dictionary is normalized (the code rescaled) and beta fine-tuned (fine_tune_beta) as in fit_parallel.
+        Returns self.result_dict as fit.
+        '''
+        X = self.X
+        r = self.n_components
+        n = X[0].shape[1]
+        X_sq = sq_norm(X[0])
+        self.stats = {}
+        Z = [np.array(self.loading[0], dtype=self.dtype), np.array(self.loading[1], dtype=self.dtype)]
+        if prediction_method_list is None:
+            prediction_method_list = ['filter'] if option == 'filter' else ['naive']
+        if code_update_mode not in ['row', 'block']:
+            raise ValueError("fit_admm needs code_update_mode 'row' or 'block' (got %r)" % code_update_mode)
+        if (self.xi is None) or (self.xi <= 0):
+            raise ValueError("fit_admm needs xi > 0, the local dictionary step is scaled by rho / xi (got xi=%r)" % self.xi)
+        params = {'a1': self.L1_reg[0], 'a2': self.L2_reg[0], 'nonnegativity': self.nonnegativity[0],
+                  'a1_dict': self.L1_reg[1], 'a2_dict': self.L2_reg[1], 'nonnegativity_dict': self.nonnegativity[1],
+                  'xi': self.xi, 'mode': code_update_mode, 'radius_norm': radius_norm}
+
+        workers, handles = start_sdl_workers(X, self.X_auxiliary, np.asarray(self.ini_code, dtype=self.dtype), n_jobs,
+                                             address=address)
+        try:
+            call = lambda name, *args: worker_call(workers, name, *args)
+            all_reduce = lambda name, *args: worker_all_reduce(workers, name, *args)
+
+            time_error = np.zeros(shape=[0, 3])
+            elapsed_time = 0
+            for step in trange(int(iter)):
+                start = time.time()
+                if beta is not None:
+                    search_radius = float(search_radius_const * (float(step + 1)) ** (-beta) / np.log(float(step + 2)))
+                else:
+                    search_radius = None
+
+                # local BCD iterations, then the consensus update
+                results = call('admm', option, Z, search_radius, n, local_iter, rho, n_jobs, params)
+                Z = [sum(x[i] for x in results) / n_jobs for i in [0, 1]]
+                if self.nonnegativity[1]:
+                    Z[0] = np.maximum(Z[0], 0)
+                self.W_version += 1
+                self.H_version += 1
+
+                if update_nuance_param:
+                    self.xi = (1/(2*r*n)) * all_reduce('loss', Z[0], self.W_version, Z[1], option)[0]
+                    params['xi'] = self.xi
+                    print('xi updated by MLE:', self.xi)
+
+                elapsed_time += time.time() - start
+
+                if if_compute_recons_error:
+                    error_data, error_label = all_reduce('loss', Z[0], self.W_version, Z[1], option)
+                    time_error = np.append(time_error, np.array([[elapsed_time, error_data, error_label]]), axis=0)
+                    self.result_dict.update({'Relative_reconstruction_loss (training)': error_data / X_sq})
+                    self.result_dict.update({'Classification_loss (training)': error_label})
+                    self.result_dict.update({'time_error': time_error.T})
+                    if (step % 10) == 0:
+                        print('--- Round %i: Training loss --- [Data, Label, Total] = [%f.3, %f.3, %f.3]' %
+                              (step, error_data, error_label, error_label + self.xi * error_data))
+
+                if if_validate and (step % 10 == 0) and (step > 1):
+                    self.loading = Z
+                    self.result_dict.update({'loading': Z})
+                    self.validation(result_dict = self.result_dict,
+                                    prediction_method_list=prediction_method_list,
+                                    verbose=True)
+                    threshold = self.result_dict.get('Opt_threshold')
+                    ACC = self.result_dict.get('Accuracy')
+                    if ACC>0.99:
+                        print('!!! --- Validation (Stopped) --- [threshold, ACC] = ', [np.round(threshold,3), np.round(ACC,3)])
+                        break
+
+            ### normalize the dictionary (W H and the predictions unchanged) and fine-tune beta
+            scale = np.linalg.norm(Z[0])
+            Z[0] /= scale
+            Z[1][:, 1:r+1] *= scale if option == 'filter' else 1 / scale
+            self.W_version += 1
+            if fine_tune_beta:
+                evaluate = lambda B, compute_hess: all_reduce('logistic', B, 'filter', Z[0], self.W_version, compute_hess)
+                Z[1] = fit_logistic_newton_sum(evaluate, Z[1]).astype(self.dtype, copy=False)
+            self.code = np.hstack(call('get_code')) * scale
+        finally:
+            stop_sdl_workers(workers, handles)
+
+        self.loading = Z
+        self.result_dict.update({'loading': Z})
+        self.result_dict.update({'code': self.code})
+        self.result_dict.update({'iter': iter})
+        self.result_dict.update({'n_components': self.n_components})
+        self.result_dict.update({'n_jobs' : n_jobs})
+        self.result_dict.update({'rho' : rho})
+        self.validation(result_dict = self.result_dict, prediction_method_list=prediction_method_list)
+        return self.result_dict
+
+
+    def partial_fit(self,
+                    X_batch,
+                    Y_batch,
+                    X_aux_batch=None,
+                    option="filter", #or "feature"
+                    search_radius=None,
+                    sub_iter=10):
+        '''
+        Online (mini-batch) SDL in the spirit of online dictionary learning (Mairal et al. 2010):
+        update W = [dict, beta] from a new batch of columns [X_batch, Y_batch] in time proportional to the batch
+            1. code H_b of the batch under the current W (filter: |X_b - W[0] H|^2, feature: jointly with the labels)
+            2. running sufficient statistics HH^T += H_b H_b^T and XH^T += X_b H_b^T
+            3. dictionary step on the surrogate loss given by the running statistics
+               (rescaled to the batch size, plus the batch logistic loss in filter mode)
+            4. online Newton step for beta with the accumulated logistic Hessian (see kernels.update_logistic_online)
+        X_aux_batch : auxiliary covariates of the batch (d3 x n_batch), required (ValueError) if the model has X_auxiliary
+        search_radius : trust-region radius for the dictionary step (None = no restriction)
+        Running statistics are kept in self.online_state and created by the first call.
+        '''
+        n_batch = X_batch.shape[1]
+        if (self.d3 > 0) and (X_aux_batch is None):
+            raise ValueError('partial_fit: the model has %i auxiliary covariates, so X_aux_batch (%i x %i) is required'
+                             % (self.d3, self.d3, n_batch))
+        if (X_aux_batch is not None) and (X_aux_batch.shape != (self.d3, n_batch)):
+            raise ValueError('partial_fit: X_aux_batch has shape %s, expected (%i, %i)'
+                             % (X_aux_batch.shape, self.d3, n_batch))
+        W = [self.loading[0].copy(), self.loading[1].copy()]
+        r = self.n_components
+        X_batch, Y_batch, X_aux_batch = [as_dtype(Z, self.dtype) for Z in [X_batch, Y_batch, X_aux_batch]]
+        if search_radius is not None:
+            search_radius = float(search_radius)
+
+        if getattr(self, 'online_state', None) is None:
+            self.online_state = {'HHt': np.zeros((r, r), dtype=self.dtype),
+                                 'XHt': np.zeros((X_batch.shape[0], r), dtype=self.dtype),
+                                 'hess': np.zeros((W[1].shape[0], W[1].shape[1], W[1].shape[1]), dtype=self.dtype),
+                                 'n_samples': 0}
+        state = self.online_state
+
+        # Code of the new batch
+        if (not self.nonnegativity[0]) and (self.L1_reg[0] == 0):
+            H = ridge_solve(self.sufficient_stat('WtW_factor', W0=W[0]), W[0].T @ X_batch)  # closed form
+        else:
+            H = update_code_within_radius(X_batch, W[0], None, r=None, sub_iter=[sub_iter],
+                                          a1=self.L1_reg[0], a2=self.L2_reg[0],
+                                          nonnegativity=self.nonnegativity[0])
+        if option == "feature":
+            # refine jointly with the labels, starting from the unsupervised code
+            H = update_code_joint_logistic([X_batch, Y_batch], W, H, r=None,
+                                           X_auxiliary=X_aux_batch,
+                                           a1=self.L1_reg[0], a2=self.L2_reg[0],
+                                           xi=self.xi, sub_iter=sub_iter, stopping_diff=0.0001,
+                                           nonnegativity=self.nonnegativity[0], mode='block')
+
+        # Running sufficient statistics
+        state['HHt'] += H @ H.T
+        state['XHt'] += X_batch @ H.T
+        state['n_samples'] += n_batch
+        scale = n_batch / state['n_samples']  # running averages times the batch size
+
+        # Dictionary
+        if option == "filter":
+            W[0] = self.update_dict_joint_logistic([X_batch, Y_batch], H, [W[0], W[1]], stopping_diff=0.0001,
+                                                   sub_iter=5,
+                                                   r=search_radius, nonnegativity=self.nonnegativity[1],
+                                                   a1=self.L1_reg[1], a2=self.L2_reg[1],
+                                                   A=scale * state['HHt'], XHt=scale * state['XHt'],
+                                                   X_auxiliary=X_aux_batch)
+        elif option == "feature":
+            W[0] = update_code_within_radius(X_batch.T, H.T, W[0].T,
+                                             r=search_radius, nonnegativity=self.nonnegativity[1],
+                                             a1=self.L1_reg[1], a2=self.L2_reg[1],
+                                             A=scale * state['HHt'], B=scale * state['XHt'].T).T
+        W[0] /= np.linalg.norm(W[0])
+        self.W_version += 1
+
+        # Beta
+        if option == "filter":
+            H1 = W[0].T @ X_batch
+        elif option == "feature":
+            H1 = H
+        if X_aux_batch is not None:
+            H1 = np.vstack((H1, X_aux_batch))
+        W[1] = update_logistic_online(Y_batch, H1, W[1], state['hess'])
+
+        self.loading = W
+        self.result_dict.update({'loading': W})
+        self.result_dict.update({'n_samples (online)': state['n_samples']})
+        return self.result_dict
+
     def validation(self,
                     result_dict=None,
                     X_test = None,
@@ -569,8 +1205,8 @@ class SDL_BCD():
 
             # Compute test data reconstruction loss
             H_test = self.sparse_code(X_test[0], W[0])
-            error_data = np.linalg.norm((X_test[0] - W[0] @ H_test).reshape(-1, 1), ord=2)
-            rel_error_data = error_data / np.linalg.norm(X_test[0].reshape(-1, 1), ord=2)
+            error_data = np.sqrt(recons_error(X_test[0], W[0], H_test))
+            rel_error_data = error_data / np.sqrt(sq_norm(X_test[0]))
 
 
             # Save results
@@ -625,11 +1261,11 @@ class SDL_BCD():
             if method == 'filter':
                 # Get threshold from training set
                 X0_comp = W[0].T @ self.X[0]
-                X0_ext = np.vstack((np.ones(self.X[1].shape[1]), X0_comp))
+                X0_ext = np.vstack((np.ones(self.X[1].shape[1], dtype=self.dtype), X0_comp))
                 if self.d3>0:
                     X0_ext = np.vstack((X0_ext, self.X_auxiliary))
                 P_pred = np.matmul(W[1], X0_ext)
-                P_pred = 1 / (np.exp(-P_pred) + 1)
+                P_pred = sigmoid(P_pred)
                 # print('!!! error norm', np.linalg.norm(X[1][0, :]-P_pred[0,:])/X[1].shape[1])
                 fpr, tpr, thresholds = metrics.roc_curve(self.X[1][0, :], P_pred[0,:], pos_label=None)
                 pred_threshold = thresholds[np.argmax(tpr - fpr)]
@@ -637,12 +1273,12 @@ class SDL_BCD():
 
             else:
                 # Get threshold from training set
-                X0_comp = self.sparse_code(self.X[0], W[0])
-                X0_ext = np.vstack((np.ones(self.X[1].shape[1]), X0_comp))
+                X0_comp = self.sparse_code(self.X[0], W[0], H0=self.code)
+                X0_ext = np.vstack((np.ones(self.X[1].shape[1], dtype=self.dtype), X0_comp))
                 if self.d3>0:
                     X0_ext = np.vstack((X0_ext, self.X_auxiliary))
                 P_pred = np.matmul(W[1], X0_ext)
-                P_pred = 1 / (np.exp(-P_pred) + 1)
+                P_pred = sigmoid(P_pred)
                 # print('!!! error norm', np.linalg.norm(X[1][0, :]-P_pred[0,:])/X[1].shape[1])
                 fpr, tpr, thresholds = metrics.roc_curve(self.X[1][0, :], P_pred[0,:], pos_label=None)
                 pred_threshold = thresholds[np.argmax(tpr - fpr)]
@@ -658,9 +1294,9 @@ class SDL_BCD():
             H = W[0].T @ X_test
             if X_test_aux is not None:
                 H = np.vstack((H, X_test_aux))
-            H2 = np.vstack((np.ones(H.shape[1]), H))
+            H2 = np.vstack((np.ones(H.shape[1], dtype=self.dtype), H))
             P_pred = np.matmul(H2.T, W[1].T)
-            P_pred = 1 / (np.exp(-P_pred) + 1)  # predicted probability for Y_test
+            P_pred = sigmoid(P_pred)  # predicted probability for Y_test
 
             Y_hat = P_pred.copy()
             Y_hat[Y_hat < pred_threshold] = 0
@@ -675,9 +1311,9 @@ class SDL_BCD():
                 # search_radius = search_radius_const * (float(step + 1)) ** (-beta) / np.log(float(step + 2))
 
                 # Update the missing label P_pred
-                H_ext = np.vstack((np.ones(X_test.shape[1]), H))
+                H_ext = np.vstack((np.ones(X_test.shape[1], dtype=self.dtype), H))
                 P_pred = np.matmul(W[1], H_ext)
-                P_pred = 1 / (np.exp(-P_pred) + 1)
+                P_pred = sigmoid(P_pred)
                 X = [X_test, P_pred]
 
                 # Update code
@@ -694,11 +1330,11 @@ class SDL_BCD():
             # Prediction for test set
             H = self.sparse_code(X_test, W[0])
             #print('---- H naive shape', H.shape)
-            H_ext = np.vstack((np.ones(X_test.shape[1]), H))
+            H_ext = np.vstack((np.ones(X_test.shape[1], dtype=self.dtype), H))
             if X_test_aux is not None:
                 H_ext = np.vstack((H_ext, X_test_aux))
             P_pred = np.matmul(W[1], H_ext)
-            P_pred = 1 / (np.exp(-P_pred) + 1)
+            P_pred = sigmoid(P_pred)
 
             # threshold predictive probabilities to get predictions
             Y_hat = P_pred.copy()
@@ -710,8 +1346,8 @@ class SDL_BCD():
 
         elif method == 'alt':
             #print('alternating prection..')
-            H = np.random.rand(r,n)
-            Y_hat = np.random.rand(self.X[1].shape[0], X_test.shape[1])
+            H = np.random.rand(r,n).astype(self.dtype)
+            Y_hat = np.random.rand(self.X[1].shape[0], X_test.shape[1]).astype(self.dtype)
             for step in trange(int(200)):
                 X = [X_test, Y_hat]
 
@@ -719,13 +1355,13 @@ class SDL_BCD():
                 radius = 10/(step+1)
                 H = self.update_code_joint_logistic(X, W, H, r=radius, sub_iter = 2, stopping_diff=0.0001)
                 # Update the missing label P_pred
-                H_ext = np.vstack((np.ones(X_test.shape[1]), H))
+                H_ext = np.vstack((np.ones(X_test.shape[1], dtype=self.dtype), H))
 
                 if X_test_aux is not None:
                     H_ext = np.vstack((H_ext, X_test_aux))
 
                 P_pred = np.matmul(W[1], H_ext)
-                P_pred = 1 / (np.exp(-P_pred) + 1)
+                P_pred = sigmoid(P_pred)
                 Y_hat = P_pred
 
                 # threshold predictive probabilities to get predictions
@@ -743,17 +1379,17 @@ class SDL_BCD():
             for i in trange(n):
                 loss_list = []
                 h_list = []
-                x_test = X_test[:,i][:,np.newaxis]
+                x_test = X_test[:,[i]]
 
                 for j in np.arange(2):
                     y_guess = np.asarray([[j]])
                     x_guess = [x_test, y_guess]
                     h = self.update_code_joint_logistic(x_guess, W, xi=self.xi, sub_iter=40,
                                                         stopping_diff=0.001, H0=None, r=None)
-                    h_ext = np.vstack((np.ones(1), h))
-                    error_data = np.linalg.norm((x_test - W[0] @ h).reshape(-1, 1), ord=2) ** 2
-                    error_label = np.sum(np.log(1+np.exp(W[1] @ h_ext))) - y_guess @ (W[1] @ h_ext).T
-                    loss = (error_label + self.xi * error_data)[0,0]
+                    h_ext = np.vstack((np.ones(1, dtype=self.dtype), h))
+                    error_data = recons_error(x_test, W[0], h)
+                    error_label = logistic_loss_grad(W[1], h_ext, y_guess, compute_grad=False)[0]
+                    loss = error_label + self.xi * error_data
                     # print('[j, loss] = ', [j, loss])
                     loss_list.append(loss)
                     h_list.append(h)
@@ -771,9 +1407,9 @@ class SDL_BCD():
             #print('--- Y_hat', Y_hat)
             H = np.asarray(H).T
             H -= np.mean(H)
-            H_ext = np.vstack((np.ones(X_test.shape[1]), H))
+            H_ext = np.vstack((np.ones(X_test.shape[1], dtype=self.dtype), H))
             P_pred = np.matmul(W[1], H_ext)
-            P_pred = 1 / (np.exp(-P_pred) + 1)
+            P_pred = sigmoid(P_pred)
             P_pred = P_pred[0,:]
 
         self.result_dict.update({'code_test': H})
@@ -784,100 +1420,261 @@ class SDL_BCD():
 
 ###### Helper functions
 
-def sparseness(x):
-    """Hoyer's measure of sparsity for a vector"""
-    sqrt_n = np.sqrt(len(x))
-    return (sqrt_n - np.linalg.norm(x, 1) / norm(x)) / (sqrt_n - 1)
-
-
-def safe_vstack(Xs):
-    if any(sp.issparse(X) for X in Xs):
-        return sp.vstack(Xs)
+def start_sdl_workers(X, X_auxiliary, H0, n_jobs, address=None):
+    '''
+    Start n_jobs sdl_worker processes on contiguous column shards of X = [X0, X1], X_auxiliary and the code H0.
+    address=None : the shards are copied once into shared memory (kernels.share_array), commands go through pipes
+    address=(host, port) : the workers connect to a multiprocessing.connection.Listener at address (local TCP
+                           sockets) and receive their shards through the connection, as a worker on another
+                           machine started with sdl_worker_socket would
+    Each worker limits its BLAS pool to cpu_count / n_jobs threads (threadpoolctl, if installed).
+    Returns the list of (process, connection) and the SharedMemory handles; see worker_call and stop_sdl_workers.
+    '''
+    n = X[0].shape[1]
+    bounds = np.linspace(0, n, n_jobs + 1).astype(int)
+    n_threads = max(1, (os.cpu_count() or 1) // n_jobs)
+    shards, handles = [], []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        shard = {}
+        for key, Z in [('X0', X[0]), ('X1', X[1]), ('X_aux', X_auxiliary), ('H', H0)]:
+            if Z is None:
+                continue
+            if address is None:
+                h, shard[key] = share_array(Z[:, lo:hi])
+                handles += h
+            else:
+                shard[key] = Z[:, lo:hi]
+        shards.append(shard)
+
+    workers = []
+    if address is None:
+        for shard in shards:
+            parent_conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=sdl_worker, args=(child_conn, shard, n_threads), daemon=True)
+            process.start()
+            workers.append((process, parent_conn))
     else:
-        return np.vstack(Xs)
+        authkey = multiprocessing.current_process().authkey
+        with multiprocessing.connection.Listener(address, authkey=authkey) as listener:
+            processes = [multiprocessing.Process(target=sdl_worker_socket, args=(listener.address, authkey, n_threads),
+                                                 daemon=True) for shard in shards]
+            for process in processes:
+                process.start()
+            for process, shard in zip(processes, shards):
+                conn = listener.accept()
+                conn.send(shard)
+                workers.append((process, conn))
+    return workers, handles
+
+
+def worker_call(workers, name, *args):
+    # run a command on all workers, return the list of results (an exception of a worker is raised here)
+    for _, conn in workers:
+        conn.send((name, args))
+    results = [conn.recv() for _, conn in workers]
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return results
+
+
+def worker_all_reduce(workers, name, *args):
+    # sum of the worker results (arrays or tuples of arrays and None)
+    results = worker_call(workers, name, *args)
+    if isinstance(results[0], tuple):
+        return tuple(None if z[0] is None else sum(z) for z in zip(*results))
+    return sum(results)
+
+
+def stop_sdl_workers(workers, handles):
+    # close the workers and free the shared memory of start_sdl_workers
+    for process, conn in workers:
+        if process.is_alive():
+            conn.send(('close', ()))
+        process.join()
+        conn.close()
+    for h in handles:
+        h.close()
+        h.unlink()
+
+
+def sdl_worker_socket(address, authkey, n_threads=1):
+    '''
+    sdl_worker that connects to the Listener of start_sdl_workers at address and receives its shard
+    (arrays) through the connection
+    '''
+    with multiprocessing.connection.Client(address, authkey=authkey) as conn:
+        sdl_worker(conn, conn.recv(), n_threads)
 
 
-def update_code_within_radius(X, W, H0, r, a1=0, a2=0,
-                              sub_iter=[2], stopping_grad_ratio=0.0001,
-                              subsample_ratio=None, nonnegativity=True,
-                              use_line_search=False):
+def sdl_worker(conn, shard, n_threads=1):
     '''
-    Find \hat{H} = argmin_H ( | X - WH| + alpha|H| ) within radius r from H0
-    Use row-wise projected gradient descent
-    Do NOT sparsecode the whole thing and then project -- instable
-    12/5/2020 Lyu
-
-    For NTF problems, X is usually tall and thin so it is better to subsample from rows
-    12/25/2020 Lyu
+    Worker process of SDL_BCD.fit_parallel and fit_admm. shard = its columns of X0, X1, X_auxiliary and the
+    code ('X0', 'X1', 'X_aux', 'H'), as arrays or share_array descriptors.
+    Answers commands (name, args) received on conn with sdl_worker_commands[name](state, *args)
+    (exceptions are sent back) until 'close'.
+    '''
+    if threadpool_limits is not None:
+        threadpool_limits(n_threads)
+    state, handles = {'X_aux': None, 'WtX': (None, None)}, []
+    for key, value in shard.items():
+        if isinstance(value, tuple):
+            state[key], h = attach_array(value)
+            handles += h
+        else:
+            state[key] = value
 
-    Apply single round of AdaGrad for rows, stop when gradient norm is small and do not make update
-    12/27/2020 Lyu
+    while True:
+        name, args = conn.recv()
+        if name == 'close':
+            break
+        try:
+            conn.send(sdl_worker_commands[name](state, *args))
+        except Exception as e:
+            conn.send(e)
+    state.clear()
+    for h in handles:
+        h.close()
+
+
+def worker_WtX(state, W0, W_version):
+    # W0.T @ X0 of the shard, cached per dictionary version (W_version=None: not cached)
+    if W_version is None:
+        return np.asarray(state['X0'].T @ W0).T
+    if state['WtX'][0] != W_version:
+        state['WtX'] = (W_version, np.asarray(state['X0'].T @ W0).T)
+    return state['WtX'][1]
+
+
+def worker_design(state, design, W0, W_version=None):
+    # [1; W0.T @ X0 (filter) or H (feature); X_auxiliary] of the shard (W_version=None: W0.T @ X0 not cached)
+    if design == 'filter':
+        Z = worker_WtX(state, W0, W_version)
+    else:
+        Z = state['H']
+    Z = np.vstack((np.ones((1, Z.shape[1]), dtype=Z.dtype), Z))
+    if state['X_aux'] is not None:
+        Z = np.vstack((Z, state['X_aux']))
+    return Z
+
+
+def worker_stats(state):
+    H = state['H']
+    return H @ H.T, np.asarray(state['X0'] @ H.T)
+
+
+def worker_dict_grad(state, W0, beta):
+    # logistic part X0 @ (P - X1).T @ beta_code of the filter-mode dictionary gradient at W0
+    r = W0.shape[1]
+    H1_ext = worker_design(state, 'filter', W0)  # W0 changes every step, not cached
+    _, _, grad_ext = logistic_loss_grad(beta, H1_ext, state['X1'], wrt='H', compute_loss=False)
+    return np.asarray(state['X0'] @ grad_ext[1:r+1].T)
+
+
+def worker_code(state, option, W, W_version, WtW, r, n, params):
+    # code update of the shard within radius r sqrt(n_shard / n), written to the shared code matrix
+    n_shard = state['H'].shape[1]
+    if r is not None:
+        r = r * np.sqrt(n_shard / n)
+    WtX = worker_WtX(state, W[0], W_version)
+    if option == 'filter':
+        H = update_code_within_radius(state['X0'], W[0], state['H'], r=r, a1=params['a1'], a2=params['a2'],
+                                      nonnegativity=params['nonnegativity'], A=WtW, B=WtX)
+    else:
+        H = update_code_joint_logistic([state['X0'], state['X1']], W, state['H'], r, X_auxiliary=state['X_aux'],
+                                       a1=params['a1'], a2=params['a2'], xi=params['xi'], sub_iter=2,
+                                       stopping_diff=0.0001, nonnegativity=params['nonnegativity'],
+                                       subsample_size=int(n_shard//10) if params['mode'] == 'row' else None,
+                                       mode=params['mode'], radius_norm=params['radius_norm'], A=WtW, B=WtX)
+    state['H'][...] = H
+
+
+def worker_logistic(state, beta, design, W0, W_version, compute_hess):
+    # logistic loss of each label of the shard, its gradient and (optionally) Hessian in beta
+    Z = worker_design(state, design, W0, W_version)
+    D = beta @ Z
+    loss = np.sum(np.logaddexp(0, D) - state['X1'] * D, axis=1)
+    P = sigmoid(D)
+    grad = (P - state['X1']) @ Z.T
+    hess = None
+    if compute_hess:
+        hess = np.stack([logistic_hessian(Z[1:], P[j] * (1 - P[j])) for j in np.arange(P.shape[0])])
+    return loss, grad, hess
+
+
+def worker_admm(state, option, Z, r, n, local_iter, rho, n_shards, params):
+    '''
+    One round of consensus ADMM (SDL_BCD.fit_admm) on the shard with scaled duals U = [U_W, U_beta]:
+        U <- U + x - Z, then local_iter block coordinate descent iterations (as in fit) on the local copy x = [W, beta]
+        of  shard loss + (dictionary and beta penalties) / n_shards + rho |x - (Z - U)|^2 / 2
+    The proximal term is folded into the existing local solvers: filter dictionary by
+    kernels.update_dict_joint_logistic_fista with H H.T + (rho/xi) I and X0 H.T + (rho/xi) (Z - U), feature
+    dictionary by update_code_within_radius with H H.T + rho I and X0 H.T + rho (Z - U), beta by
+    kernels.update_logistic_online centered at Z - U with Hessian n_shards rho I. The code (not shared) is updated
+    within radius r sqrt(n_shard / n) as in worker_code. Returns x + U.
     '''
+    if 'admm' not in state:
+        state['admm'] = {'x': [Z[0].copy(), Z[1].copy()], 'U': [np.zeros_like(Z[0]), np.zeros_like(Z[1])]}
+        if option == 'filter':
+            state['admm']['X_norm_sq'] = power_iteration(state['X0'].T, gram=False)
+    x, U = state['admm']['x'], state['admm']['U']
+    for i in [0, 1]:
+        U[i] += x[i] - Z[i]
+    V = [Z[0] - U[0], Z[1] - U[1]]
+    X0, X1, H = state['X0'], state['X1'], state['H']
+    I = np.identity(H.shape[0], dtype=H.dtype)
+    d2, p = x[1].shape
+    hess = np.repeat(n_shards * rho * np.identity(p, dtype=x[1].dtype)[None], d2, axis=0)
+    a1, a2 = params['a1_dict'] / n_shards, params['a2_dict'] / n_shards
+
+    for step in np.arange(local_iter):
+        if option == 'filter':
+            x[0] = update_dict_joint_logistic_fista([X0, X1], H, x, None, xi=params['xi'], a1=a1, a2=a2,
+                                                    nonnegativity=params['nonnegativity_dict'],
+                                                    X_auxiliary=state['X_aux'],
+                                                    A=H @ H.T + (rho / params['xi']) * I,
+                                                    XHt=np.asarray(X0 @ H.T) + (rho / params['xi']) * V[0],
+                                                    X_norm_sq=state['admm']['X_norm_sq'], max_iter=10)
+            worker_code(state, option, x, None, x[0].T @ x[0], r, n, params)
+            x[1] = update_logistic_online(X1, worker_design(state, 'filter', x[0])[1:], V[1], hess.copy(), C=n_shards)
+        else:
+            x[0] = update_code_within_radius(None, None, x[0].T, None, a1=a1, a2=a2, stopping_grad_ratio=0.01,
+                                             nonnegativity=params['nonnegativity_dict'], A=H @ H.T + rho * I,
+                                             B=(np.asarray(X0 @ H.T) + rho * V[0]).T).T
+            x[1] = update_logistic_online(X1, worker_design(state, 'feature', x[0])[1:], V[1], hess.copy(), C=n_shards)
+            worker_code(state, option, x, None, x[0].T @ x[0], r, n, params)
+    return x[0] + U[0], x[1] + U[1]
 
-    # print('!!!! X.shape', X.shape)
-    # print('!!!! W.shape', W.shape)
-    # print('!!!! H0.shape', H0.shape)
 
-    if H0 is None:
-        H0 = np.random.rand(W.shape[1], X.shape[1])
-    H1 = H0.copy()
-    i = 0
-    dist = 1
-    idx = np.arange(X.shape[0])
-    H1_old = H1.copy()
-
-    A = W.T @ W
-    B = W.T @ X
+def worker_get_code(state):
+    return np.array(state['H'])
 
-    while (i < np.random.choice(sub_iter)):
-        if_continue = np.ones(H0.shape[0])  # indexed by rows of H
 
-        for k in [k for k in np.arange(H0.shape[0]) if if_continue[k]>0.5]:
+def worker_loss(state, W0, W_version, beta, design='filter'):
+    # reconstruction error and logistic loss (filter design as logged by fit, or feature design) of the shard
+    WtX = worker_WtX(state, W0, W_version)
+    error_data = recons_error(state['X0'], W0, state['H'], WtX=WtX)
+    error_label = logistic_loss_grad(beta, worker_design(state, design, W0, W_version), state['X1'],
+                                     compute_grad=False)[0]
+    return error_data, error_label
 
-            grad = np.dot(A[k, :], H1) - B[k, :]
-            grad += a1 * np.sign(H1[k, :]) * np.ones(H0.shape[1]) + a2 * H1[k, :]
-            grad_norm = np.linalg.norm(grad, 2)
 
-            # Initial step size
-            step_size = 1/(A[k,k]+1)
-            # step_size = 1 / (np.trace(A)) # use the whole trace
-            # step_size = 1
-            if r is not None:  # usual sparse coding without radius restriction
-                d = step_size * grad_norm
-                step_size = (r / max(r, d)) * step_size
+sdl_worker_commands = {'stats': worker_stats, 'dict_grad': worker_dict_grad, 'code': worker_code,
+                       'logistic': worker_logistic, 'loss': worker_loss, 'admm': worker_admm,
+                       'get_code': worker_get_code}
 
-            H1_temp = H1.copy()
-            # loss_old = np.linalg.norm(X - W @ H1)**2
-            H1_temp[k, :] = H1[k, :] - step_size * grad
-            if nonnegativity:
-                H1_temp[k,:] = np.maximum(H1_temp[k,:], np.zeros(shape=(H1.shape[1],)))  # nonnegativity constraint
-            #loss_new = np.linalg.norm(X - W @ H1_temp)**2
-            #if loss_old > loss_new:
-
-                # print('recons_loss:' , np.linalg.norm(X - W @ H1, ord=2) / np.linalg.norm(X, ord=2))
-
-            """
-            if use_line_search:
-            # Armijo backtraking line search
-                m = grad.T @ H1[k,:]
-                H1_temp = H1.copy()
-                loss_old = np.linalg.norm(X - W @ H1)**2
-                loss_new = 0
-                count = 0
-                while (count==0) or (loss_old - loss_new < 0.1 * step_size * m):
-                    step_size /= 2
-                    H1_temp[k, :] = H1[k, :] - step_size * grad
-                    if nonnegativity:
-                        H1_temp[k,:] = np.maximum(H1_temp[k,:], np.zeros(shape=(H1.shape[1],)))  # nonnegativity constraint
-                    loss_new = np.linalg.norm(X - W @ H1_temp)**2
-                    count += 1
-            """
-            H1 = H1_temp
 
-        i = i + 1
+def sparseness(x):
+    """Hoyer's measure of sparsity for a vector"""
+    sqrt_n = np.sqrt(len(x))
+    return (sqrt_n - np.linalg.norm(x, 1) / norm(x)) / (sqrt_n - 1)
 
 
-    return H1
+def safe_vstack(Xs):
+    if any(sp.issparse(X) for X in Xs):
+        return sp.vstack(Xs)
+    else:
+        return np.vstack(Xs)
 
 
 def block_dict_column_update(X, H, W0=None, r=None, alpha=0):
@@ -1065,9 +1862,9 @@ def fit_MLR_GD(Y, H, W0=None, sub_iter=100, stopping_diff=0.01):
         i = 0
         grad = np.ones(W0.shape)
         while (i < sub_iter) and (np.linalg.norm(grad) > stopping_diff):
-            Q = 1/(1+np.exp(-H.T @ W1))  # probability matrix, same shape as Y
+            _, Q, grad = logistic_loss_grad(W1.T, H, Y.T, compute_loss=False)  # Q = probability matrix, same shape as Y.T
             # grad = H @ (Q - Y).T + alpha * np.ones(W0.shape[1])
-            grad = H @ (Q - Y)
+            grad = grad.T  # = H @ (Q.T - Y)
             W1 = W1 - (np.log(i+1) / (((i + 1) ** (0.5)))) * grad
             i = i + 1
             # print('iter %i, grad_norm %f' %(i, np.linalg.norm(grad)))
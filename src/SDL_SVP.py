@@ -15,10 +15,11 @@ from sklearn.metrics import precision_recall_curve
 from sklearn.metrics import accuracy_score
 from sklearn.metrics import confusion_matrix
 import scipy.sparse as sp
-from sklearn.decomposition import SparseCoder
 from sklearn.linear_model import LogisticRegression
 from scipy.linalg import block_diag
-from sklearn.decomposition import TruncatedSVD
+from scipy.sparse.linalg import LinearOperator
+from src.kernels import update_code_joint_logistic, update_code_within_radius, as_dtype, sq_norm
+from src.kernels import logistic_loss_grad, sigmoid, sparse_code_batched, ridge_factor, ridge_solve, subspace_svd
 
 
 
@@ -43,21 +44,26 @@ class SDL_SVP():
                  xi = None, # weight for dim reduction vs. prediction trade-off
                  L1_reg=[0,0,0], # L1 regularizer for code H, dictioanry W[0], and regression params W[1]
                  L2_reg=[0,0,0], # L2 regularizer for code H, dictioanry W[0], and regression params W[1]
-                 full_dim=False): # if true, dictionary matrix W[0] is Id with size d1 x d1 -- no dimension reduction
+                 full_dim=False, # if true, dictionary matrix W[0] is Id with size d1 x d1 -- no dimension reduction
+                 dtype=np.float64): # floating point type of data, loading, code and all intermediates (e.g. np.float32)
 
-        self.X = X
+        self.dtype = dtype
+        self.X = [as_dtype(X[0], dtype), as_dtype(X[1], dtype)]
+        X_auxiliary = as_dtype(X_auxiliary, dtype)
         self.X_auxiliary = X_auxiliary
         self.d3 = 0 # auxiliary data dim
         if X_auxiliary is not None:
             self.d3 = X_auxiliary.shape[0]
 
+        if X_test is not None:
+            X_test = [as_dtype(X_test[0], dtype), as_dtype(X_test[1], dtype)]
         self.X_test = X_test
-        self.X_test_aux = X_test_aux
+        self.X_test_aux = as_dtype(X_test_aux, dtype)
         self.n_components = n_components
         self.iterations = iterations
-        self.ini_code = ini_code
+        self.ini_code = as_dtype(ini_code, dtype)
         if ini_code is None:
-            self.ini_code = np.random.rand(n_components, X[0].shape[1])
+            self.ini_code = np.random.rand(n_components, X[0].shape[1]).astype(dtype)
 
         self.loading = ini_loading
         if ini_loading is None:
@@ -66,37 +72,51 @@ class SDL_SVP():
             r = n_components
             self.loading = [np.random.rand(X[0].shape[0], r), 1-2*np.random.rand(X[1].shape[0], r + 1 + self.d3)]  # additional first column for constant terms in Logistic Regression
             # add additional d3 columns of regression coefficients for the auxiliary variables
+        self.loading = [as_dtype(W, dtype) for W in self.loading]
         print('initial loading beta', self.loading[1])
 
         self.xi = xi
         self.L1_reg = L1_reg
         self.L2_reg = L2_reg
-        self.code = np.zeros(shape=(n_components, X[0].shape[1]))
+        self.code = np.zeros(shape=(n_components, X[0].shape[1]), dtype=dtype)
         self.full_dim = full_dim
         self.result_dict = {}
+        self.code_factor = None  # (W, ridge_factor(W.T @ W)) of the last least squares sparse_code
+        self.svd_subspace = None  # right singular block of the last rank-r projection (warm start of the next one)
+        self.svd_iter = 1  # subspace iterations of a warm-started rank-r projection
+        self.svp_factors = None  # (u0, s0, v0) of the last SVP projection
         self.result_dict.update({'xi' : self.xi})
         self.result_dict.update({'L1_reg' : self.L1_reg})
         self.result_dict.update({'L2_reg' : self.L2_reg})
         self.result_dict.update({'n_components' : self.n_components})
 
 
-    def rank_r_projection(self, X, rank):
-        svd = TruncatedSVD(n_components=rank, n_iter=7, random_state=42)
-        X_reduced = svd.fit_transform(X) #
-        u = X_reduced.dot(np.linalg.inv(np.diag(svd.singular_values_)))
-        s = svd.singular_values_
-        vh = svd.components_
-        r = rank
-        u0 = u[:,:r]
-        s0 = s[:r]
-        v0 = vh[:r,:]
-        recons = u0 @ np.diag(s0) @ v0
+    def rank_r_projection(self, X, rank, warm_start=False, compute_recons=True):
+        '''
+        Best rank-r approximation u0 @ diag(s0) @ v0 of X by subspace iteration (kernels.subspace_svd).
+        X may be a LinearOperator (see svp_operator); compute_recons = False skips the dense recons (None).
+        warm_start = True starts from the singular subspace of the previous projection (consecutive SVP iterates
+        differ by a small gradient step) and runs self.svd_iter iterations instead of 7 from a random block.
+        '''
+        V0 = self.svd_subspace if warm_start else None
+        if (V0 is not None) and (V0.shape[0] != X.shape[1]):
+            V0 = None
+        u0, s0, v0, V_b = subspace_svd(X, rank, V0=V0, n_iter=7 if V0 is None else self.svd_iter)
+        if warm_start:
+            self.svd_subspace = V_b
+        recons = (u0 * s0) @ v0 if compute_recons else None
         return u0, s0, v0, recons
 
-    def unfactored2factored(self, A, B, Beta1, rank, option='filter'): # or 'feature')
+    def unfactored2factored(self, A, B, Beta1, rank, option='filter', factors=None): # or 'feature')
+        # factors = (u0, s0, v0) of the rank-r projection that produced A and B (self.svp_factors after step_SVP):
+        # W and H are recovered from them in O((p + n) r) without another SVD.
+        # Otherwise [A, B] or [A; B] (B dense or low-rank factors (L, R)) is projected as an operator (see svp_operator)
+        if factors is not None:
+            u0, s0, v0 = factors
+        else:
+            C = svp_operator(A, B, self.X[0], option=option)
+            u0, s0, v0, recons = self.rank_r_projection(C, rank=rank, compute_recons=False)
         if option == 'filter':
-            C = np.hstack((A,B))
-            u0, s0, v0, recons = self.rank_r_projection(C, rank=rank)
             s = np.diag(s0)
             W0 = u0 @ np.sqrt(s)
             W_norm = np.linalg.norm(W0)
@@ -107,8 +127,6 @@ class SDL_SVP():
             H = D[:,1:]
 
         elif option == 'feature':
-            C = np.vstack((A,B))
-            u0, s0, v0, recons = self.rank_r_projection(C, rank=rank)
             s = np.diag(s0)
             H = np.sqrt(s) @ v0
             D = u0 @ np.sqrt(s)
@@ -125,54 +143,149 @@ class SDL_SVP():
 
     def step_SVP(self, A, B, Beta1, tau=1, nu=0.1, option='filter'): # or 'feature'):
         # A = W[0] @ W[1][1:1+self.n_components].T    (p x 1)
-        # B = W @ H    (p x n)
+        # B = W @ H    (p x n), dense or low-rank factors (L, R) with B = L @ R
         # Beta1 = regression coefficients for auxiliary variables (including the bias term)  (1 x q) = (1 x (1+self.d3))
+        # The gradient step of B is B - tau * 2 xi (B - X) = (1 - 2 tau xi) B + 2 tau xi X, so the projected
+        # matrix C is applied as an operator (svp_operator) and never formed; a dense B is updated in place.
+        # Returns B_new in the form of B; the factors of the projection are kept in self.svp_factors.
 
         X = self.X
         r = self.n_components
         n = X[0].shape[1]
 
-        grad_B = 2 * self.xi * (B - X[0])
-        Z = np.ones(shape=[1,X[0].shape[1]]) # auxiliary covariates
+        Z = np.ones(shape=[1,X[0].shape[1]], dtype=self.dtype) # auxiliary covariates
         if self.d3>0:
             Z = np.vstack((Z, self.X_auxiliary))
 
         if option == 'filter':
-            D = A.T @ X[0] + Beta1 @ Z
-            P = 1 / (1 + np.exp(-D))
-            grad_A = X[0] @ (P - X[1]).T + nu * A
-            grad_Beta1 = Z @ (P - X[1]).T + nu * Beta1
-            if self.d3>0:
-                grad_Beta1 = (P - X[1]) @ Z.T + nu * Beta1
+            # logits A.T @ X[0] + Beta1 @ Z, grad_A = X[0] @ (P - X[1]).T
+            _, P, grad_A = logistic_loss_grad(A.T, X[0], X[1], offset=Beta1 @ Z, compute_loss=False)
+            grad_A = grad_A.T + nu * A
+            grad_Beta1 = (P - X[1]) @ Z.T + nu * Beta1
 
         elif option == 'feature':
-            D = A + Beta1 @ Z
-            P = 1 / (1 + np.exp(-D))
+            # logits A + Beta1 @ Z, grad_Beta1 = (P - X[1]) @ Z.T
+            _, P, grad_Beta1 = logistic_loss_grad(Beta1, Z, X[1], offset=A, compute_loss=False)
             grad_A = (P - X[1]) + nu * A
-            grad_Beta1 = Z @ (P - X[1]).T + nu * Beta1
-            if self.d3>0:
-                grad_Beta1 = (P - X[1]) @ Z.T + nu * Beta1
+            grad_Beta1 += nu * Beta1
 
         # gradient descent step
         A -= tau * grad_A
-        B -= tau * grad_B
         Beta1 -= tau * grad_Beta1
+        A_new, B_new = self.project_SVP(A, B, 1 - 2 * tau * self.xi, 2 * tau * self.xi, option=option)
+
+        return A_new, B_new, Beta1
+
+    def project_SVP(self, A, B, c_B, c_X, option='filter'):
+        '''
+        Rank-r projection of C = [A, c_B B + c_X X[0]] (filter) or [A; c_B B + c_X X[0]] (feature) without forming C.
+        B dense: updated in place to c_B B + c_X X[0] (sparse X[0] added entrywise, B stays an ndarray);
+        B = (L, R) low rank: C is applied through the factors.
+        Returns the A and B blocks of the projection, B_new in the form of B, and keeps (u0, s0, v0) in self.svp_factors.
+        '''
+        X = self.X
+        if not isinstance(B, tuple):
+            B *= c_B
+            if sp.issparse(X[0]):
+                X0 = X[0].tocoo()
+                np.add.at(B, (X0.row, X0.col), c_X * X0.data)
+            else:
+                B += c_X * X[0]
+            c_B, c_X = 1, 0
+        C = svp_operator(A, B, X[0], c_B=c_B, c_X=c_X, option=option)
+        u0, s0, v0, _ = self.rank_r_projection(C, rank=self.n_components, warm_start=True, compute_recons=False)
+        self.svp_factors = (u0, s0, v0)
 
         # singular value projection on rank-r matrices
         if option == 'filter':
-            C = np.hstack((A, B))
-            u0, s0, v0, recons = self.rank_r_projection(C, rank=self.n_components)
-            A_new = recons[:, :A.shape[1]]
-            B_new = recons[:, A.shape[1]:]
+            k = A.shape[1]
+            A_new = (u0 * s0) @ v0[:, :k]
+            B_new = (u0 * s0, v0[:, k:])
             ### TODO: Maybe add column normalization step for W
 
         elif option == 'feature':
-            C = np.vstack((A, B))
-            u0, s0, v0, recons = self.rank_r_projection(C, rank=self.n_components)
-            A_new = recons[:A.shape[0], :]
-            B_new = recons[A.shape[0]:, :]
+            k = A.shape[0]
+            A_new = (u0[:k] * s0) @ v0
+            B_new = (u0[k:] * s0, v0)
 
-        return A_new, B_new, Beta1
+        if not isinstance(B, tuple):
+            B_new = B_new[0] @ B_new[1]
+        return A_new, B_new
+
+    def svp_loss(self, A, B, Beta1, option='filter', X_sq=None):
+        '''
+        Training loss [|X - B|^2, logistic loss] of the unfactored iterate and the probability matrix P_pred,
+        from B dense or low-rank factors (L, R) without p x n temporaries (see b_inner)
+        '''
+        X = self.X
+        if X_sq is None:
+            X_sq = sq_norm(X[0])
+        Z = np.ones(shape=[1,X[0].shape[1]], dtype=self.dtype) # auxiliary covariates
+        if self.d3>0:
+            Z = np.vstack((Z, self.X_auxiliary))
+        error_data = max(X_sq - 2 * b_inner(X[0], B) + b_inner(B, B), 0)
+        if option == 'filter':
+            error_label, P_pred, _ = logistic_loss_grad(A.T, X[0], X[1], offset=Beta1 @ Z, compute_grad=False)
+        elif option == 'feature':
+            error_label, P_pred, _ = logistic_loss_grad(Beta1, Z, X[1], offset=A, compute_grad=False)
+        return error_data, error_label, P_pred
+
+    def step_APG(self, A, B, Beta1, nu=0, option='filter'):
+        '''
+        One accelerated projected gradient step (momentum as in FISTA, Beck and Teboulle 2009) on
+            F = xi |X - B|^2 + Logistic_Loss + nu (|A|^2 + |Beta1|^2) / 2   subject to rank([A, B]) <= r
+        (one step size for all blocks, also Beta1), with the state in self.apg_state = {'prev', 't', 'tau', 'loss'}:
+            y = x + (t_prev - 1) / t (x - x_prev),   x_new = P_r(y - tau grad F(y))   (step_SVP at y)
+        x_new is accepted if F(x_new) < F(x); otherwise the momentum is dropped (y = x), and tau is halved when
+        there was none. The momentum restarts (t = 1) when <y - x_new, x_new - x> > 0 (gradient restart,
+        O'Donoghue and Candes 2015). B is dense or factored; a factored y has rank 2r and is applied through
+        its factors. Each trial costs one rank-r projection. Returns A, B, Beta1 and F at the new iterate.
+        '''
+        state = self.apg_state
+        x = (A, B, Beta1)
+
+        def objective(A, B, Beta1):
+            error_data, error_label, _ = self.svp_loss(A, B, Beta1, option=option, X_sq=state['X_sq'])
+            return self.xi * error_data + error_label + nu * (np.sum(A * A) + np.sum(Beta1 * Beta1)) / 2
+
+        if state['loss'] is None:
+            state['loss'] = objective(*x)
+        x_prev = state['prev']
+        t = state['t']
+        momentum = x_prev is not None
+        while True:
+            theta = (t - 1) / ((1 + np.sqrt(1 + 4 * t**2)) / 2) if momentum else 0
+            if theta > 0:
+                y_A = (1 + theta) * A - theta * x_prev[0]
+                y_Beta1 = (1 + theta) * Beta1 - theta * x_prev[2]
+                if isinstance(B, tuple):
+                    y_B = (np.hstack(((1 + theta) * B[0], -theta * x_prev[1][0])), np.vstack((B[1], x_prev[1][1])))
+                else:
+                    y_B = (1 + theta) * B - theta * x_prev[1]
+            else:
+                y_A, y_B, y_Beta1 = A.copy(), B if isinstance(B, tuple) else B.copy(), Beta1.copy()
+            x_new = self.step_SVP(y_A, y_B, y_Beta1, tau=state['tau'], nu=nu, option=option)
+            loss_new = objective(*x_new)
+            if loss_new < state['loss']:
+                break
+            if theta > 0:
+                momentum = False
+            elif state['tau'] > 1e-12:
+                state['tau'] /= 2
+            else:  # no descent at any step size: stay at x (self.svp_factors are those of the last trial)
+                self.svp_factors = None
+                return A, B, Beta1, state['loss']
+
+        # gradient restart: <y - x_new, x_new - x> = theta <x - x_prev, x_new - x> - |x_new - x|^2
+        inner = lambda P, Q: np.sum(P[0] * Q[0]) + b_inner(P[1], Q[1]) + np.sum(P[2] * Q[2])
+        step_sq = inner(x_new, x_new) - 2 * inner(x_new, x) + inner(x, x)
+        restart = -step_sq
+        if theta > 0:
+            restart += theta * (inner(x, x_new) - inner(x, x) - inner(x_prev, x_new) + inner(x_prev, x))
+        state['t'] = 1 if (restart > 0) or not momentum else (1 + np.sqrt(1 + 4 * t**2)) / 2
+        state['prev'] = x
+        state['loss'] = loss_new
+        return x_new[0], x_new[1], x_new[2], loss_new
 
     def step_feature(self, A, B, Beta1, tau=1, nu=0.1):
         # A = W[1][1:1+self.n_components] @ H    (1 x n)
@@ -183,30 +296,21 @@ class SDL_SVP():
         r = self.n_components
         n = X[0].shape[1]
 
-        grad_B = 2 * self.xi * (B - X[0])
-        Z = np.ones(shape=[1,X[0].shape[1]]) # auxiliary covariates
+        Z = np.ones(shape=[1,X[0].shape[1]], dtype=self.dtype) # auxiliary covariates
         if self.d3>0: #####################################
             Z = np.vstack((Z, self.X_auxiliary)) #########################
 
-        D = A + Beta1 @ Z
-
-        # P = probability matrix, same shape as X1
-        P = 1 / (1 + np.exp(-D))
+        # P = probability matrix of the logits A + Beta1 @ Z, same shape as X1
+        _, P, grad_Beta1 = logistic_loss_grad(Beta1, Z, X[1], offset=A, compute_loss=False)
         grad_A = (P - X[1]) + nu * A
-        grad_Beta1 = Z @ (P - X[1]).T + nu * Beta1
-        if self.d3>0: ##########################################################
-            grad_Beta1 = (P - X[1]) @ Z.T + nu * Beta1 #########################
+        grad_Beta1 += nu * Beta1 # = (P - X[1]) @ Z.T + nu * Beta1
 
-        # gradient descent step
+        # gradient descent step (B implicitly, see project_SVP)
         A -= tau * grad_A
-        B -= tau * grad_B
         Beta1 -= 10*tau * grad_Beta1
 
         # singular value projection on rank-r matrices
-        C = np.vstack((A, B))
-        u0, s0, v0, recons = self.rank_r_projection(C, rank=self.n_components)
-        A_new = recons[:A.shape[0], :]
-        B_new = recons[A.shape[0]:, :]
+        A_new, B_new = self.project_SVP(A, B, 1 - 2 * tau * self.xi, 2 * tau * self.xi, option='feature')
 
         return A_new, B_new, Beta1
 
@@ -223,14 +327,35 @@ class SDL_SVP():
             if_validate=False,
             fine_tune_beta = False,
             SDL_option = 'filter',
-            prediction_method_list=['filter']): # or 'feature'
+            prediction_method_list=['filter'], # or 'feature'
+            svd_iter=1,
+            factored=False,
+            solver='pgd',
+            stopping_diff=1e-5):
         '''
         Given input X = [data, label] and initial loading dictionary W_ini, find W = [dict, beta] and code H
         by projected gradient descent in an unfactored formulation
+        svd_iter = subspace iterations per rank-r projection, warm-started from the previous step's singular subspace
+        factored = True stores B = W @ H as rank-r factors (p x r, r x n) instead of a dense (p x n) array: the
+                   gradient step is applied through the factors and X (see project_SVP) and the training loss is
+                   evaluated from them, so the memory besides X is O((p + n) r)
+        solver = 'pgd' : projected gradient steps with the step size schedule search_radius_const (step+10)^(-beta)
+                 'apg' : accelerated projected gradient with backtracking and restart (see step_APG), starting from
+                         the step size search_radius_const 10^(-beta); stops once the objective changes by less
+                         than stopping_diff (relative)
+        if_compute_recons_error = True logs the training loss [time, data, label] in time_error and recovers the
+        factored [W, H] every iteration from the SVD of the last projection (no extra SVD); AUC every 10 iterations
         '''
         X = self.X
         r = self.n_components
         n = X[0].shape[1]
+        X_sq = sq_norm(X[0])
+        self.svd_subspace = None
+        self.svp_factors = None
+        self.svd_iter = svd_iter
+        Z = np.ones(shape=[1,n], dtype=self.dtype) # auxiliary covariates
+        if self.d3>0:
+            Z = np.vstack((Z, self.X_auxiliary))
 
         #H = np.random.rand(r, n)
         #W = [np.random.rand(X[0].shape[0], r), np.random.rand(X[1].shape[0], r + 1 + self.d3)]  # additional first column for constant terms in Logistic Regression
@@ -247,15 +372,18 @@ class SDL_SVP():
         # set up unfactored variable
         if SDL_option == 'filter':
             A = W[0] @ W[1][:,1:1+r].T
-            B = W[0] @ H
         elif SDL_option == 'feature':
             A = W[1][:,1:1+r] @ H
+        if factored:
+            B = (np.array(W[0], dtype=self.dtype), np.array(H, dtype=self.dtype))
+        else:
             B = W[0] @ H
 
 
-        Beta1 = np.zeros(shape=[X[1].shape[0], 1+ self.d3])
+        Beta1 = np.zeros(shape=[X[1].shape[0], 1+ self.d3], dtype=self.dtype)
         Beta1[:,0] = W[1][:,0]
         Beta1[:,1:] = W[1][:,r+1:]
+        self.apg_state = {'prev': None, 't': 1, 'tau': search_radius_const * 10.0 ** (-beta), 'loss': None, 'X_sq': X_sq}
 
         for step in trange(int(iter)):
             start = time.time()
@@ -264,56 +392,45 @@ class SDL_SVP():
             search_radius = search_radius_const * (float(step + 10)) ** (-beta)
             #print('search_radius', search_radius)
             # search_radius = 0.0001
-            A, B, Beta1 = self.step_SVP(A, B, Beta1, tau=search_radius, nu=0, option=SDL_option)
+            if solver == 'apg':
+                loss_old = self.apg_state['loss']
+                A, B, Beta1, loss = self.step_APG(A, B, Beta1, nu=0, option=SDL_option)
+                converged = (loss_old is not None) and (abs(loss_old - loss) <= stopping_diff * abs(loss_old))
+            else:
+                A, B, Beta1 = self.step_SVP(A, B, Beta1, tau=search_radius, nu=0, option=SDL_option)
+                converged = False
 
             #print('Beta1', Beta1)
             end = time.time()
             elapsed_time += end - start
 
+            if if_compute_recons_error:
+                # B = W[0] @ H and the logits A.T @ X[0] (filter) or A (feature) are exact after the rank-r
+                # projection, so the loss of the factored model is |X|^2 - 2 <X, B> + |B|^2 plus the logistic loss
+                error_data, error_label, P_pred = self.svp_loss(A, B, Beta1, option=SDL_option, X_sq=X_sq)
+                rel_error_data = error_data / X_sq
+
+                time_error = np.append(time_error, np.array([[elapsed_time, error_data, error_label]]), axis=0)
+                self.result_dict.update({'Relative_reconstruction_loss (training)': rel_error_data})
+                self.result_dict.update({'Classification_loss (training)': error_label})
+                self.result_dict.update({'time_error': time_error.T})
+
+                # factored [W, H] from the SVD factors of the last projection, O((p + n) r)
+                W, H = self.unfactored2factored(A, B, Beta1, rank=self.n_components, option=SDL_option,
+                                                factors=self.svp_factors)
+                self.result_dict.update({'loading': W})
+                self.result_dict.update({'code': H})
+                self.loading = W
+                self.code = H
+
             if (step % 10) == 0:
                 if if_compute_recons_error:
-                    W, H = self.unfactored2factored(A, B, Beta1, rank=self.n_components, option=SDL_option)
                     #W /= np.linalg.norm(W[0])
                     #H *= np.linalg.norm(W[0])
                     #print('Beta', W[1])
-                    # print the error every 50 iterations
-
-                    error_data = np.linalg.norm((X[0] - W[0] @ H).reshape(-1, 1), ord=2)**2
-                    rel_error_data = error_data / np.linalg.norm(X[0].reshape(-1, 1), ord=2)**2
 
                     print('*** rel_error_data train', rel_error_data)
 
-                    if SDL_option == 'filter':
-                        X0_comp = W[0].T @ X[0]
-                        X0_ext = np.vstack((np.ones(X[1].shape[1]), X0_comp))
-                        if self.d3>0:
-                            X0_ext = np.vstack((X0_ext, self.X_auxiliary))
-
-
-                    elif SDL_option == 'feature':
-
-                        X0_ext = np.vstack((np.ones(X[1].shape[1]), H))
-                        if self.d3>0:
-                            H_ext = np.vstack((np.ones(X[1].shape[1]), H)) ###############
-                            X0_ext = np.vstack((H_ext, self.X_auxiliary)) ###############
-                        """
-                        X0_comp = W[0].T @ X[0]
-                        X0_ext = np.vstack((np.ones(X[1].shape[1]), X0_comp))
-                        if self.d3>0:
-                            X0_ext = np.vstack((X0_ext, self.X_auxiliary))
-                        """
-
-                    ### Additional fitting of logistic regression
-                    #if fine_tune_beta:
-                    #    print('beta_old', W[1][0,:])s
-                    #    clf = LogisticRegression(random_state=0).fit(X0_comp.T, self.X[1][0,:])
-                    #    W[1][0,1:] = clf.coef_[0]
-                    #    W[1][0,0] = clf.intercept_[0]
-                    #    print('beta_new', W[1][0,:])
-
-                    P_pred = np.matmul(W[1], X0_ext)
-                    #P_pred -= np.min(P_pred)
-                    P_pred = 1 / (np.exp(-P_pred) + 1)
                     # print('Y - P_pred', np.linalg.norm(X[1] - P_pred))
                     # print('!!! error norm', np.linalg.norm(X[1][0, :]-P_pred[0,:])/X[1].shape[1])
                     fpr, tpr, thresholds = metrics.roc_curve(X[1][0, :], P_pred[0,:], pos_label=None)
@@ -322,20 +439,7 @@ class SDL_SVP():
                     self.result_dict.update({'Training_threshold':mythre})
                     self.result_dict.update({'Training_AUC':myauc})
                     print('--- Training --- [threshold, AUC] = ', [np.round(mythre,3), np.round(myauc,3)])
-
-                    error_label = np.sum(np.log(1+np.exp(W[1] @ X0_ext))) - X[1] @ (W[1] @ X0_ext).T
-                    error_label = error_label[0][0]
-
-                    time_error = np.append(time_error, np.array([[elapsed_time, error_data, error_label]]), axis=0)
                     print('--- Iteration %i: Training loss --- [Data, Label, Total] = [%f.3, %f.3, %f.3]' % (step, error_data, error_label, self.xi * error_data+error_label))
-
-                    self.result_dict.update({'Relative_reconstruction_loss (training)': rel_error_data})
-                    self.result_dict.update({'Classification_loss (training)': error_label})
-                    self.result_dict.update({'loading': W})
-                    self.result_dict.update({'code': H})
-                    self.result_dict.update({'time_error': time_error.T})
-                    self.loading = W
-                    self.code = H
                     print('error_time', np.asarray(time_error).shape)
 
                 if if_validate and (step>1):
@@ -352,9 +456,13 @@ class SDL_SVP():
                         print('!!! --- Validation (Stopped) --- [threshold, ACC] = ', [np.round(threshold,3), np.round(ACC,3)])
                         break
 
+            if converged:
+                print('Converged: relative objective change below stopping_diff at iteration %i' % step)
+                self.result_dict.update({'iter': step + 1})
+                break
 
-
-        W, H = self.unfactored2factored(A, B, Beta1, rank=self.n_components, option=SDL_option)
+        W, H = self.unfactored2factored(A, B, Beta1, rank=self.n_components, option=SDL_option,
+                                        factors=self.svp_factors)
         self.result_dict.update({'loading': W})
         self.result_dict.update({'code': H})
         self.loading = W
@@ -370,7 +478,7 @@ class SDL_SVP():
 
         return self.result_dict
 
-    def sparse_code(self, X, W, sparsity=0, nonnegativity=False):
+    def sparse_code(self, X, W, sparsity=0, nonnegativity=False, H0=None):
         # Same function as OMF
 
         '''
@@ -380,6 +488,7 @@ class SDL_SVP():
         args:
             X (numpy array): data matrix with dimensions: features (d) x samples (n)
             W (numpy array): dictionary matrix with dimensions: features (d) x topics (r)
+            H0 (numpy array): warm start for the code (e.g. the code of the previous iteration)
 
         returns:
             H (numpy array): code matrix with dimensions: topics (r) x samples(n)
@@ -392,82 +501,46 @@ class SDL_SVP():
             print('X.shape:', X.shape)
             print('W.shape:', W.shape, '\n')
 
-        # initialize the SparseCoder with W as its dictionary
-        # then find H such that X \approx W*H
-        coder = SparseCoder(dictionary=W.T, transform_n_nonzero_coefs=None,
-                            transform_alpha=sparsity, transform_algorithm='lasso_lars', positive_code=nonnegativity)
-        # alpha = L1 regularization parameter.
-        H = coder.transform(X.T)
+        if (not nonnegativity) and (sparsity == 0):
+            # least squares code in closed form; the factorization of W.T @ W is kept with a copy of W
+            # and reused while the same dictionary codes other data (e.g. training and test set in predict)
+            if (self.code_factor is None) or (not np.array_equal(self.code_factor[0], W)):
+                self.code_factor = (W.copy(), ridge_factor(W.T @ W))
+            H = ridge_solve(self.code_factor[1], np.asarray(X.T @ W).T)
+        else:
+            # find H such that X \approx W*H, with the same objective as SparseCoder(lasso_lars)
+            # alpha = L1 regularization parameter. All columns share the Gram matrix W.T @ W.
+            H = sparse_code_batched(X, W, alpha=sparsity, H0=H0, nonnegativity=nonnegativity)
 
-        # transpose H before returning to undo the preceding transpose on X
         # print('!!! sparse_code: Start')
-        return H.T
+        return H.astype(W.dtype, copy=False)
 
     def update_code_joint_logistic(self, X, W, H0, r,
                                    a1=0, a2=0, sub_iter=2,
                                    stopping_diff=0.1, nonnegativity=True,
                                    xi = 0,
-                                   subsample_size=None):
+                                   subsample_size=None,
+                                   mode='row',
+                                   radius_norm='spectral'):
         '''
         X = [X0, X1]
         W = [W0, W1+W2]
         Find \hat{H} = argmin_H ( xi * || X0 - W0 H||^2 + alpha|H| + Logistic_Loss(X1, [W1|W2], H)) within radius r from H0
-        Use row-wise projected gradient descent
+        mode = 'row' : row-wise projected gradient descent
+        mode = 'block' : projected gradient descent on all rows of H at once
+        radius_norm = 'spectral' (default), 'fro' or 'row' : norm in which the radius r is measured (see kernels.radius_scale)
         '''
 
-        if H0 is None:
-            H0 = np.random.rand(W[0].shape[1], X[0].shape[1])
-            # print('!!! H0.shape', H0.shape)
-
-        if not self.full_dim:
-            A = W[0].T @ W[0]
-            B = W[0].T @ X[0]
-
-        H1 = H0.copy()
-        i = 0
-        dist = 1
-        idx = np.arange(X[0].shape[1])
-        while (i < sub_iter) and (dist > stopping_diff):
-            H1_old = H1.copy()
-            for k in np.arange(H1.shape[0]):
-                if subsample_size is not None:
-                    idx = np.random.randint(X[0].shape[1], size=subsample_size)
-
-                H1_ext = np.vstack((np.ones(len(idx)), H1[:,idx]))
-                if self.X_auxiliary is not None:
-                    H1_ext = np.vstack((H1_ext, self.X_auxiliary[:,idx]))
-                    # add additional rows for the auxiliary explanatory variables
-
-                # P = probability matrix, same shape as X1
-                D = W[1] @ H1_ext
-                P = 1 / (1 + np.exp(-D))
-
-                if self.full_dim:
-                    grad = np.diag(W[1][:,k]) @ (P-X[1][:,idx])
-                    H1[k, idx] = H1[k, idx] - (1 / (((i + 10) ** (0.5)) * (0 + 1))) * grad
-                else:
-                    grad_MF = (np.dot(A[k, :], H1[:,idx]) - B[k, idx])
-                    #print('W[1].shape', W[1].shape)
-                    grad_pred = np.diag(W[1][:,k+1]) @ (P-X[1][:,idx])
-                    grad =  xi * grad_MF + grad_pred + a1 * np.sign(H1[k,idx])*np.ones(len(idx)) + a2 * H1[k, idx]
-                    H1[k, idx] = H1[k, idx] - (1 / (((i + 10) ** (0.5)) * (A[k, k] + 1))) * grad
-
-                if nonnegativity:
-                    H1[k, idx] = np.maximum(H1[k, idx], np.zeros(shape=(len(idx),)))  # nonnegativity constraint
-
-                if r is not None:  # usual sparse coding without radius restriction
-                    d = np.linalg.norm(H1 - H0, 2)
-                    H1 = H0 + (r / max(r, d)) * (H1 - H0)
-                H0 = H1
-
-            dist = np.linalg.norm(H1 - H1_old, 2) / np.linalg.norm(H1_old, 2)
-            # print('!!! dist', dist)
-            # H1_old = H1
-            i = i + 1
-            # print('!!!! i', i)  # mostly the loop finishes at i=1 except the first round
-
-
-        return H1
+        return update_code_joint_logistic(X, W, H0, r,
+                                          X_auxiliary=self.X_auxiliary,
+                                          a1=a1, a2=a2, sub_iter=sub_iter,
+                                          stopping_diff=stopping_diff,
+                                          nonnegativity=nonnegativity,
+                                          xi=xi,
+                                          subsample_size=subsample_size,
+                                          full_dim=self.full_dim,
+                                          mode=mode,
+                                          radius_norm=radius_norm)
 
     def validation(self,
                     result_dict=None,
@@ -552,11 +625,11 @@ class SDL_SVP():
             # Get threshold from training set
             if SDL_option == 'filter':
                 X0_comp = W[0].T @ self.X[0]
-                X0_ext = np.vstack((np.ones(X[1].shape[1]), X0_comp))
+                X0_ext = np.vstack((np.ones(X[1].shape[1], dtype=self.dtype), X0_comp))
                 if self.d3>0:
                     X0_ext = np.vstack((X0_ext, self.X_auxiliary))
                 P_pred = np.matmul(W[1], X0_ext)
-                P_pred = 1 / (np.exp(-P_pred) + 1)
+                P_pred = sigmoid(P_pred)
                 fpr, tpr, thresholds = metrics.roc_curve(X[1][0, :], P_pred[0,:], pos_label=None)
                 pred_threshold = thresholds[np.argmax(tpr - fpr)]
                 myauc_training = metrics.auc(fpr, tpr)
@@ -564,11 +637,11 @@ class SDL_SVP():
 
             elif SDL_option == 'feature':
                 X0_comp = self.sparse_code(X[0], W[0], nonnegativity=False)
-                X0_ext = np.vstack((np.ones(X[1].shape[1]), X0_comp))
+                X0_ext = np.vstack((np.ones(X[1].shape[1], dtype=self.dtype), X0_comp))
                 if self.d3>0:
                     X0_ext = np.vstack((X0_ext, self.X_auxiliary))
                 P_pred = np.matmul(W[1], X0_ext)
-                P_pred = 1 / (np.exp(-P_pred) + 1)
+                P_pred = sigmoid(P_pred)
                 # print('!!! error norm', np.linalg.norm(X[1][0, :]-P_pred[0,:])/X[1].shape[1])
                 fpr, tpr, thresholds = metrics.roc_curve(self.X[1][0, :], P_pred[0,:], pos_label=None)
                 pred_threshold = thresholds[np.argmax(tpr - fpr)]
@@ -590,9 +663,9 @@ class SDL_SVP():
             H = W[0].T @ X_test
             if X_test_aux is not None:
                 H = np.vstack((H, X_test_aux))
-            H2 = np.vstack((np.ones(H.shape[1]), H))
+            H2 = np.vstack((np.ones(H.shape[1], dtype=self.dtype), H))
             P_pred = np.matmul(W[1], H2)
-            P_pred = 1 / (np.exp(-P_pred) + 1)  # predicted probability for Y_test
+            P_pred = sigmoid(P_pred)  # predicted probability for Y_test
             # threshold predictive probabilities to get predictions
             Y_hat = P_pred.copy()
             Y_hat[Y_hat < pred_threshold] = 0
@@ -605,11 +678,11 @@ class SDL_SVP():
             if method == 'naive':
                 H = self.sparse_code(X_test, W[0], nonnegativity=False)
                 #print('---- H naive shape', H.shape)
-                H_ext = np.vstack((np.ones(X_test.shape[1]), H))
+                H_ext = np.vstack((np.ones(X_test.shape[1], dtype=self.dtype), H))
                 if X_test_aux is not None:
                     H_ext = np.vstack((H_ext, X_test_aux))
                 P_pred = np.matmul(W[1], H_ext)
-                P_pred = 1 / (np.exp(-P_pred) + 1)
+                P_pred = sigmoid(P_pred)
 
                 # threshold predictive probabilities to get predictions
                 Y_hat = P_pred.copy()
@@ -621,8 +694,8 @@ class SDL_SVP():
 
             elif method == 'alt':
                 #print('alternating prection..')
-                H = np.random.rand(r,n)
-                Y_hat = np.random.rand(self.X[1].shape[0], X_test.shape[1])
+                H = np.random.rand(r,n).astype(self.dtype)
+                Y_hat = np.random.rand(self.X[1].shape[0], X_test.shape[1]).astype(self.dtype)
                 for step in trange(int(200)):
                     X = [X_test, Y_hat]
 
@@ -630,13 +703,13 @@ class SDL_SVP():
                     radius = 10/(step+1)
                     H = self.update_code_joint_logistic(X, W, H, r=radius, sub_iter = 2, stopping_diff=0.0001)
                     # Update the missing label P_pred
-                    H_ext = np.vstack((np.ones(X_test.shape[1]), H))
+                    H_ext = np.vstack((np.ones(X_test.shape[1], dtype=self.dtype), H))
 
                     if X_test_aux is not None:
                         H_ext = np.vstack((H_ext, X_test_aux))
 
                     P_pred = np.matmul(W[1], H_ext)
-                    P_pred = 1 / (np.exp(-P_pred) + 1)
+                    P_pred = sigmoid(P_pred)
                     Y_hat = P_pred
 
                     # threshold predictive probabilities to get predictions
@@ -661,10 +734,10 @@ class SDL_SVP():
                         x_guess = [x_test, y_guess]
                         h = self.update_code_joint_logistic(x_guess, W, xi=self.xi, sub_iter=40,
                                                             stopping_diff=0.001, H0=None, r=None)
-                        h_ext = np.vstack((np.ones(1), h))
+                        h_ext = np.vstack((np.ones(1, dtype=self.dtype), h))
                         error_data = np.linalg.norm((x_test - W[0] @ h).reshape(-1, 1), ord=2) ** 2
-                        error_label = np.sum(np.log(1+np.exp(W[1] @ h_ext))) - y_guess @ (W[1] @ h_ext).T
-                        loss = (error_label + self.xi * error_data)[0,0]
+                        error_label = logistic_loss_grad(W[1], h_ext, y_guess, compute_grad=False)[0]
+                        loss = error_label + self.xi * error_data
                         # print('[j, loss] = ', [j, loss])
                         loss_list.append(loss)
                         h_list.append(h)
@@ -682,9 +755,9 @@ class SDL_SVP():
                 #print('--- Y_hat', Y_hat)
                 H = np.asarray(H).T
                 H -= np.mean(H)
-                H_ext = np.vstack((np.ones(X_test.shape[1]), H))
+                H_ext = np.vstack((np.ones(X_test.shape[1], dtype=self.dtype), H))
                 P_pred = np.matmul(W[1], H_ext)
-                P_pred = 1 / (np.exp(-P_pred) + 1)
+                P_pred = sigmoid(P_pred)
                 P_pred = P_pred[0,:]
 
         # Compute test data reconstruction loss
@@ -703,6 +776,58 @@ class SDL_SVP():
 
 ###### Helper functions
 
+def b_inner(P, Q):
+    '''
+    Frobenius inner product <P, Q> of (p x n) matrices given dense (or scipy.sparse for P) or as low-rank
+    factors (L, R) = L @ R, without forming the factored ones: <L1 R1, L2 R2> = <L1.T L2, R1 R2.T>
+    '''
+    if isinstance(P, tuple) and isinstance(Q, tuple):
+        return float(np.sum((P[0].T @ Q[0]) * (P[1] @ Q[1].T)))
+    if isinstance(P, tuple):
+        P, Q = Q, P
+    if isinstance(Q, tuple):
+        return float(np.sum(np.asarray(P @ Q[1].T) * Q[0]))
+    if sp.issparse(P):
+        return float(P.multiply(Q).sum())
+    return float(np.einsum('ij,ij->', P, Q))
+
+
+def svp_operator(A, B, X, c_B=1, c_X=0, option='filter'):
+    '''
+    LinearOperator of C = [A, c_B B + c_X X] (filter, p x (d2 + n)) or [A; c_B B + c_X X] (feature, (d2 + p) x n),
+    the matrix projected by SDL_SVP.step_SVP, without forming it.
+    B : dense (p x n) array or low-rank factors (L, R) with B = L @ R;  X : dense or scipy.sparse (p x n)
+    Products with (n x k) and (p x k) blocks cost O((p + n) r k) for factored B plus the products with X.
+    '''
+    low_rank = isinstance(B, tuple)
+    k = A.shape[1] if option == 'filter' else A.shape[0]
+    dtype = np.result_type(A.dtype, X.dtype, np.float32)
+
+    def B_matmat(V):  # (c_B B + c_X X) @ V
+        out = c_B * (B[0] @ (B[1] @ V)) if low_rank else c_B * (B @ V)
+        if c_X != 0:
+            out += c_X * np.asarray(X @ V)
+        return out
+
+    def B_rmatmat(Q):  # (c_B B + c_X X).T @ Q
+        out = c_B * (B[1].T @ (B[0].T @ Q)) if low_rank else c_B * (B.T @ Q)
+        if c_X != 0:
+            out += c_X * np.asarray(X.T @ Q)
+        return out
+
+    if option == 'filter':
+        shape = (A.shape[0], k + X.shape[1])
+        matmat = lambda V: A @ V[:k] + B_matmat(V[k:])
+        rmatmat = lambda Q: np.vstack((A.T @ Q, B_rmatmat(Q)))
+    else:
+        shape = (k + X.shape[0], A.shape[1])
+        matmat = lambda V: np.vstack((A @ V, B_matmat(V)))
+        rmatmat = lambda Q: A.T @ Q[:k] + B_rmatmat(Q[k:])
+    return LinearOperator(shape, matvec=lambda v: matmat(v.reshape(-1, 1)).ravel(),
+                          rmatvec=lambda q: rmatmat(q.reshape(-1, 1)).ravel(),
+                          matmat=matmat, rmatmat=rmatmat, dtype=dtype)
+
+
 def sparseness(x):
     """Hoyer's measure of sparsity for a vector"""
     sqrt_n = np.sqrt(len(x))
@@ -716,88 +841,6 @@ def safe_vstack(Xs):
         return np.vstack(Xs)
 
 
-def update_code_within_radius(X, W, H0, r, a1=0, a2=0,
-                              sub_iter=[2], stopping_grad_ratio=0.0001,
-                              subsample_ratio=None, nonnegativity=True,
-                              use_line_search=False):
-    '''
-    Find \hat{H} = argmin_H ( | X - WH| + alpha|H| ) within radius r from H0
-    Use row-wise projected gradient descent
-    Do NOT sparsecode the whole thing and then project -- instable
-    12/5/2020 Lyu
-
-    For NTF problems, X is usually tall and thin so it is better to subsample from rows
-    12/25/2020 Lyu
-
-    Apply single round of AdaGrad for rows, stop when gradient norm is small and do not make update
-    12/27/2020 Lyu
-    '''
-
-    # print('!!!! X.shape', X.shape)
-    # print('!!!! W.shape', W.shape)
-    # print('!!!! H0.shape', H0.shape)
-
-    if H0 is None:
-        H0 = np.random.rand(W.shape[1], X.shape[1])
-    H1 = H0.copy()
-    i = 0
-    dist = 1
-    idx = np.arange(X.shape[0])
-    H1_old = H1.copy()
-
-    A = W.T @ W
-    B = W.T @ X
-
-    while (i < np.random.choice(sub_iter)):
-        if_continue = np.ones(H0.shape[0])  # indexed by rows of H
-
-        for k in [k for k in np.arange(H0.shape[0]) if if_continue[k]>0.5]:
-
-            grad = np.dot(A[k, :], H1) - B[k, :]
-            grad += a1 * np.sign(H1[k, :]) * np.ones(H0.shape[1]) + a2 * H1[k, :]
-            grad_norm = np.linalg.norm(grad, 2)
-
-            # Initial step size
-            step_size = 1/(A[k,k]+1)
-            # step_size = 1 / (np.trace(A)) # use the whole trace
-            # step_size = 1
-            if r is not None:  # usual sparse coding without radius restriction
-                d = step_size * grad_norm
-                step_size = (r / max(r, d)) * step_size
-
-            H1_temp = H1.copy()
-            # loss_old = np.linalg.norm(X - W @ H1)**2
-            H1_temp[k, :] = H1[k, :] - step_size * grad
-            if nonnegativity:
-                H1_temp[k,:] = np.maximum(H1_temp[k,:], np.zeros(shape=(H1.shape[1],)))  # nonnegativity constraint
-            #loss_new = np.linalg.norm(X - W @ H1_temp)**2
-            #if loss_old > loss_new:
-
-                # print('recons_loss:' , np.linalg.norm(X - W @ H1, ord=2) / np.linalg.norm(X, ord=2))
-
-            """
-            if use_line_search:
-            # Armijo backtraking line search
-                m = grad.T @ H1[k,:]
-                H1_temp = H1.copy()
-                loss_old = np.linalg.norm(X - W @ H1)**2
-                loss_new = 0
-                count = 0
-                while (count==0) or (loss_old - loss_new < 0.1 * step_size * m):
-                    step_size /= 2
-                    H1_temp[k, :] = H1[k, :] - step_size * grad
-                    if nonnegativity:
-                        H1_temp[k,:] = np.maximum(H1_temp[k,:], np.zeros(shape=(H1.shape[1],)))  # nonnegativity constraint
-                    loss_new = np.linalg.norm(X - W @ H1_temp)**2
-                    count += 1
-            """
-            H1 = H1_temp
-
-        i = i + 1
-
-
-    return H1
-
 def code_update_sparse(X, W, H0=None, r=None, alpha=1, sub_iter=[5], stopping_grad_ratio=0.02, subsample_ratio=None, nonnegativity=True):
     '''
     Find \hat{H} = argmin_H ( || X - WH||^2 ) within radius r from H0
@@ -885,9 +928,9 @@ def fit_MLR_GD(Y, H, W0=None, sub_iter=100, stopping_diff=0.01):
         i = 0
         grad = np.ones(W0.shape)
         while (i < sub_iter) and (np.linalg.norm(grad) > stopping_diff):
-            Q = 1/(1+np.exp(-H.T @ W1))  # probability matrix, same shape as Y
+            _, Q, grad = logistic_loss_grad(W1.T, H, Y.T, compute_loss=False)  # Q = probability matrix, same shape as Y.T
             # grad = H @ (Q - Y).T + alpha * np.ones(W0.shape[1])
-            grad = H @ (Q - Y)
+            grad = grad.T  # = H @ (Q.T - Y)
             W1 = W1 - (np.log(i+1) / (((i + 1) ** (0.5)))) * grad
             i = i + 1
             # print('iter %i, grad_norm %f' %(i, np.linalg.norm(grad)))
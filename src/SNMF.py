@@ -15,9 +15,11 @@ from sklearn.metrics import precision_recall_curve
 from sklearn.metrics import accuracy_score
 from sklearn.metrics import confusion_matrix
 import scipy.sparse as sp
-from sklearn.decomposition import SparseCoder
 from sklearn.linear_model import LogisticRegression
 from scipy.linalg import block_diag
+from src.kernels import radius_scale, scale_toward, update_code_within_radius
+from src.kernels import fit_logistic_newton, sq_norm, recons_error, as_dtype, logistic_loss_grad, sigmoid
+from src.kernels import sparse_code_batched, power_iteration, update_code_fista, update_dict_joint_logistic_fista
 
 
 
@@ -63,22 +65,27 @@ class SNMF():
                  L1_reg=[0,0,0], # L1 regularizer for code H, dictioanry W[0], and regression params W[1]
                  L2_reg=[0,0,0], # L2 regularizer for code H, dictioanry W[0], and regression params W[1]
                  nonnegativity=[True,True,False], # nonnegativity constraints on code H, dictionary W[0], reg params W[1]
-                 full_dim=False): # if true, dictionary matrix W[0] is Id with size d1 x d1 -- no dimension reduction
+                 full_dim=False, # if true, dictionary matrix W[0] is Id with size d1 x d1 -- no dimension reduction
+                 dtype=np.float64): # floating point type of data, loading, code and all intermediates (e.g. np.float32)
 
-        self.X = X
+        self.dtype = dtype
+        self.X = [as_dtype(X[0], dtype), as_dtype(X[1], dtype)]
+        X_auxiliary = as_dtype(X_auxiliary, dtype)
         self.X_auxiliary = X_auxiliary
         self.d3 = 0 # auxiliary data dim
         self.nonnegativity = nonnegativity
         if X_auxiliary is not None:
             self.d3 = X_auxiliary.shape[0]
 
+        if X_test is not None:
+            X_test = [as_dtype(X_test[0], dtype), as_dtype(X_test[1], dtype)]
         self.X_test = X_test
-        self.X_test_aux = X_test_aux
+        self.X_test_aux = as_dtype(X_test_aux, dtype)
         self.n_components = n_components
         self.iterations = iterations
-        self.ini_code = ini_code
+        self.ini_code = as_dtype(ini_code, dtype)
         if ini_code is None:
-            self.ini_code = np.random.rand(n_components, X[0].shape[1])
+            self.ini_code = np.random.rand(n_components, X[0].shape[1]).astype(dtype)
 
         self.loading = ini_loading
         if ini_loading is None:
@@ -87,12 +94,13 @@ class SNMF():
             r = n_components
             self.loading = [np.random.rand(X[0].shape[0], r), 1-2*np.random.rand(X[1].shape[0], r + 1 + self.d3)]  # additional first column for constant terms in Logistic Regression
             # add additional d3 columns of regression coefficients for the auxiliary variables
+        self.loading = [as_dtype(W, dtype) for W in self.loading]
         print('initial loading beta', self.loading[1])
 
         self.xi = xi
         self.L1_reg = L1_reg
         self.L2_reg = L2_reg
-        self.code = np.zeros(shape=(n_components, X[0].shape[1]))
+        self.code = np.zeros(shape=(n_components, X[0].shape[1]), dtype=dtype)
         self.full_dim = full_dim
         self.result_dict = {}
         self.result_dict.update({'xi' : self.xi})
@@ -102,7 +110,7 @@ class SNMF():
         self.result_dict.update({'n_components' : self.n_components})
 
 
-    def sparse_code(self, X, W, sparsity=0):
+    def sparse_code(self, X, W, sparsity=0, H0=None):
         # Same function as OMF
 
         '''
@@ -112,6 +120,7 @@ class SNMF():
         args:
             X (numpy array): data matrix with dimensions: features (d) x samples (n)
             W (numpy array): dictionary matrix with dimensions: features (d) x topics (r)
+            H0 (numpy array): warm start for the code (e.g. the code of the previous iteration)
 
         returns:
             H (numpy array): code matrix with dimensions: topics (r) x samples(n)
@@ -124,21 +133,17 @@ class SNMF():
             print('X.shape:', X.shape)
             print('W.shape:', W.shape, '\n')
 
-        # initialize the SparseCoder with W as its dictionary
-        # then find H such that X \approx W*H
-        coder = SparseCoder(dictionary=W.T, transform_n_nonzero_coefs=None,
-                            transform_alpha=sparsity, transform_algorithm='lasso_lars', positive_code=True)
-        # alpha = L1 regularization parameter.
-        H = coder.transform(X.T)
+        # find H >= 0 such that X \approx W*H, with the same objective as SparseCoder(lasso_lars)
+        # alpha = L1 regularization parameter. All columns share the Gram matrix W.T @ W (dense or sparse X).
+        H = sparse_code_batched(X, W, alpha=sparsity, H0=H0, nonnegativity=True)
 
-        # transpose H before returning to undo the preceding transpose on X
         # print('!!! sparse_code: Start')
-        return H.T
+        return H.astype(W.dtype, copy=False)
 
 
-    def update_beta_logistic(self, Y, W0, input, r, a1=0, sub_iter=2, stopping_diff=0.1, nonnegativity=True, history=1):
+    def update_beta_logistic(self, Y, W0, input, r, a1=0, sub_iter=2, stopping_diff=0.1, nonnegativity=True, history=1, radius_norm='spectral'):
         '''
-        Y = (p' x n), W = (p' x (r+1)), H = (r' x n), H' = np.vstack((np.ones(n), H))
+        Y = (p' x n), W = (p' x (r+1)), H = (r' x n), H' = np.vstack((np.ones(n, dtype=self.dtype), H))
         W0 = [W_beta  W_beta_aux]
         H = [H               ]
             [self.X_auxiliary]
@@ -146,10 +151,11 @@ class SNMF():
         MLE -->
         Find \hat{W} = argmin_W ( sum_j ( log(1+exp(W H_j) ) - Y (W H).T ) ) within radius r from W0
         Use row-wise projected gradient descent
+        radius_norm = 'spectral' (default), 'fro' or 'row' : norm in which the radius r is measured (see kernels.radius_scale)
         '''
 
         d1 = self.X[0].shape[0] # data dim
-        H = np.vstack((np.ones(Y.shape[1]), input))
+        H = np.vstack((np.ones(Y.shape[1], dtype=self.dtype), input))
         #H -= np.mean(H)
         #H /= np.std(H)
 
@@ -157,24 +163,35 @@ class SNMF():
             H = np.vstack((H, self.X_auxiliary)) # add additional rows for the auxiliary explanatory variables
 
         A = H @ H.T
-        P = 1/(1+np.exp(-W0 @ H))  # probability matrix, same shape as Y
+        _, P, grad_W = logistic_loss_grad(W0, H, Y, compute_loss=False)  # P = probability matrix, same shape as Y
 
         W1 = W0.copy()
+        W_center = W0
+        row_dist = np.zeros(W1.shape[0], dtype=W1.dtype)  # squared distances |W1[k] - W_center[k]|^2 for radius_norm='fro'
         i = history
         dist = 1
         while (i < sub_iter) and (dist > stopping_diff):
             # W1_old = W1.copy()
             for k in np.arange(W0.shape[0]):
-                grad = H @ (P[k,:] - Y[k,:]).T + a1 * np.ones(W0.shape[1])
+                grad = grad_W[k, :] + a1  # = H @ (P[k,:] - Y[k,:]).T + a1
                 # H1[k, :] = H1[k,:] - (1 / (A[k, k] + np.linalg.norm(grad, 2))) * grad
                 W1[k, :] = W1[k, :] - (1 / (((i + 10) ** (0.5)) * (A[k, k] + 1))) * grad
 
                 if nonnegativity:
-                    W1[k, :] = np.maximum(W1[k, :], np.zeros(shape=(W1.shape[1],)))  # nonnegativity constraint
+                    W1[k, :] = np.maximum(W1[k, :], 0)  # nonnegativity constraint
 
                 if r is not None:  # usual sparse coding without radius restriction
-                    d = np.linalg.norm(W1 - W0, 2)
-                    W1 = W0 + (r / max(r, d)) * (W1 - W0)
+                    if radius_norm == 'spectral':
+                        d = np.linalg.norm(W1 - W0, 2)
+                        W1 = W0 + (r / max(r, d)) * (W1 - W0)
+                    elif radius_norm == 'fro':
+                        row_dist[k] = np.sum((W1[k, :] - W_center[k, :]) ** 2)
+                        c = radius_scale(np.sqrt(np.sum(row_dist)), r)
+                        if c < 1:
+                            scale_toward(W1, W_center, c)
+                            row_dist *= c ** 2
+                    elif radius_norm == 'row':
+                        scale_toward(W1[k, :], W_center[k, :], radius_scale(np.linalg.norm(W1[k, :] - W_center[k, :]), r))
 
                 W0 = W1
 
@@ -184,20 +201,30 @@ class SNMF():
             # print('!!!! i', i)  # mostly the loop finishes at i=1 except the first round
         return W1
 
-    def update_dict_joint_logistic(self, X, H, W0, r, a1=0, a2=0, sub_iter=2, stopping_diff=0.1, nonnegativity=True, subsample_size=None):
+    def update_dict_joint_logistic(self, X, H, W0, r, a1=0, a2=0, sub_iter=2, stopping_diff=0.1, nonnegativity=True, subsample_size=None,
+                                   solver='pgd', X_norm_sq=None):
         '''
         X = [X0, X1]
         W = [W0, W1+W2]
         Find \hat{W} = argmin_W ( || X0 - W0 H||^2 + alpha|H| + Logistic_Loss(W[0].T @ X1, W[1])) within radius r from W0
         Compressed data = W[0].T @ X0 instead of H
+        solver = 'pgd' (projected gradient) or 'fista' (see kernels.update_dict_joint_logistic_fista,
+                 X_norm_sq = largest eigenvalue of X0 X0.T, computed if None)
         '''
 
+        if solver == 'fista':
+            return update_dict_joint_logistic_fista(X, H, W0, r, xi=self.xi, a1=a1, a2=a2, nonnegativity=nonnegativity,
+                                                    X_auxiliary=self.X_auxiliary, X_norm_sq=X_norm_sq,
+                                                    max_iter=sub_iter, tol=stopping_diff)
+
         if W0 is None:
             W0 = np.random.rand(X[0].shape[0], self.n_components)
             print('!!! W0.shape', W0.shape)
 
         #if not self.full_dim:
         A = H @ H.T
+        if not self.full_dim:
+            XHt = X[0] @ H.T  # stays a (d x r) product when X[0] is sparse
 
         W1 = W0[0].copy()
         i = 0
@@ -207,19 +234,18 @@ class SNMF():
             W1_old = W1.copy()
 
             X0_comp = W1.T @ X[0]
-            H1_ext = np.vstack((np.ones(X[1].shape[1]), X0_comp))
+            H1_ext = np.vstack((np.ones(X[1].shape[1], dtype=self.dtype), X0_comp))
             if self.X_auxiliary is not None:
                 H1_ext = np.vstack((H1_ext, self.X_auxiliary[:,:]))
                 # add additional rows for the auxiliary explanatory variables
 
-            # P = probability matrix, same shape as X1
-            D = W0[1] @ H1_ext
-            P = 1 / (1 + np.exp(-D))
+            # P = probability matrix, same shape as X1, grad_ext = W0[1].T @ (P - X1)
+            _, P, grad_ext = logistic_loss_grad(W0[1], H1_ext, X[1], wrt='H', compute_loss=False)
 
             if not self.full_dim:
-                grad_MF = (W1 @ H - X[0]) @ H.T
-                grad_pred = X[0] @ (P-X[1]).T @ W0[1][:, 1:self.n_components+1] # exclude the first column of W[1] (intercept terms)
-                grad = self.xi * grad_MF + grad_pred + a1 * np.sign(W1)*np.ones(shape=W1.shape) + a2 * W1
+                grad_MF = W1 @ A - XHt  # = (W1 @ H - X[0]) @ H.T
+                grad_pred = X[0] @ grad_ext[1:self.n_components+1].T # exclude the first row (intercept terms)
+                grad = self.xi * grad_MF + grad_pred + a1 * np.sign(W1) + a2 * W1
                 # grad = grad_MF
 
                 W1 -= (1 / (((i + 10) ** (0.5)) * (np.trace(A) + 1))) * grad
@@ -230,10 +256,9 @@ class SNMF():
             W0[0] = W1
 
             if nonnegativity:
-                W1 = np.maximum(W1, np.zeros(shape=W1.shape))  # nonnegativity constraint
+                W1 = np.maximum(W1, 0)  # nonnegativity constraint
 
-            dist = np.linalg.norm(W1 - W1_old, 2) / np.linalg.norm(W1_old, 2)
-            dist = 1
+            dist = np.linalg.norm(W1 - W1_old) / np.linalg.norm(W1_old)
             # print('!!! dist', dist)
             # H1_old = H1
             i = i + 1
@@ -246,13 +271,15 @@ class SNMF():
                                    r, a1=0, a2=0, sub_iter=2,
                                    stopping_diff=0.1,
                                    nonnegativity=True,
-                                   subsample_size=None):
+                                   subsample_size=None,
+                                   radius_norm='spectral'):
         '''
         X = [X0, X1]
         W = [W0, W1+W2]
         Find \hat{W} = argmin_H ( || X0 - W0 H||^2 + alpha|H| + Logistic_Loss(W[0].T @ X1, W[1])) within radius r from W0
         Compressed data = W[0].T @ X0 instead of H
         Use column-wise gradient descent (full gradient descent seems to be unstable for high dimensional data (p>250 or so))
+        radius_norm = 'spectral' (default), 'fro' or 'row' (here: per column) : norm in which the radius r is measured (see kernels.radius_scale)
         '''
 
         if W0 is None:
@@ -263,36 +290,46 @@ class SNMF():
         A = H @ H.T
 
         W1 = W0[0].copy()
+        W_center = W0[0]
+        col_dist = np.zeros(W1.shape[1], dtype=W1.dtype)  # squared distances |W1[:,k] - W_center[:,k]|^2 for radius_norm='fro'
         i = 0
         dist = 1
         idx = np.arange(X[0].shape[0])
         while (i < sub_iter) and (dist > stopping_diff):
             W1_old = W1.copy()
             X0_comp = W1.T @ X[0]
-            H1_ext = np.vstack((np.ones(X[1].shape[1]), X0_comp))
+            H1_ext = np.vstack((np.ones(X[1].shape[1], dtype=self.dtype), X0_comp))
             if self.X_auxiliary is not None:
                 H1_ext = np.vstack((H1_ext, self.X_auxiliary[:,:]))
                 # add additional rows for the auxiliary explanatory variables
 
-            # P = probability matrix, same shape as X1
-            D = W0[1] @ H1_ext
-            P = 1 / (1 + np.exp(-D))
+            # P = probability matrix, same shape as X1, grad_ext = W0[1].T @ (P - X1)
+            _, P, grad_ext = logistic_loss_grad(W0[1], H1_ext, X[1], wrt='H', compute_loss=False)
 
             for k in np.arange(W1.shape[1]): #
                 grad_MF = (W1 @ H - X[0]) @ H[k,:].T
                 # grad_pred = X[0] @ (P-X[1]).T @ W0[1][:, 1:] # exclude the first column of W[1] (constant terms)
-                grad_pred = X[0] @ (P-X[1]).T @ W0[1][:, k+1] # exclude the first column of W[1] (constant terms)
-                grad = self.xi * grad_MF + grad_pred + a1 * np.sign(W1[:,k])*np.ones(shape=[len(idx),]) + a2 * W1[:,k]
+                grad_pred = X[0] @ grad_ext[k+1] # = X[0] @ (P-X[1]).T @ W0[1][:, k+1], skipping the intercept row
+                grad = self.xi * grad_MF + grad_pred + a1 * np.sign(W1[:,k]) + a2 * W1[:,k]
                 # grad = grad_MF
 
                 W1[:,k] -= (1 / (((i + 10) ** (0.5)) * (A[k,k] + 1))) * grad
 
                 if nonnegativity:
-                    W1[:,k] = np.maximum(W1[:,k], np.zeros(shape=[len(idx),]))  # nonnegativity constraint
+                    W1[:,k] = np.maximum(W1[:,k], 0)  # nonnegativity constraint
 
                 if r is not None:  # usual sparse coding without radius restriction
-                    d = np.linalg.norm(W1[idx,:] - W0[0][idx,:], 2)
-                    W1[idx,k] = W0[0][idx,k] + (r / max(r, d)) * (W1[idx,k] - W0[0][idx,k])
+                    if radius_norm == 'spectral':
+                        d = np.linalg.norm(W1[idx,:] - W0[0][idx,:], 2)
+                        W1[idx,k] = W0[0][idx,k] + (r / max(r, d)) * (W1[idx,k] - W0[0][idx,k])
+                    elif radius_norm == 'fro':
+                        col_dist[k] = np.sum((W1[:,k] - W_center[:,k]) ** 2)
+                        c = radius_scale(np.sqrt(np.sum(col_dist)), r)
+                        if c < 1:
+                            scale_toward(W1, W_center, c)
+                            col_dist *= c ** 2
+                    elif radius_norm == 'row':
+                        scale_toward(W1[:,k], W_center[:,k], radius_scale(np.linalg.norm(W1[:,k] - W_center[:,k]), r))
                 W0[0] = W1
 
                 dist = np.linalg.norm(W1 - W1_old, 2) / np.linalg.norm(W1_old, 2)
@@ -328,11 +365,11 @@ class SNMF():
             # print('!!! W[1].shape', W[1].shape)
 
             W_stacked = np.vstack((W[0], np.sqrt(self.xi) * W[1]))
-            H = self.sparse_code(X_stacked, W_stacked, sparsity=self.a1)
+            H = self.sparse_code(X_stacked, W_stacked, sparsity=self.a1, H0=H if step > 0 else None)
 
             # Fix H and find W = [dict, beta]
-            W[0] = self.sparse_code(X[0].T, H.T, sparsity=0).T
-            W[1] = self.sparse_code(X[1].T, H.T, sparsity=self.a2).T
+            W[0] = self.sparse_code(X[0].T, H.T, sparsity=0, H0=W[0].T if step > 0 else None).T
+            W[1] = self.sparse_code(X[1].T, H.T, sparsity=self.a2, H0=W[1].T if step > 0 else None).T
 
             end = time.time()
             elapsed_time += end - start
@@ -363,16 +400,22 @@ class SNMF():
                         search_radius_const=1000,
                         if_compute_recons_error=False,
                         update_nuance_param=False,
-                        if_validate=False):
+                        if_validate=False,
+                        solver='pgd'):
         '''
         Given input X = [data, label] and initial loading dictionary W_ini, find W = [dict, beta] and code H
         by two-block coordinate descent: [dict, beta] --> H, H--> [dict, beta]
         Use Supervised NMF (filter-based) model
+        solver = 'pgd' : projected gradient steps with diminishing step sizes for the dictionary and code (default)
+                 'fista' : accelerated proximal gradient for both blocks (see SDL_BCD.fit)
         update_nuance_param = True means self.xi is updated by the MLE (sample variance) each iteration
+        if_compute_recons_error = True logs the training loss [time, data, label] in time_error every iteration
+        (see kernels.recons_error); AUC and early stopping every 10 iterations
         '''
         X = self.X
         r = self.n_components
         n = X[0].shape[1]
+        X_sq = sq_norm(X[0])
 
         #H = np.random.rand(r, n)
         #W = [np.random.rand(X[0].shape[0], r), np.random.rand(X[1].shape[0], r + 1 + self.d3)]  # additional first column for constant terms in Logistic Regression
@@ -382,17 +425,21 @@ class SNMF():
 
         if self.full_dim:
             r = X[0].shape[0]
-            W = [1, np.random.rand(X[1].shape[0], r + 1 + self.d3)] # don't use np.identity(r) for efficient computation
+            W = [1, np.random.rand(X[1].shape[0], r + 1 + self.d3).astype(self.dtype)] # don't use np.identity(r) for efficient computation
             H = X[0]
 
         time_error = np.zeros(shape=[0, 3])
         elapsed_time = 0
         total_error = 0
+        fista_iter = 10  # maximal number of FISTA iterations per block (solver='fista')
+        X_norm_sq = None
+        if (solver == 'fista') and (not self.full_dim):
+            X_norm_sq = power_iteration(X[0].T, gram=False)  # lambda_max(X0 X0.T) for the logistic Lipschitz bound
 
         for step in trange(int(iter)):
             start = time.time()
             if beta is not None:
-                search_radius = search_radius_const * (float(step + 1)) ** (-beta) / np.log(float(step + 2))
+                search_radius = float(search_radius_const * (float(step + 1)) ** (-beta) / np.log(float(step + 2)))
             else:
                 search_radius = None
 
@@ -403,21 +450,29 @@ class SNMF():
 
                 if step % dict_update_freq == 0:
                     W[0] = self.update_dict_joint_logistic(X, H, W, stopping_diff=0.0001,
-                                                     sub_iter = 5,
+                                                     sub_iter = 5 if solver == 'pgd' else fista_iter,
                                                      r=search_radius, nonnegativity=self.nonnegativity[1],
                                                      a1=self.L1_reg[1], a2=self.L2_reg[1],
-                                                     subsample_size = None)
+                                                     subsample_size = None,
+                                                     solver=solver, X_norm_sq=X_norm_sq)
 
                     W[0] /= np.linalg.norm(W[0])
 
 
 
-                H = update_code_within_radius(X[0], W[0], H, r=search_radius,
-                                            a1=self.L1_reg[0], a2=self.L2_reg[0],
-                                            nonnegativity=self.nonnegativity[0])
+                if solver == 'fista':
+                    H = update_code_fista(X[0], W[0], H, r=search_radius,
+                                          a1=self.L1_reg[0], a2=self.L2_reg[0],
+                                          nonnegativity=self.nonnegativity[0],
+                                          max_iter=fista_iter, tol=0.0001)
+                else:
+                    H = update_code_within_radius(X[0], W[0], H, r=search_radius,
+                                                a1=self.L1_reg[0], a2=self.L2_reg[0],
+                                                nonnegativity=self.nonnegativity[0])
 
                 # Beta
-                X0_comp = W[0].T @ X[0]
+                WtX = W[0].T @ X[0]
+                X0_comp = WtX
                 # X0_comp = (X0_comp + H)/2
                 # print('X0_comp mean', np.mean(X0_comp))
                 #print('X0_comp std', np.std(X0_comp))
@@ -433,12 +488,10 @@ class SNMF():
 
                 if self.X_auxiliary is not None:
                     X0_comp = np.vstack((X0_comp, self.X_auxiliary[:,:]))
-                clf = LogisticRegression(random_state=0).fit(X0_comp.T, self.X[1][0,:])
-                W[1][0,1:] = clf.coef_[0]
-                W[1][0,0] = clf.intercept_[0]
+                W[1] = fit_logistic_newton(self.X[1], X0_comp, W[1])  # warm start from the previous beta
 
                 if update_nuance_param:
-                    self.xi = (1/(2*r*n)) * np.linalg.norm((X[0] - W[0] @ H).reshape(-1, 1), ord=2)**2
+                    self.xi = (1/(2*r*n)) * recons_error(X[0], W[0], H, X_sq=X_sq, WtX=WtX)
                     print('xi updated by MLE:', self.xi)
 
             end = time.time()
@@ -455,21 +508,26 @@ class SNMF():
 
 
 
+            if if_compute_recons_error:
+                # training loss every iteration, reusing W[0].T @ X[0] from the beta update
+                if self.full_dim:
+                    error_data = np.linalg.norm((X[0] - H).reshape(-1, 1), ord=2)**2
+                    X0_comp = H if self.X_auxiliary is None else np.vstack((H, self.X_auxiliary))
+                else:
+                    error_data = recons_error(X[0], W[0], H, X_sq=X_sq, WtX=WtX)
+                rel_error_data = error_data / X_sq
+
+                X0_ext = np.vstack((np.ones(X[1].shape[1], dtype=self.dtype), X0_comp))
+                error_label, P_pred, _ = logistic_loss_grad(W[1], X0_ext, X[1], compute_grad=False)
+                total_error_new = error_label + self.xi * error_data
+
+                time_error = np.append(time_error, np.array([[elapsed_time, error_data, error_label]]), axis=0)
+                self.result_dict.update({'Relative_reconstruction_loss (training)': rel_error_data})
+                self.result_dict.update({'Classification_loss (training)': error_label})
+                self.result_dict.update({'time_error': time_error.T})
+
             if (step % 10) == 0:
                 if if_compute_recons_error:
-                    # print the error every 50 iterations
-                    if self.full_dim:
-                        error_data = np.linalg.norm((X[0] - H).reshape(-1, 1), ord=2)**2
-                    else:
-                        error_data = np.linalg.norm((X[0] - W[0] @ H).reshape(-1, 1), ord=2)**2
-                    rel_error_data = error_data / np.linalg.norm(X[0].reshape(-1, 1), ord=2)**2
-
-                    X0_comp = W[0].T @ X[0]
-                    X0_ext = np.vstack((np.ones(X[1].shape[1]), X0_comp))
-                    if self.d3>0:
-                        X0_ext = np.vstack((X0_ext, self.X_auxiliary))
-                    P_pred = np.matmul(W[1], X0_ext)
-                    P_pred = 1 / (np.exp(-P_pred) + 1)
                     # print('!!! error norm', np.linalg.norm(X[1][0, :]-P_pred[0,:])/X[1].shape[1])
                     fpr, tpr, thresholds = metrics.roc_curve(X[1][0, :], P_pred[0,:], pos_label=None)
                     mythre = thresholds[np.argmax(tpr - fpr)]
@@ -477,18 +535,8 @@ class SNMF():
                     self.result_dict.update({'Training_threshold':mythre})
                     self.result_dict.update({'Training_AUC':myauc})
                     print('--- Training --- [threshold, AUC] = ', [np.round(mythre,3), np.round(myauc,3)])
-                    error_label = np.sum(np.log(1+np.exp(W[1] @ X0_ext))) - X[1] @ (W[1] @ X0_ext).T
-                    error_label = error_label[0][0]
-
-                    total_error_new = error_label + self.xi * error_data
-
-                    time_error = np.append(time_error, np.array([[elapsed_time, error_data, error_label]]), axis=0)
                     print('--- Iteration %i: Training loss --- [Data, Label, Total] = [%f.3, %f.3, %f.3]' % (step, error_data, error_label, total_error_new))
 
-                    self.result_dict.update({'Relative_reconstruction_loss (training)': rel_error_data})
-                    self.result_dict.update({'Classification_loss (training)': error_label})
-                    self.result_dict.update({'time_error': time_error.T})
-
                     # stopping criterion
                     if (total_error > 0) and (total_error_new > 1.001 * total_error):
                         print("Early stopping: training loss increased")
@@ -513,8 +561,7 @@ class SNMF():
                 #    print('!!! W norm', np.linalg.norm(W[0].reshape(-1,1)))
 
         ### fine-tune beta
-        clf = LogisticRegression(random_state=0).fit(X0_comp.T, self.X[1][0,:])
-        W[1][0,1:] = clf.coef_[0]
+        W[1] = fit_logistic_newton(self.X[1], X0_comp, W[1])
 
         self.validation(result_dict = self.result_dict)
         #threshold = self.result_dict.get('Opt_threshold')
@@ -550,7 +597,7 @@ class SNMF():
 
         if self.full_dim:
             r = X[0].shape[0]
-            W = [1, np.random.rand(X[1].shape[0], r + 1 + self.d3)] # don't use np.identity(r) for efficient computation
+            W = [1, np.random.rand(X[1].shape[0], r + 1 + self.d3).astype(self.dtype)] # don't use np.identity(r) for efficient computation
             H = X[0]
 
         result_dict = {}
@@ -563,7 +610,7 @@ class SNMF():
         else: # logistic regression **after** dimension reduction
             for step in trange(int(iter)):
                 start = time.time()
-                search_radius = search_radius_const * (float(step + 1)) ** (-beta) / np.log(float(step + 2))
+                search_radius = float(search_radius_const * (float(step + 1)) ** (-beta) / np.log(float(step + 2)))
                 #print('!!! search_radius', search_radius)
 
 
@@ -584,7 +631,7 @@ class SNMF():
                                              nonnegativity=self.nonnegativity[2], history=1)
             """
             # Now that W[0] and H are fixed, further optimize the regression coefficients W[1]
-            H1 = np.vstack((np.ones(H.shape[1]), H))
+            H1 = np.vstack((np.ones(H.shape[1], dtype=self.dtype), H))
             clf = LogisticRegression(random_state=0).fit(H1.T, self.X[1][0,:])
             W[1] = clf.coef_
 
@@ -609,7 +656,7 @@ class SNMF():
             else:
                 error_data = np.linalg.norm((X[0] - W[0] @ H).reshape(-1, 1), ord=2)
 
-            H_ext = np.vstack((np.ones(X[1].shape[1]), H))
+            H_ext = np.vstack((np.ones(X[1].shape[1], dtype=self.dtype), H))
             if self.d3>0:
                 H_ext = np.vstack((H_ext, self.X_auxiliary))
 
@@ -617,7 +664,7 @@ class SNMF():
             #print('W[1].shape', W[1].shape)
 
             P_pred = np.matmul(W[1], H_ext)
-            P_pred = 1 / (np.exp(-P_pred) + 1)
+            P_pred = sigmoid(P_pred)
             # print('!!! error norm', np.linalg.norm(X[1][0, :]-P_pred[0,:])/X[1].shape[1])
             fpr, tpr, thresholds = metrics.roc_curve(X[1][0, :], P_pred[0,:], pos_label=None)
             mythre = thresholds[np.argmax(tpr - fpr)]
@@ -626,7 +673,7 @@ class SNMF():
             self.result_dict.update({'Training_AUC':myauc})
 
             print('--- Training --- [threshold, AUC] = ', [np.round(mythre,3), np.round(myauc,3)])
-            error_label = np.sum(np.log(1+np.exp(W[1] @ H_ext))) - X[1] @ (W[1] @ H_ext).T
+            error_label = logistic_loss_grad(W[1], H_ext, X[1], compute_grad=False)[0]
             time_error = np.append(time_error, np.array([[elapsed_time, error_data, error_label]]), axis=0)
             print('--- Training loss --- [Data, Label] = [%f.3, %f.3]' % (error_data, error_label))
 
@@ -684,15 +731,15 @@ class SNMF():
 
         if X_test_aux is not None:
             H = np.vstack((H, X_test_aux))
-        H2 = np.vstack((np.ones(H.shape[1]), H))
+        H2 = np.vstack((np.ones(H.shape[1], dtype=self.dtype), H))
 
         # Get threshold from training set
         X0_comp = W[0].T @ self.X[0]
-        X0_ext = np.vstack((np.ones(self.X[1].shape[1]), X0_comp))
+        X0_ext = np.vstack((np.ones(self.X[1].shape[1], dtype=self.dtype), X0_comp))
         if self.d3>0:
             X0_ext = np.vstack((X0_ext, self.X_auxiliary))
         P_pred = np.matmul(W[1], X0_ext)
-        P_pred = 1 / (np.exp(-P_pred) + 1)
+        P_pred = sigmoid(P_pred)
         # print('!!! error norm', np.linalg.norm(X[1][0, :]-P_pred[0,:])/X[1].shape[1])
         fpr, tpr, thresholds = metrics.roc_curve(self.X[1][0, :], P_pred[0,:], pos_label=None)
         mythre = thresholds[np.argmax(tpr - fpr)]
@@ -700,7 +747,7 @@ class SNMF():
 
         # Compute accuracy metrics for the test set
         P_pred = np.matmul(H2.T, beta)
-        P_pred = 1 / (np.exp(-P_pred) + 1)  # predicted probability for Y_test
+        P_pred = sigmoid(P_pred)  # predicted probability for Y_test
 
         fpr, tpr, thresholds = metrics.roc_curve(test_Y[0, :], P_pred, pos_label=None)
 
@@ -734,8 +781,8 @@ class SNMF():
 
         # Compute test data reconstruction loss
         H_test = self.sparse_code(X_test[0], W[0])
-        error_data = np.linalg.norm((X_test[0] - W[0] @ H_test).reshape(-1, 1), ord=2)**2
-        rel_error_data = error_data / np.linalg.norm(X_test[0].reshape(-1, 1), ord=2)**2
+        error_data = recons_error(X_test[0], W[0], H_test)
+        rel_error_data = error_data / sq_norm(X_test[0])
 
         # Save results
         result_dict.update({'Relative_reconstruction_loss (test)': rel_error_data})
@@ -783,16 +830,16 @@ class SNMF():
         n = X_test.shape[1]
         if W is None:
             W = self.loading
-        H = np.random.rand(r, n)
+        H = np.random.rand(r, n).astype(self.dtype)
 
         for step in range(int(iter)):
             start = time.time()
             # search_radius = search_radius_const * (float(step + 1)) ** (-beta) / np.log(float(step + 2))
 
             # Update the missing label P_pred
-            H_ext = np.vstack((np.ones(X_test.shape[1]), H))
+            H_ext = np.vstack((np.ones(X_test.shape[1], dtype=self.dtype), H))
             P_pred = np.matmul(W[1], H_ext)
-            P_pred = 1 / (np.exp(-P_pred) + 1)
+            P_pred = sigmoid(P_pred)
             X = [X_test, P_pred]
 
             # Update code
@@ -818,89 +865,6 @@ def safe_vstack(Xs):
         return np.vstack(Xs)
 
 
-def update_code_within_radius(X, W, H0, r, a1=0, a2=0,
-                              sub_iter=[2], stopping_grad_ratio=0.0001,
-                              subsample_ratio=None, nonnegativity=True,
-                              use_line_search=False):
-    '''
-    Find \hat{H} = argmin_H ( | X - WH| + alpha|H| ) within radius r from H0
-    Use row-wise projected gradient descent
-    Do NOT sparsecode the whole thing and then project -- instable
-    12/5/2020 Lyu
-
-    For NTF problems, X is usually tall and thin so it is better to subsample from rows
-    12/25/2020 Lyu
-
-    Apply single round of AdaGrad for rows, stop when gradient norm is small and do not make update
-    12/27/2020 Lyu
-    '''
-
-    # print('!!!! X.shape', X.shape)
-    # print('!!!! W.shape', W.shape)
-    # print('!!!! H0.shape', H0.shape)
-
-    if H0 is None:
-        H0 = np.random.rand(W.shape[1], X.shape[1])
-    H1 = H0.copy()
-    i = 0
-    dist = 1
-    idx = np.arange(X.shape[0])
-    H1_old = H1.copy()
-
-    A = W.T @ W
-    B = W.T @ X
-
-    while (i < np.random.choice(sub_iter)):
-        if_continue = np.ones(H0.shape[0])  # indexed by rows of H
-
-        for k in [k for k in np.arange(H0.shape[0]) if if_continue[k]>0.5]:
-
-            grad = np.dot(A[k, :], H1) - B[k, :]
-            grad += a1 * np.sign(H1[k, :]) * np.ones(H0.shape[1]) + a2 * H1[k, :]
-            grad_norm = np.linalg.norm(grad, 2)
-
-            # Initial step size
-            step_size = 1/(A[k,k]+1)
-            # step_size = 1 / (np.trace(A)) # use the whole trace
-            # step_size = 1
-            if r is not None:  # usual sparse coding without radius restriction
-                d = step_size * grad_norm
-                step_size = (r / max(r, d)) * step_size
-
-            H1_temp = H1.copy()
-            # loss_old = np.linalg.norm(X - W @ H1)**2
-            H1_temp[k, :] = H1[k, :] - step_size * grad
-            if nonnegativity:
-                H1_temp[k,:] = np.maximum(H1_temp[k,:], np.zeros(shape=(H1.shape[1],)))  # nonnegativity constraint
-            #loss_new = np.linalg.norm(X - W @ H1_temp)**2
-            #if loss_old > loss_new:
-
-                # print('recons_loss:' , np.linalg.norm(X - W @ H1, ord=2) / np.linalg.norm(X, ord=2))
-
-            """
-            if use_line_search:
-            # Armijo backtraking line search
-                m = grad.T @ H1[k,:]
-                H1_temp = H1.copy()
-                loss_old = np.linalg.norm(X - W @ H1)**2
-                loss_new = 0
-                count = 0
-                while (count==0) or (loss_old - loss_new < 0.1 * step_size * m):
-                    step_size /= 2
-                    H1_temp[k, :] = H1[k, :] - step_size * grad
-                    if nonnegativity:
-                        H1_temp[k,:] = np.maximum(H1_temp[k,:], np.zeros(shape=(H1.shape[1],)))  # nonnegativity constraint
-                    loss_new = np.linalg.norm(X - W @ H1_temp)**2
-                    count += 1
-            """
-            H1 = H1_temp
-
-        i = i + 1
-
-
-    return H1
-
-
 def block_dict_column_update(X, H, W0=None, r=None, alpha=0):
     '''
     Use column-wise block minimization for dictionary upate to induce L1 sparsity on each columns
@@ -1086,9 +1050,9 @@ def fit_MLR_GD(Y, H, W0=None, sub_iter=100, stopping_diff=0.01):
         i = 0
         grad = np.ones(W0.shape)
         while (i < sub_iter) and (np.linalg.norm(grad) > stopping_diff):
-            Q = 1/(1+np.exp(-H.T @ W1))  # probability matrix, same shape as Y
+            _, Q, grad = logistic_loss_grad(W1.T, H, Y.T, compute_loss=False)  # Q = probability matrix, same shape as Y.T
             # grad = H @ (Q - Y).T + alpha * np.ones(W0.shape[1])
-            grad = H @ (Q - Y)
+            grad = grad.T  # = H @ (Q.T - Y)
             W1 = W1 - (np.log(i+1) / (((i + 1) ** (0.5)))) * grad
             i = i + 1
             # print('iter %i, grad_norm %f' %(i, np.linalg.norm(grad)))
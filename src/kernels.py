@@ -0,0 +1,1121 @@
+# Numerical kernels shared by SDL_BCD, SDL_SVP, LMF and SNMF
+# Author: Joowon Lee and Hanbaek Lyu
+
+import os
+import numpy as np
+import scipy.sparse as sp
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from multiprocessing import shared_memory
+from scipy.linalg import get_blas_funcs, cho_factor, cho_solve, LinAlgError
+from scipy.special import expit
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:  # optional: the BLAS pool is then not limited in the threaded chunked coder
+    threadpool_limits = None
+
+
+def update_code_joint_logistic(X, W, H0, r,
+                               X_auxiliary=None,
+                               a1=0, a2=0, sub_iter=2,
+                               stopping_diff=0.1, nonnegativity=True,
+                               xi=0,
+                               subsample_size=None,
+                               full_dim=False,
+                               mode='row',
+                               radius_norm='spectral',
+                               A=None, B=None):
+    '''
+    X = [X0, X1]
+    W = [W0, W1+W2]
+    Find \hat{H} = argmin_H ( xi * || X0 - W0 H||^2 + alpha|H| + Logistic_Loss(X1, [W1|W2], H)) within radius r from H0
+    mode = 'row' (row-wise), 'block' (whole H per step) or 'fista' projected gradient; radius_norm : see radius_scale
+    A, B : precomputed W0.T @ W0 and W0.T @ X0, computed if None
+    '''
+
+    if H0 is None:
+        H0 = np.random.rand(W[0].shape[1], X[0].shape[1]).astype(W[1].dtype)
+        # print('!!! H0.shape', H0.shape)
+
+    if (mode == 'fista') and not full_dim:
+        return update_code_joint_logistic_fista(X, W, H0, r, X_auxiliary=X_auxiliary, a1=a1, a2=a2, xi=xi,
+                                                nonnegativity=nonnegativity, A=A, B=B,
+                                                max_iter=sub_iter, tol=stopping_diff)
+
+    if mode == 'block':
+        return update_code_joint_logistic_block(X, W, H0, r, X_auxiliary=X_auxiliary,
+                                                a1=a1, a2=a2, sub_iter=sub_iter,
+                                                stopping_diff=stopping_diff,
+                                                nonnegativity=nonnegativity, xi=xi,
+                                                subsample_size=subsample_size,
+                                                full_dim=full_dim,
+                                                radius_norm=radius_norm,
+                                                A=A, B=B)
+
+    if not full_dim:
+        if A is None:
+            A = W[0].T @ W[0]
+        if B is None:
+            B = W[0].T @ X[0]
+
+    H1 = H0.copy()
+
+    # Logits D = W[1] @ [1; H1; X_auxiliary] and probabilities P are kept as running state.
+    # Changing row k of H1 changes D by the rank-1 term W[1][:, k+1] (H1_new[k] - H1_old[k]),
+    # so each row update costs O(d2 * n) instead of recomputing D from scratch.
+    H1_ext = np.vstack((np.ones(X[0].shape[1], dtype=H1.dtype), H1))
+    if X_auxiliary is not None:
+        H1_ext = np.vstack((H1_ext, X_auxiliary))
+        # add additional rows for the auxiliary explanatory variables
+    D = W[1] @ H1_ext
+    P = sigmoid(D)  # probability matrix, same shape as X1
+    D0 = D.copy()  # logits at H0, needed when the radius projection rescales H1 - H0
+    row_dist = np.zeros(H1.shape[0])  # squared distances |H1[k] - H0[k]|^2 for radius_norm='fro'
+
+    i = 0
+    dist = 1
+    idx = np.arange(X[0].shape[1])
+    while (i < sub_iter) and (dist > stopping_diff):
+        H1_old = H1.copy()
+        for k in np.arange(H1.shape[0]):
+            if subsample_size is not None:
+                idx = np.random.randint(X[0].shape[1], size=subsample_size)
+
+            h_old = H1[k, idx]
+            if full_dim:
+                grad = W[1][:,k] @ (P[:,idx]-X[1][:,idx])
+                h_new = h_old - (1 / (((i + 10) ** (0.5)) * (0 + 1))) * grad
+            else:
+                grad_MF = (np.dot(A[k, :], H1[:,idx]) - B[k, idx])
+                grad_pred = W[1][:,k+1] @ (P[:,idx]-X[1][:,idx])
+                grad =  xi * grad_MF + grad_pred + a1 * np.sign(h_old) + a2 * h_old
+                h_new = h_old - (1 / (((i + 10) ** (0.5)) * (A[k, k] + 1))) * grad
+
+            if nonnegativity:
+                h_new = np.maximum(h_new, 0)  # nonnegativity constraint
+
+            # rank-1 correction of the logits and probabilities on the updated columns
+            H1[k, idx] = h_new
+            D[:, idx] += np.outer(W[1][:, k+1], h_new - h_old)
+            P[:, idx] = sigmoid(D[:, idx])
+
+            if r is None:  # usual sparse coding without radius restriction
+                continue
+
+            if radius_norm == 'spectral':
+                # legacy: spectral norm (full SVD) of H1 - H0, re-centered after every row
+                d = np.linalg.norm(H1 - H0, 2)
+                if d > r:
+                    H1 = H0 + (r / d) * (H1 - H0)
+                    D = D0 + (r / d) * (D - D0)  # logits are affine in H
+                    P = sigmoid(D)
+                H0 = H1
+                D0 = D
+
+            elif radius_norm == 'fro':
+                row_dist[k] = np.sum((H1[k, :] - H0[k, :]) ** 2)
+                c = radius_scale(np.sqrt(np.sum(row_dist)), r)
+                if c < 1:
+                    scale_toward(H1, H0, c)
+                    scale_toward(D, D0, c)  # logits are affine in H
+                    sigmoid(D, out=P)
+                    row_dist *= c ** 2
+
+            elif radius_norm == 'row':
+                h_old = H1[k, :].copy()
+                c = radius_scale(np.linalg.norm(H1[k, :] - H0[k, :]), r)
+                if c < 1:
+                    scale_toward(H1[k, :], H0[k, :], c)
+                    D += np.outer(W[1][:, k+1], H1[k, :] - h_old)
+                    sigmoid(D, out=P)
+
+        dist = np.linalg.norm(H1 - H1_old, 2) / np.linalg.norm(H1_old, 2)
+        # print('!!! dist', dist)
+        i = i + 1
+        # print('!!!! i', i)  # mostly the loop finishes at i=1 except the first round
+
+    return H1
+
+
+def update_code_joint_logistic_block(X, W, H0, r,
+                                     X_auxiliary=None,
+                                     a1=0, a2=0, sub_iter=2,
+                                     stopping_diff=0.1, nonnegativity=True,
+                                     xi=0,
+                                     subsample_size=None,
+                                     full_dim=False,
+                                     radius_norm='spectral',
+                                     A=None, B=None):
+    '''
+    Block version of update_code_joint_logistic: one projected gradient step on all rows of H per sub-iteration,
+    step size 1 / (xi * tr(W0.T W0) + |W1|_F^2 / 4 + a2 + 1)
+    '''
+
+    m = X[0].shape[1]
+    r_code = H0.shape[0]
+    beta_code = W[1][:, 1:r_code+1]  # exclude the first column of W[1] (intercept terms)
+    beta_aux = W[1][:, r_code+1:]
+
+    if full_dim:
+        L = 0
+    else:
+        if A is None:
+            A = W[0].T @ W[0]
+        if B is None:
+            B = W[0].T @ X[0]
+        L = xi * np.trace(A)
+    L += np.linalg.norm(beta_code) ** 2 / 4 + a2 + 1
+
+    # logits of the intercept and the auxiliary variables do not depend on H
+    D_fixed = np.repeat(W[1][:, :1], m, axis=1)
+    if X_auxiliary is not None:
+        D_fixed += beta_aux @ X_auxiliary
+
+    H1 = H0.copy()
+    i = 0
+    dist = 1
+    idx = slice(None)
+    while (i < sub_iter) and (dist > stopping_diff):
+        H1_old = H1.copy()
+        if subsample_size is not None:
+            idx = np.random.randint(m, size=subsample_size)
+
+        H_idx = H1[:, idx]
+        _, P, grad = logistic_loss_grad(beta_code, H_idx, X[1][:, idx], offset=D_fixed[:, idx],
+                                        wrt='H', compute_loss=False)  # grad = beta_code.T @ (P - X1)
+        if not full_dim:
+            grad += xi * (A @ H_idx - B[:, idx])
+        if a1 > 0:
+            grad += a1 * np.sign(H_idx)
+        if a2 > 0:
+            grad += a2 * H_idx
+
+        H_idx -= (1 / L) * grad
+        if nonnegativity:
+            np.maximum(H_idx, 0, out=H_idx)  # nonnegativity constraint
+        H1[:, idx] = H_idx
+
+        if r is not None:  # usual sparse coding without radius restriction
+            if radius_norm == 'row':
+                c = radius_scale(np.linalg.norm(H1 - H0, axis=1), r)
+                scale_toward(H1, H0, c[:, np.newaxis])
+            else:
+                ord = 2 if radius_norm == 'spectral' else 'fro'
+                scale_toward(H1, H0, radius_scale(np.linalg.norm(H1 - H0, ord), r))
+
+        dist = np.linalg.norm(H1 - H1_old, 2) / np.linalg.norm(H1_old, 2)
+        i = i + 1
+
+    return H1
+
+
+def update_code_within_radius(X, W, H0, r, a1=0, a2=0,
+                              sub_iter=[2], stopping_grad_ratio=0.0001,
+                              subsample_ratio=None, nonnegativity=True,
+                              use_line_search=False,
+                              A=None, B=None, chunk_size=None, n_jobs=None):
+    '''
+    Find \hat{H} = argmin_H ( | X - WH| + alpha|H| ) within radius r from H0
+    Use row-wise projected gradient descent
+    Do NOT sparsecode the whole thing and then project -- instable
+    12/5/2020 Lyu
+
+    For NTF problems, X is usually tall and thin so it is better to subsample from rows
+    12/25/2020 Lyu
+
+    Apply single round of AdaGrad for rows, stop when gradient norm is small and do not make update
+    12/27/2020 Lyu
+
+    A, B : precomputed W.T @ W and W.T @ X, computed if None (X and W are then unused)
+    use_line_search : Armijo backtracking of each row step on 0.5|X - WH|^2 + a1|H|_1 + 0.5 a2|H|^2, from A and G
+    chunk_size, n_jobs : code chunks of chunk_size columns (each within radius r sqrt(chunk / n)) in n_jobs threads
+    '''
+
+    if H0 is None:
+        H0 = np.random.rand(W.shape[1], X.shape[1]).astype(np.result_type(W.dtype, np.float32))
+    H1 = np.array(H0, dtype=np.result_type(H0.dtype, (W if W is not None else A).dtype, np.float32))  # copy
+
+    if A is None:
+        A = W.T @ W
+    n = H1.shape[1]
+    if (chunk_size is None) or (chunk_size >= n):
+        chunk_size = n
+    elif sp.issparse(X):
+        X = X.tocsc()  # fast column slicing
+    n_sweeps = np.random.choice(sub_iter)  # drawn once, shared by all chunks
+
+    def code_chunk(lo, hi):
+        # row-wise projected gradient sweeps on the columns lo:hi, within radius r sqrt((hi - lo) / n)
+        r_chunk = r if (r is None) or (hi - lo == n) else r * np.sqrt((hi - lo) / n)
+        H = np.array(H1[:, lo:hi], order='C')
+        X_chunk = X[:, lo:hi] if X is not None else None
+        # G = A @ H - B with B = W.T @ X is the gradient of the quadratic part. It is Fortran-ordered
+        # so that gemm and ger update it in place without an extra (r x n) temporary.
+        if B is None:
+            G = np.asfortranarray(np.asarray(X_chunk.T @ W).T, dtype=H.dtype)
+        else:
+            G = np.array(B[:, lo:hi], dtype=H.dtype, order='F')  # copy, B is not modified
+        gemm, ger = get_blas_funcs(('gemm', 'ger'), (G,))
+        G = gemm(1.0, A, H.T, beta=-1.0, c=G, trans_b=1, overwrite_c=1)
+
+        # workspaces of length hi - lo, reused for every row
+        grad = np.empty(H.shape[1], dtype=H.dtype)
+        h_new = np.empty_like(grad)
+        delta = np.empty_like(grad)
+
+        i = 0
+        while (i < n_sweeps):
+            for k in np.arange(H.shape[0]):
+                h = H[k, :]
+                grad[:] = G[k, :]
+                if a1 != 0:
+                    np.sign(h, out=delta)
+                    delta *= a1
+                    grad += delta
+                if a2 != 0:
+                    np.multiply(h, a2, out=delta)
+                    grad += delta
+                grad_norm = np.linalg.norm(grad, 2)
+
+                # Initial step size
+                step_size = 1/(A[k,k]+1)
+                if r_chunk is not None:  # usual sparse coding without radius restriction
+                    d = step_size * grad_norm
+                    step_size = (r_chunk / max(r_chunk, d)) * step_size
+
+                np.multiply(grad, -step_size, out=h_new)
+                h_new += h
+                if nonnegativity:
+                    np.maximum(h_new, 0, out=h_new)  # nonnegativity constraint
+
+                if use_line_search:
+                    # Armijo backtracking on the row objective, from the Gram matrix A and the cached gradient G
+                    for _ in range(20):
+                        np.subtract(h_new, h, out=delta)
+                        decrease = -(G[k, :] @ delta + 0.5 * A[k, k] * (delta @ delta))
+                        if a1 != 0:
+                            decrease -= a1 * (np.abs(h_new).sum() - np.abs(h).sum())
+                        if a2 != 0:
+                            decrease -= 0.5 * a2 * (h_new @ h_new - h @ h)
+                        if decrease >= -0.1 * (grad @ delta):
+                            break
+                        step_size /= 2
+                        np.multiply(grad, -step_size, out=h_new)
+                        h_new += h
+                        if nonnegativity:
+                            np.maximum(h_new, 0, out=h_new)  # nonnegativity constraint
+
+                # G += A[:, k] (h_new - h), then H[k] = h_new
+                np.subtract(h_new, h, out=delta)
+                G = ger(1.0, A[:, k], delta, a=G, overwrite_a=1)
+                h[:] = h_new
+
+            i = i + 1
+        H1[:, lo:hi] = H
+
+    starts = np.arange(0, n, chunk_size)
+    if (n_jobs is None) or (n_jobs == 1) or (len(starts) == 1):
+        for lo in starts:
+            code_chunk(lo, min(lo + chunk_size, n))
+    else:
+        # cpu_count / n_jobs BLAS threads per chunk worker, so that the pool does not oversubscribe the cores
+        n_threads = max(1, (os.cpu_count() or 1) // n_jobs)
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool, \
+                (threadpool_limits(n_threads) if threadpool_limits is not None else nullcontext()):
+            list(pool.map(lambda lo: code_chunk(lo, min(lo + chunk_size, n)), starts))
+    return H1
+
+
+def sparse_code_batched(X, W, alpha=0, H0=None, nonnegativity=True, A=None,
+                        max_iter=1000, tol=1e-6, chunk_size=10000, n_jobs=None):
+    '''
+    Batched (nonnegative) lasso coder h = argmin_h 0.5 | x - W h |^2 + alpha |h|_1 for every column x of X
+    by cyclic coordinate descent on the rows of H (replaces SparseCoder 'lasso_lars')
+    X = (d x n) dense or scipy.sparse, W = (d x r), H0 = (r x n) warm start (zero if None), A = precomputed W.T @ W
+    chunk_size, n_jobs : columns are coded in chunks of chunk_size in a pool of n_jobs threads (None = serial)
+    '''
+    dtype = np.result_type(W.dtype, np.float32)
+    if A is None:
+        A = W.T @ W
+    A = np.asarray(A, dtype=dtype)
+    r, n = W.shape[1], X.shape[1]
+    if sp.issparse(X):
+        X = X.tocsc()  # fast column slicing
+
+    H = np.zeros((r, n), dtype=dtype)
+    if H0 is not None:
+        H[:] = H0
+        if nonnegativity:
+            np.maximum(H, 0, out=H)
+
+    def code_chunk(j):
+        cols = np.arange(j, min(j + chunk_size, n))  # columns of the chunk that are still active
+        H1 = np.array(H[:, cols], order='C')
+        G = np.asfortranarray(np.asarray(X[:, j:j + len(cols)].T @ W).T, dtype=dtype)
+        gemm, ger = get_blas_funcs(('gemm', 'ger'), (G,))
+        G = gemm(1.0, A, H1.T, beta=-1.0, c=G, trans_b=1, overwrite_c=1)
+
+        for i in np.arange(max_iter):
+            h_new = np.empty(H1.shape[1], dtype=dtype)
+            delta = np.empty_like(h_new)
+            change = np.zeros_like(h_new)  # largest coordinate change of each column in this sweep
+            for k in np.arange(r):
+                if A[k, k] <= 0:  # zero atom
+                    continue
+                h = H1[k, :]
+                # h_new = argmin of the objective in coordinate k
+                np.multiply(G[k, :], -1 / A[k, k], out=h_new)
+                h_new += h
+                if nonnegativity:
+                    h_new -= alpha / A[k, k]
+                    np.maximum(h_new, 0, out=h_new)
+                elif alpha != 0:
+                    np.abs(h_new, out=delta)
+                    delta -= alpha / A[k, k]
+                    np.maximum(delta, 0, out=delta)
+                    np.copysign(delta, h_new, out=h_new)
+
+                np.subtract(h_new, h, out=delta)
+                G = ger(1.0, A[:, k], delta, a=G, overwrite_a=1)
+                h[:] = h_new
+                np.abs(delta, out=delta)
+                np.maximum(change, delta, out=change)
+
+            # columns whose sweep changed no coordinate by more than tol * max|h| are done
+            active = change > tol * np.max(np.abs(H1), axis=0)
+            if not np.all(active):
+                H[:, cols[~active]] = H1[:, ~active]
+                cols, H1, G = cols[active], np.ascontiguousarray(H1[:, active]), np.asfortranarray(G[:, active])
+            if len(cols) == 0:
+                break
+        H[:, cols] = H1
+
+    starts = np.arange(0, n, chunk_size)
+    if (n_jobs is None) or (n_jobs == 1) or (len(starts) == 1):
+        for j in starts:
+            code_chunk(j)
+    else:
+        # cpu_count / n_jobs BLAS threads per chunk worker, as in update_code_within_radius
+        n_threads = max(1, (os.cpu_count() or 1) // n_jobs)
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool, \
+                (threadpool_limits(n_threads) if threadpool_limits is not None else nullcontext()):
+            list(pool.map(code_chunk, starts))
+    return H
+
+
+def nnls_block_pivot(A, B, H0=None, max_iter=None, tol=1e-10):
+    '''
+    Exact nonnegative least squares H = argmin_{H >= 0} 0.5 tr(H.T A H) - tr(B.T H) for all columns at once
+    by block principal pivoting with column grouping (Kim and Park 2011)
+    A = (r x r) Gram matrix W.T W, B = (r x n) W.T X, H0 = previous code (its support is the initial passive set)
+    '''
+    r, n = B.shape
+    if max_iter is None:
+        max_iter = 5 * r + 10
+    F = np.zeros((r, n), dtype=bool) if H0 is None else (np.asarray(H0) > 0)
+    H, Y = _solve_passive(A, B, F)
+
+    alpha = np.full(n, 3)  # remaining full exchanges without improvement
+    beta = np.full(n, r + 1)  # smallest number of infeasible variables so far
+    B_scale = tol * np.max(np.abs(B), axis=0)
+    for i in np.arange(max_iter):
+        infeasible = (F & (H < -tol * np.max(np.abs(H), axis=0))) | (~F & (Y < -B_scale))
+        n_infeasible = np.sum(infeasible, axis=0)
+        cols = np.nonzero(n_infeasible)[0]
+        if len(cols) == 0:
+            break
+
+        improved = n_infeasible[cols] < beta[cols]
+        beta[cols[improved]] = n_infeasible[cols[improved]]
+        alpha[cols[improved]] = 3
+        alpha[cols[~improved]] -= 1
+        backup = cols[alpha[cols] < 0]
+        exchange = infeasible[:, cols]
+        if len(backup) > 0:
+            # exchange only the infeasible variable with the largest index
+            last = r - 1 - np.argmax(infeasible[::-1, backup], axis=0)
+            exchange[:, alpha[cols] < 0] = False
+            exchange[last, np.nonzero(alpha[cols] < 0)[0]] = True
+        F[:, cols] ^= exchange
+        H[:, cols], Y[:, cols] = _solve_passive(A, B[:, cols], F[:, cols])
+
+    return H
+
+
+def _solve_passive(A, B, F):
+    '''
+    H[F] = solution of the normal equations A[F, F] H[F] = B[F] (column by column), H = 0 elsewhere,
+    and Y = A H - B (set to 0 on F). Columns with the same passive set are solved together.
+    '''
+    H = np.zeros(B.shape, dtype=np.result_type(A.dtype, B.dtype, np.float32))
+    patterns, group = np.unique(np.packbits(F, axis=0), axis=1, return_inverse=True)
+    order = np.argsort(np.ravel(group), kind='stable')
+    bounds = np.cumsum(np.bincount(np.ravel(group)))
+    for cols in np.split(order, bounds[:-1]):
+        p = np.flatnonzero(F[:, cols[0]])
+        if len(p) == 0:
+            continue
+        A_p = A[p[:, np.newaxis], p]
+        B_p = B[p[:, np.newaxis], cols]
+        try:
+            H[p[:, np.newaxis], cols] = np.linalg.solve(A_p, B_p)
+        except np.linalg.LinAlgError:  # singular A[F, F], e.g. collinear dictionary atoms
+            H[p[:, np.newaxis], cols] = np.linalg.lstsq(A_p, B_p, rcond=None)[0]
+    Y = A @ H - B
+    Y[F] = 0
+    return H, Y
+
+
+def ridge_factor(A, a2=0):
+    '''
+    Factorization of A + a2 * I (A = W.T @ W) for ridge_solve: Cholesky factor, or the pseudo-inverse
+    if A + a2 * I is singular (e.g. a2 = 0 and collinear atoms). Compute once per dictionary and reuse.
+    '''
+    A2 = A + a2 * np.identity(A.shape[0], dtype=A.dtype)
+    try:
+        return 'cholesky', cho_factor(A2, check_finite=False)
+    except LinAlgError:
+        return 'pinv', np.linalg.pinv(A2, hermitian=True)
+
+
+def ridge_solve(factor, B):
+    '''
+    Closed-form ridge code H = (W.T W + a2 I)^{-1} W.T X = argmin_H |X - WH|^2 / 2 + a2 |H|^2 / 2
+    for B = W.T @ X (r x n) and factor = ridge_factor(W.T @ W, a2)
+    '''
+    kind, F = factor
+    if kind == 'cholesky':
+        return cho_solve(F, B, check_finite=False)
+    return F @ B
+
+
+def fit_logistic_newton(Y, H, W0=None, C=1.0, sub_iter=20, stopping_diff=1e-4):
+    '''
+    Warm-started Newton's method (with step halving) for Logistic Regression of each row of Y on H,
+    same objective as sklearn's LogisticRegression(C=C) (intercept not penalized)
+    Y = (d2 x n) labels, H = (p x n) design matrix (no row of ones), W0 = (d2 x (p+1)) initial [intercept | coef]
+    '''
+    d2 = Y.shape[0]
+    p, n = H.shape
+    dtype = np.result_type(H.dtype, np.float32)
+    if W0 is None:
+        W1 = np.zeros((d2, p + 1), dtype=dtype)
+    else:
+        W1 = np.array(W0, dtype=dtype)  # copy
+
+    def loss(w, logit, y):
+        return C * np.sum(np.logaddexp(0, logit) - y * logit) + np.dot(w[1:], w[1:]) / 2
+
+    HS = np.empty((p, n), dtype=dtype)  # workspace for H diag(s)
+    for j in np.arange(d2):
+        y = np.asarray(Y[j, :], dtype=dtype)
+        w = W1[j, :]
+        logit = w[0] + w[1:] @ H
+        loss_old = loss(w, logit, y)
+        i = 0
+        while i < sub_iter:
+            P = sigmoid(logit)
+            grad = np.empty(p + 1, dtype=dtype)
+            grad[0] = C * np.sum(P - y)
+            grad[1:] = C * (H @ (P - y)) + w[1:]
+            if np.max(np.abs(grad)) < stopping_diff:
+                break
+
+            hess = logistic_hessian(H, C * P * (1 - P), HS)
+            hess[1:, 1:] += np.identity(p)
+            step = np.linalg.solve(hess, grad)
+
+            # step halving until the objective decreases
+            t = 1
+            d_logit = step[0] + step[1:] @ H
+            while True:
+                w_new = w - t * step
+                logit_new = logit - t * d_logit
+                loss_new = loss(w_new, logit_new, y)
+                if (loss_new <= loss_old) or (t < 1e-10):
+                    break
+                t /= 2
+            w, logit, loss_old = w_new, logit_new, loss_new
+            i = i + 1
+        W1[j, :] = w
+
+    return W1
+
+
+def logistic_hessian(H, s, HS=None):
+    '''
+    Hessian [1; H] diag(s) [1; H].T ((p+1) x (p+1)) of the logistic loss in [intercept | coef],
+    where s = P (1 - P) (times C) and H = (p x n). HS = optional (p x n) workspace for H diag(s).
+    '''
+    p = H.shape[0]
+    if HS is None:
+        HS = np.empty(H.shape, dtype=np.result_type(H.dtype, np.float32))
+    np.multiply(H, s, out=HS)
+    hess = np.empty((p + 1, p + 1), dtype=HS.dtype)
+    hess[0, 0] = np.sum(s)
+    hess[0, 1:] = hess[1:, 0] = np.sum(HS, axis=1)
+    hess[1:, 1:] = HS @ H.T
+    return hess
+
+
+def update_logistic_online(Y, H, W0, hess, C=1.0, sub_iter=5):
+    '''
+    Online Newton update of Logistic Regression on a new batch (Y, H) (shapes as in fit_logistic_newton)
+    hess = (d2 x (p+1) x (p+1)) running sum of the Hessians of past batches (quadratic model of their loss), updated in place
+    '''
+    p = H.shape[0]
+    dtype = np.result_type(H.dtype, np.float32)
+    W1 = np.array(W0, dtype=dtype)  # copy
+    reg = np.identity(p + 1, dtype=dtype)
+    reg[0, 0] = 0  # intercept not penalized
+    HS = np.empty(H.shape, dtype=dtype)
+
+    def loss(w, logit, y, w_prev, S):
+        return C * np.sum(np.logaddexp(0, logit) - y * logit) + (w - w_prev) @ S @ (w - w_prev) / 2 + np.dot(w[1:], w[1:]) / 2
+
+    for j in np.arange(Y.shape[0]):
+        y = np.asarray(Y[j, :], dtype=dtype)
+        S = hess[j]
+        w_prev = W1[j, :].copy()
+        w = W1[j, :]
+        logit = w[0] + w[1:] @ H
+        loss_old = loss(w, logit, y, w_prev, S)
+        for i in np.arange(sub_iter):
+            P = sigmoid(logit)
+            grad = S @ (w - w_prev) + reg @ w
+            grad[0] += C * np.sum(P - y)
+            grad[1:] += C * (H @ (P - y))
+            step = np.linalg.solve(logistic_hessian(H, C * P * (1 - P), HS) + S + reg, grad)
+
+            # step halving until the objective decreases
+            t = 1
+            d_logit = step[0] + step[1:] @ H
+            while True:
+                w_new = w - t * step
+                logit_new = logit - t * d_logit
+                loss_new = loss(w_new, logit_new, y, w_prev, S)
+                if (loss_new <= loss_old) or (t < 1e-10):
+                    break
+                t /= 2
+            w, logit, loss_old = w_new, logit_new, loss_new
+
+        W1[j, :] = w
+        P = sigmoid(logit)
+        hess[j] += logistic_hessian(H, C * P * (1 - P), HS)
+    return W1
+
+
+def as_dtype(X, dtype):
+    '''
+    Dense array or scipy.sparse matrix X in floating point type dtype (no copy if it already is); None stays None
+    '''
+    if X is None:
+        return None
+    if sp.issparse(X):
+        return X.astype(dtype, copy=False)
+    return np.asarray(X, dtype=dtype)
+
+
+def sq_norm(X):
+    '''
+    Squared Frobenius norm of a dense array or a scipy.sparse matrix (without densifying)
+    '''
+    if sp.issparse(X):
+        return X.multiply(X).sum()
+    return np.linalg.norm(X.reshape(-1, 1), ord=2)**2
+
+
+def recons_error(X, W, H, X_sq=None, WtX=None, WtW=None, HHt=None):
+    '''
+    Reconstruction error || X - W H ||_F^2 = |X|^2 - 2 <W.T X, H> + <W.T W, H H.T> without the (d x n) residual
+    X_sq, WtX, WtW, HHt : cached |X|^2, W.T @ X, W.T @ W and H @ H.T, computed if None
+    '''
+    if X_sq is None:
+        X_sq = sq_norm(X)
+    if WtX is None:
+        WtX = np.asarray(X.T @ W).T
+    if WtW is None:
+        WtW = W.T @ W
+    if HHt is None:
+        HHt = H @ H.T
+    return max(X_sq - 2 * np.sum(WtX * H) + np.sum(WtW * HHt), 0)
+
+
+def sigmoid(D, out=None):
+    '''
+    Logistic function 1 / (1 + exp(-D)) without overflow for large |D| (scipy.special.expit); out=D for in place
+    '''
+    return expit(D, out=out)
+
+
+def logistic_loss_grad(W, H, Y, offset=None, sample_weight=None, wrt='W',
+                       P=None, grad=None, compute_loss=True, compute_grad=True):
+    '''
+    Logistic loss sum_ij s_j ( log(1 + exp(D_ij)) - Y_ij D_ij ) with logits D = W @ H + offset, P = sigmoid(D),
+    and its gradient (P - Y) diag(s) @ H.T (wrt='W') or W.T @ (P - Y) diag(s) (wrt='H')
+    W = (d2 x p), H = (p x n) dense or scipy.sparse, Y and offset = (d2 x n); P and grad are optional output buffers (dense H)
+    Returns loss, P, grad (None if not computed)
+    '''
+    if sp.issparse(H):
+        D = np.asarray(H.T @ W.T).T  # no out= buffer for a sparse design
+    else:
+        D = np.matmul(W, H, out=P)
+    if offset is not None:
+        D += offset
+    s = sample_weight
+
+    loss = None
+    T = np.empty_like(D)  # workspace
+    if compute_loss:
+        np.logaddexp(0, D, out=T)
+        if s is None:
+            loss = np.sum(T) - np.einsum('ij,ij->', Y, D)
+        else:
+            loss = np.einsum('ij,j->', T, s) - np.einsum('ij,ij,j->', Y, D, s)
+
+    P = expit(D, out=D)
+    if compute_grad:
+        R = np.subtract(P, Y, out=T)
+        if s is not None:
+            R *= s
+        if wrt == 'W' and sp.issparse(H):
+            grad = np.asarray(H @ R.T).T
+        elif wrt == 'W':
+            grad = np.matmul(R, H.T, out=grad)
+        else:
+            grad = np.matmul(W.T, R, out=grad)
+    return loss, P, grad
+
+
+def radius_scale(d, r):
+    '''
+    Factor c <= 1 such that H0 + c * (H1 - H0) lies within radius r from H0, given d = |H1 - H0| (array: one per row)
+    radius_norm = 'spectral' (|H1 - H0|_2, default), 'fro' (Frobenius, from per-row distances) or 'row' (each row)
+    '''
+    return r / np.maximum(r, d)
+
+
+def scale_toward(H1, H0, c):
+    '''
+    In-place H1 <- H0 + c * (H1 - H0) without allocating a new matrix
+    '''
+    H1 -= H0
+    H1 *= c
+    H1 += H0
+    return H1
+
+
+def power_iteration(M, n_iter=100, tol=1e-6, gram=True):
+    '''
+    Largest eigenvalue of the symmetric PSD matrix M (gram=True) or of M.T @ M (gram=False, M dense or sparse)
+    by power iteration, up to relative change tol (estimate from below)
+    '''
+    v = np.ones(M.shape[1], dtype=np.result_type(M.dtype, np.float32)) / np.sqrt(M.shape[1])
+    lam = 0
+    for i in np.arange(n_iter):
+        u = M @ v
+        if not gram:
+            u = M.T @ u
+        lam_new = np.linalg.norm(u)
+        if lam_new == 0:
+            return 0.0
+        v = u / lam_new
+        if abs(lam_new - lam) <= tol * lam_new:
+            break
+        lam = lam_new
+    return float(lam_new)
+
+
+def subspace_svd(M, rank, V0=None, n_iter=2, oversample=5, random_state=42):
+    '''
+    Truncated SVD M ~ U diag(S) Vt of rank `rank` by subspace iteration (Halko, Martinsson and Tropp 2011)
+    M = (m x n) array, scipy.sparse matrix or LinearOperator, V0 = (n x k) starting block (e.g. V_b of the last call)
+    Returns U (m x rank), S (rank,), Vt (rank x n), V_b (n x (rank + oversample))
+    '''
+    m, n = M.shape
+    l = min(rank + oversample, m, n)
+    dtype = np.result_type(M.dtype, np.float32)
+    V = np.random.RandomState(random_state).standard_normal((n, l)).astype(dtype)
+    if V0 is not None:
+        k = min(V0.shape[1], l)
+        V[:, :k] = V0[:, :k]
+    V = np.linalg.qr(V)[0]
+    for i in np.arange(n_iter):
+        Q = np.linalg.qr(np.asarray(M @ V))[0]
+        V = np.linalg.qr(np.asarray(M.T @ Q))[0]
+    Q = np.linalg.qr(np.asarray(M @ V))[0]
+    # M ~ Q Q.T M, with (Q.T M).T = V_b diag(S) U_b.T
+    V_b, S, U_bt = np.linalg.svd(np.asarray(M.T @ Q), full_matrices=False)
+    U = Q @ U_bt.T
+    return U[:, :rank], S[:rank], V_b[:, :rank].T, V_b
+
+
+def prox_l1(a1=0, nonnegativity=True):
+    '''
+    Proximal map Z -> argmin_U |U - Z|^2 / (2 step) + a1 |U|_1 (+ indicator of U >= 0), in place on Z
+    '''
+    def prox(Z, step):
+        if nonnegativity:
+            if a1 != 0:
+                Z -= step * a1
+            return np.maximum(Z, 0, out=Z)
+        if a1 != 0:
+            return np.copysign(np.maximum(np.abs(Z) - step * a1, 0), Z, out=Z)
+        return Z
+    return prox
+
+
+def fista(grad, X0, L, prox=None, max_iter=100, tol=1e-4, restart=True, f=None, L_max=np.inf):
+    '''
+    Accelerated proximal gradient (FISTA) for min_X f(X) + g(X), step size 1/L; grad(Y) = gradient of f, prox(Z, step)
+    With f given, L is doubled up to L_max (backtracking); restart resets the momentum (O'Donoghue and Candes 2015)
+    Stops when |X_k+1 - X_k|_F <= tol * |X_1 - X_0|_F. Returns X and the number of iterations
+    '''
+    X = np.array(X0, dtype=np.result_type(X0.dtype, np.float32))  # copy
+    Y = X.copy()
+    t = 1.0
+    for i in np.arange(max_iter):
+        G = grad(Y)
+        if f is not None:
+            f_Y = f(Y)
+        while True:
+            step = 1 / L
+            X_new = Y - step * G
+            if prox is not None:
+                X_new = prox(X_new, step)
+            if (f is None) or (L >= L_max):
+                break
+            D = X_new - Y
+            if f(X_new) <= f_Y + np.sum(G * D) + (L / 2) * np.sum(D * D):
+                break
+            L = min(2 * L, L_max)
+
+        diff = X_new - X
+        diff_norm = np.linalg.norm(diff)
+        if i == 0:
+            first_norm = diff_norm
+
+        if restart and (np.sum((Y - X_new) * diff) > 0):
+            t = 1.0
+        t_new = (1 + np.sqrt(1 + 4 * t ** 2)) / 2
+        Y = X_new + ((t - 1) / t_new) * diff
+        X, t = X_new, t_new
+        if diff_norm <= tol * first_norm:
+            break
+    return X, i + 1
+
+
+def update_code_fista(X, W, H0, r, a1=0, a2=0, nonnegativity=True,
+                      A=None, B=None, L=None, max_iter=100, tol=1e-4):
+    '''
+    FISTA version of update_code_within_radius: argmin_H |X - WH|^2 / 2 + a1 |H|_1 + a2 |H|^2 / 2 within radius r
+    (Frobenius) from H0;  A, B : precomputed W.T @ W and W.T @ X;  L : precomputed Lipschitz constant
+    '''
+    if H0 is None:
+        H0 = np.zeros((W.shape[1], X.shape[1]), dtype=np.result_type(W.dtype, np.float32))
+    if A is None:
+        A = W.T @ W
+    if B is None:
+        B = np.asarray(X.T @ W).T
+    if L is None:
+        L = 1.01 * power_iteration(A) + a2
+    if L == 0:
+        return np.array(H0)
+
+    def grad(H):
+        G = A @ H - B
+        if a2 != 0:
+            G += a2 * H
+        return G
+
+    H1, _ = fista(grad, H0, L, prox=prox_l1(a1, nonnegativity), max_iter=max_iter, tol=tol)
+    if r is not None:
+        scale_toward(H1, H0, radius_scale(np.linalg.norm(H1 - H0), r))
+    return H1
+
+
+def update_code_joint_logistic_fista(X, W, H0, r, X_auxiliary=None, a1=0, a2=0, xi=0, nonnegativity=True,
+                                     A=None, B=None, max_iter=100, tol=1e-4):
+    '''
+    FISTA version of update_code_joint_logistic (feature mode), within radius r (Frobenius) from H0
+    X = [X0, X1], W = [W0, W1], H0 = (r x n)
+    '''
+    if A is None:
+        A = W[0].T @ W[0]
+    if B is None:
+        B = W[0].T @ X[0]
+    r_code = H0.shape[0]
+    beta_code = W[1][:, 1:r_code+1]
+    D_fixed = np.repeat(W[1][:, :1], X[0].shape[1], axis=1)  # logits of the intercept and auxiliary variables
+    if X_auxiliary is not None:
+        D_fixed += W[1][:, r_code+1:] @ X_auxiliary
+    L = 1.01 * (xi * power_iteration(A) + power_iteration(beta_code.T @ beta_code) / 4) + a2
+
+    def grad(H):
+        _, _, G = logistic_loss_grad(beta_code, H, X[1], offset=D_fixed, wrt='H', compute_loss=False)
+        G += xi * (A @ H - B)
+        if a2 != 0:
+            G += a2 * H
+        return G
+
+    H1, _ = fista(grad, H0, L, prox=prox_l1(a1, nonnegativity), max_iter=max_iter, tol=tol)
+    if r is not None:
+        scale_toward(H1, H0, radius_scale(np.linalg.norm(H1 - H0), r))
+    return H1
+
+
+def update_dict_joint_logistic_fista(X, H, W, r, xi=1, a1=0, a2=0, nonnegativity=True,
+                                     X_auxiliary=None, A=None, XHt=None, X_norm_sq=None,
+                                     max_iter=100, tol=1e-4):
+    '''
+    FISTA dictionary step of filter-based SDL: argmin_W0 xi |X0 - W0 H|^2 / 2 + Logistic_Loss(X1, W1 [1; W0.T X0; X_aux])
+    within radius r (Frobenius) from W0
+    A, XHt : precomputed H @ H.T and X0 @ H.T;  X_norm_sq : precomputed lambda_max(X0 X0.T)
+    '''
+    if A is None:
+        A = H @ H.T
+    if XHt is None:
+        XHt = X[0] @ H.T
+    if X_norm_sq is None:
+        X_norm_sq = power_iteration(X[0].T, gram=False)
+    r_code = H.shape[0]
+    beta_code = W[1][:, 1:r_code+1]
+    D_fixed = np.repeat(W[1][:, :1], X[0].shape[1], axis=1)
+    if X_auxiliary is not None:
+        D_fixed += W[1][:, r_code+1:] @ X_auxiliary
+    L_MF = 1.01 * xi * power_iteration(A) + a2
+    L_max = L_MF + 1.01 * power_iteration(beta_code.T @ beta_code) * X_norm_sq / 4
+
+    def grad(W0):
+        # logits beta @ W0.T @ X0 + D_fixed, gradient X0 @ (P - X1).T @ beta
+        _, _, G_code = logistic_loss_grad(beta_code, np.asarray(X[0].T @ W0).T, X[1], offset=D_fixed,
+                                          wrt='H', compute_loss=False)
+        G = np.asarray(X[0] @ G_code.T)
+        G += xi * (W0 @ A - XHt)
+        if a2 != 0:
+            G += a2 * W0
+        return G
+
+    def f(W0):
+        # xi |X0 - W0 H|^2 / 2 without the constant |X0|^2, plus the logistic loss and the L2 term
+        loss = logistic_loss_grad(beta_code, np.asarray(X[0].T @ W0).T, X[1], offset=D_fixed, compute_grad=False)[0]
+        loss += xi * (np.sum((W0.T @ W0) * A) / 2 - np.sum(W0 * XHt)) + a2 * np.sum(W0 * W0) / 2
+        return loss
+
+    # the bound L_max is loose when the logits are far from 0, so start from the MF part and backtrack
+    W1, _ = fista(grad, W[0], L_MF, prox=prox_l1(a1, nonnegativity), max_iter=max_iter, tol=tol, f=f, L_max=L_max)
+    if r is not None:
+        scale_toward(W1, W[0], radius_scale(np.linalg.norm(W1 - W[0]), r))
+    return W1
+
+
+def sdl_filter_loss_grad(X, W, H, beta, xi=1, X_auxiliary=None, X_sq=None):
+    '''
+    Filter-based SDL objective xi |X0 - W0 H|^2 / 2 + Logistic_Loss(X1, beta [1; W0.T X0; X_aux]) and its gradient
+    X = [X0, X1], W0 = (d x r), H = (r x n), beta = (d2 x (1+r+d3));  X_sq : cached |X0|^2
+    Returns f, [grad_W0, grad_H, grad_beta], error_data, error_label
+    '''
+    if X_sq is None:
+        X_sq = sq_norm(X[0])
+    r = H.shape[0]
+    WtX = np.asarray(X[0].T @ W).T  # r x n, shared by the MF and logistic terms
+    WtW = W.T @ W
+    HHt = H @ H.T
+    error_data = max(X_sq - 2 * np.sum(WtX * H) + np.sum(WtW * HHt), 0)
+
+    H_ext = np.vstack((np.ones((1, H.shape[1]), dtype=WtX.dtype), WtX))
+    if X_auxiliary is not None:
+        H_ext = np.vstack((H_ext, X_auxiliary))
+    error_label, P, grad_beta = logistic_loss_grad(beta, H_ext, X[1])
+    R = np.subtract(P, X[1], out=P)
+
+    M = beta[:, 1:r+1].T @ R
+    M -= xi * H
+    grad_W = np.asarray(X[0] @ M.T)
+    grad_W += xi * (W @ HHt)
+    grad_H = xi * (WtW @ H - WtX)
+    return xi * error_data / 2 + error_label, [grad_W, grad_H, grad_beta], error_data, error_label
+
+
+def svrg_code_beta(X, W, H0, r=None, X_auxiliary=None, xi=0, a1=0, a2=0, C=1.0, nonnegativity=True,
+                   A=None, B=None, n_epochs=2, batch_size=1000, code_iter=3, tol=1e-4):
+    '''
+    Code/beta block of feature-based SDL: FISTA sweeps of H over column slices, then preconditioned SVRG on beta
+    (Johnson and Zhang 2013) with H fixed; H within radius r (Frobenius) from H0
+    W = [W0, beta], H0 = (r x n);  A, B : precomputed W0.T @ W0 and W0.T @ X0.  Returns H, beta
+    '''
+    n = X[1].shape[1]
+    d2 = X[1].shape[0]
+    r_code = H0.shape[0]
+    if A is None:
+        A = W[0].T @ W[0]
+    if B is None:
+        B = W[0].T @ X[0]
+    L_MF = 1.01 * xi * power_iteration(A) + a2
+    prox = prox_l1(a1, nonnegativity)
+
+    H = H0.copy()
+    beta = np.array(W[1], dtype=H.dtype)  # copy
+    reg = np.identity(beta.shape[1], dtype=beta.dtype)
+    reg[0, 0] = 0  # intercept not penalized
+
+    slices = [slice(s, min(s + batch_size, n)) for s in np.arange(0, n, batch_size)]
+    def aux(sl):
+        return None if X_auxiliary is None else X_auxiliary[:, sl]
+
+    def design(H_b, aux_b):
+        # [1; H_b; aux_b]
+        Z = [np.ones((1, H_b.shape[1]), dtype=H_b.dtype), H_b]
+        if aux_b is not None:
+            Z.append(aux_b)
+        return np.vstack(Z)
+
+    def logits(H_b, aux_b):
+        D = beta[:, 1:r_code+1] @ H_b
+        D += beta[:, :1]
+        if aux_b is not None:
+            D += beta[:, r_code+1:] @ aux_b
+        return D
+
+    def grad_beta(R, H_b, aux_b):
+        # C R @ [1; H_b; aux_b].T without stacking the design
+        G = [np.sum(R, axis=1, keepdims=True), R @ H_b.T]
+        if aux_b is not None:
+            G.append(R @ aux_b.T)
+        return C * np.hstack(G)
+
+    def precond_factor(M):
+        try:
+            return cho_factor(M, check_finite=False)
+        except LinAlgError:  # saturated labels (P (1 - P) = 0) leave the unpenalized intercept block singular
+            return cho_factor(np.diag(np.maximum(np.diag(M), 1 / n)), check_finite=False)
+
+    R_snap = np.empty(X[1].shape, dtype=beta.dtype)
+    for epoch in np.arange(n_epochs):
+        H_old = H.copy()
+        beta_old = beta.copy()
+
+        # 1. code sweep, snapshot gradient and Hessians at the new codes
+        beta_code = beta[:, 1:r_code+1]
+        L = L_MF + C * np.sum(beta_code ** 2) / 4
+        G_snap = np.zeros_like(beta)
+        hess = np.zeros((d2, beta.shape[1], beta.shape[1]), dtype=beta.dtype)
+        for sl in slices:
+            aux_b = aux(sl)
+            Y_b = X[1][:, sl]
+            D_fixed = logits(np.zeros((r_code, sl.stop - sl.start), dtype=H.dtype), aux_b)
+            def grad(H_c):
+                G = C * (beta_code.T @ (sigmoid(beta_code @ H_c + D_fixed) - Y_b))
+                G += xi * (A @ H_c - B[:, sl])
+                if a2 != 0:
+                    G += a2 * H_c
+                return G
+            H[:, sl] = fista(grad, H[:, sl], L, prox=prox, max_iter=code_iter, tol=0)[0]
+
+            P = sigmoid(logits(H[:, sl], aux_b))
+            R_snap[:, sl] = P - Y_b
+            G_snap += grad_beta(R_snap[:, sl], H[:, sl], aux_b)
+            Z = design(H[:, sl], aux_b)[1:]
+            for j in np.arange(d2):
+                hess[j] += logistic_hessian(Z, C * P[j] * (1 - P[j]))
+
+        # 2. beta sweep: preconditioned SVRG with H fixed
+        precond = [precond_factor((hess[j] + reg) / n) for j in np.arange(d2)]
+        L_max = np.zeros(d2)
+        for sl in slices:
+            Z = design(H[:, sl], aux(sl))
+            for j in np.arange(d2):
+                L_max[j] = max(L_max[j], C * np.max(np.sum(Z * cho_solve(precond[j], Z), axis=0)) / 4)
+        m = min(batch_size, n)
+        step = 1 / (3 * ((n - m) / (m * max(n - 1, 1)) * L_max + n * (m - 1) / (m * max(n - 1, 1))))
+
+        for k in np.random.permutation(len(slices)):
+            sl = slices[k]
+            H_b = H[:, sl]
+            aux_b = aux(sl)
+            R = sigmoid(logits(H_b, aux_b)) - X[1][:, sl]
+            g_new = grad_beta(R, H_b, aux_b)
+            g_snap = grad_beta(R_snap[:, sl], H_b, aux_b)
+            v = (g_new - g_snap) / (sl.stop - sl.start) + G_snap / n + (beta @ reg) / n
+            for j in np.arange(d2):
+                beta[j] -= step[j] * cho_solve(precond[j], v[j])
+
+        dist = max(np.linalg.norm(H - H_old) / max(np.linalg.norm(H_old), 1e-12),
+                   np.linalg.norm(beta - beta_old) / max(np.linalg.norm(beta_old), 1e-12))
+        if dist < tol:
+            break
+
+    if r is not None:
+        scale_toward(H, H0, radius_scale(np.linalg.norm(H - H0), r))
+    return H, beta
+
+
+def fit_logistic_newton_sum(evaluate, W0, sub_iter=20, stopping_diff=1e-4):
+    '''
+    fit_logistic_newton for a loss summed over parts held elsewhere (e.g. worker shards)
+    evaluate(W, compute_hess) -> summed loss (d2,), grad (d2 x (p+1)), hess (d2 x (p+1) x (p+1) or None)
+    '''
+    W1 = np.array(W0, dtype=np.result_type(W0.dtype, np.float32))  # copy
+    reg = np.identity(W1.shape[1], dtype=W1.dtype)
+    reg[0, 0] = 0  # intercept not penalized
+
+    def penalized(W, compute_hess):
+        loss, grad, hess = evaluate(W, compute_hess)
+        loss = loss + np.sum(W[:, 1:] ** 2, axis=1) / 2
+        grad = grad + W @ reg
+        return loss, grad, hess
+
+    loss_old, grad, hess = penalized(W1, True)
+    for i in np.arange(sub_iter):
+        if np.max(np.abs(grad)) < stopping_diff:
+            break
+        step = np.stack([np.linalg.solve(hess[j] + reg, grad[j]) for j in np.arange(W1.shape[0])])
+
+        # step halving (per label) until the objective decreases
+        t = np.ones(W1.shape[0], dtype=W1.dtype)
+        while True:
+            W_new = W1 - t[:, np.newaxis] * step
+            loss_new = penalized(W_new, False)[0]
+            worse = (loss_new > loss_old) & (t >= 1e-10)
+            if not np.any(worse):
+                break
+            t[worse] /= 2
+        W1 = W_new
+        loss_old, grad, hess = penalized(W1, True)
+    return W1
+
+
+def share_array(X):
+    '''
+    Copy a dense array or scipy.sparse matrix (stored as CSC) into shared memory (multiprocessing.shared_memory)
+    so that worker processes can use it without copies. Returns the SharedMemory handles (keep them alive,
+    close and unlink when done) and a picklable descriptor for attach_array.
+    '''
+    if sp.issparse(X):
+        X = sp.csc_matrix(X)
+        handles, descs = [], []
+        for Z in [X.data, X.indices, X.indptr]:
+            h, d = share_array(Z)
+            handles += h
+            descs.append(d)
+        return handles, ('csc', X.shape, descs)
+    X = np.asarray(X)
+    shm = shared_memory.SharedMemory(create=True, size=max(X.nbytes, 1))
+    np.ndarray(X.shape, dtype=X.dtype, buffer=shm.buf)[...] = X
+    return [shm], ('dense', shm.name, X.shape, X.dtype.str)
+
+
+def attach_array(desc):
+    '''
+    Array (or CSC matrix) in shared memory from a share_array descriptor, without copying.
+    Returns the array and the SharedMemory handles to close when done.
+    '''
+    if desc[0] == 'csc':
+        parts, handles = [], []
+        for d in desc[2]:
+            Z, h = attach_array(d)
+            parts.append(Z)
+            handles += h
+        return sp.csc_matrix(tuple(parts), shape=desc[1], copy=False), handles
+    shm = shared_memory.SharedMemory(name=desc[1])
+    return np.ndarray(desc[2], dtype=np.dtype(desc[3]), buffer=shm.buf), [shm]
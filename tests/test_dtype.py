@@ -0,0 +1,63 @@
+import io
+import contextlib
+import numpy as np
+import pytest
+
+from SDL_simulation import sim_data_gen
+from src.SDL_BCD import SDL_BCD
+from src.SNMF import SNMF
+from src.LMF import LMF
+from src.SDL_SVP import SDL_SVP
+
+
+METHODS = ['SDL-filt', 'SDL-feat', 'SNMF', 'LMF', 'SDL-conv-filt', 'SDL-conv-feat']
+
+
+def fit_model(name, X_train, X_test, Y_train, Y_test, n_components=2, iter=20, dtype=np.float64):
+    '''
+    Fit one of the four models on [X_train, Y_train] and return (test accuracy, model)
+    '''
+    kw = dict(X=[X_train, Y_train], X_test=[X_test, Y_test], n_components=n_components, xi=1, dtype=dtype)
+    radius = 10
+    if name in ['SDL-filt', 'SDL-feat']:
+        model = SDL_BCD(**kw)
+        result = model.fit(iter=iter, option='filter' if name == 'SDL-filt' else 'feature',
+                           search_radius_const=radius, if_compute_recons_error=True)
+        return result.get('Accuracy'), model
+    elif name == 'SNMF':
+        model = SNMF(**kw)
+        result = model.train_logistic(iter=iter, search_radius_const=radius, if_compute_recons_error=True)
+        return result.get('Accuracy'), model
+    elif name == 'LMF':
+        model = LMF(**kw)
+        result = model.train_logistic(iter=iter, search_radius_const=radius, if_compute_recons_error=True,
+                                      prediction_method_list=['naive'])
+        return result.get('Accuracy (naive)'), model
+    else:
+        option = 'filter' if name == 'SDL-conv-filt' else 'feature'
+        pred_type = 'filter' if option == 'filter' else 'naive'
+        model = SDL_SVP(**kw)
+        result = model.fit(iter=iter, beta=0, nu=2, search_radius_const=0.01, SDL_option=option,
+                           prediction_method_list=[pred_type], if_compute_recons_error=True)
+        return result.get('Accuracy ({})'.format(pred_type)), model
+
+
+@pytest.fixture(scope='module', params=[1, 2])
+def data(request):
+    with contextlib.redirect_stdout(io.StringIO()):
+        X_train, X_test, Y_train, Y_test = sim_data_gen(p=100, r=2, n=1000, noise_std=0.1, random_seed=request.param)[:4]
+    return request.param, X_train, X_test, Y_train, Y_test
+
+
+@pytest.mark.parametrize('name', METHODS)
+def test_float32_parity(data, name):
+    seed, X_train, X_test, Y_train, Y_test = data
+    acc = {}
+    for dtype in [np.float64, np.float32]:
+        np.random.seed(seed)
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            acc[dtype], model = fit_model(name, X_train, X_test, Y_train, Y_test, dtype=dtype)
+    assert acc[np.float64] > 0.7  # parity of a fit that learned something
+    assert abs(acc[np.float32] - acc[np.float64]) <= 0.03
+    for Z in [model.loading[0], model.loading[1], model.code]:
+        assert np.asarray(Z).dtype == np.float32
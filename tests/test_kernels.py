@@ -0,0 +1,45 @@
+import numpy as np
+from scipy.optimize import nnls
+
+from src.kernels import svrg_code_beta, update_code_within_radius, nnls_block_pivot
+
+
+def test_svrg_code_beta_saturated_labels():
+    # P = 1 exactly on every sample: the logistic Hessian of the unpenalized intercept vanishes
+    rng = np.random.RandomState(0)
+    X0, Y = rng.rand(20, 300), np.ones((1, 300))
+    W = [rng.rand(20, 3), np.array([[200., 50., 50., 50.]])]
+    H, beta = svrg_code_beta([X0, Y], W, rng.rand(3, 300), xi=1, batch_size=100)
+    assert np.all(np.isfinite(H)) and np.all(np.isfinite(beta))
+
+
+def test_update_code_line_search_gram_path():
+    # the line search runs on A = W.T W and B = W.T X alone and does not increase the objective
+    rng = np.random.RandomState(0)
+    X, W, H0 = rng.rand(30, 200), rng.rand(30, 5), rng.rand(5, 200)
+    objective = lambda H: 0.5 * np.linalg.norm(X - W @ H) ** 2 + 0.1 * np.abs(H).sum()
+    H = update_code_within_radius(None, None, H0, None, a1=0.1, A=W.T @ W, B=W.T @ X, use_line_search=True)
+    H_direct = update_code_within_radius(X, W, H0, None, a1=0.1, use_line_search=True)
+    np.testing.assert_allclose(H, H_direct, rtol=1e-10)
+    assert objective(H) < objective(H0)
+
+
+def test_nnls_block_pivot_matches_scipy():
+    # columnwise scipy.optimize.nnls on the same W, including an exactly collinear pair of atoms
+    rng = np.random.RandomState(0)
+    W = rng.randn(40, 6)
+    W[:, 5] = 2 * W[:, 4]
+    X = rng.randn(40, 50) + W[:, :3] @ rng.rand(3, 50)
+    A, B = W.T @ W, W.T @ X
+    H = nnls_block_pivot(A, B)
+    H_scipy = np.stack([nnls(W, X[:, j])[0] for j in range(X.shape[1])], axis=1)
+    assert np.all(H >= 0)
+    # minimizers need not be unique on collinear atoms, so compare fits and objectives
+    np.testing.assert_allclose(W @ H, W @ H_scipy, atol=1e-8)
+    np.testing.assert_allclose(np.linalg.norm(X - W @ H, axis=0), np.linalg.norm(X - W @ H_scipy, axis=0), rtol=1e-10)
+    H_warm = nnls_block_pivot(A, B, H0=H_scipy)
+    np.testing.assert_allclose(W @ H_warm, W @ H_scipy, atol=1e-8)
+    # full column rank: the minimizer is unique
+    H5 = nnls_block_pivot(A[:5, :5], B[:5])
+    H5_scipy = np.stack([nnls(W[:, :5], X[:, j])[0] for j in range(X.shape[1])], axis=1)
+    np.testing.assert_allclose(H5, H5_scipy, atol=1e-10)
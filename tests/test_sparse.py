@@ -0,0 +1,49 @@
+import io
+import contextlib
+import numpy as np
+import scipy.sparse as sp
+import pytest
+
+from src.SDL_SVP import SDL_SVP
+
+
+def sparse_data(p=30, n=60, density=0.3, random_seed=0):
+    rng = np.random.RandomState(random_seed)
+    X = rng.rand(p, n) * (rng.rand(p, n) < density)
+    Y = (rng.rand(1, n) < 0.5).astype(float)
+    return X, Y
+
+
+def fit_svp(X, Y, option, **kwargs):
+    np.random.seed(1)
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        model = SDL_SVP(X=[X, Y], X_test=[X.toarray() if sp.issparse(X) else X, Y], n_components=3, xi=1)
+        model.fit(iter=3, SDL_option=option, if_compute_recons_error=True,
+                  prediction_method_list=['filter' if option == 'filter' else 'naive'], **kwargs)
+    return model
+
+
+@pytest.mark.parametrize('option', ['filter', 'feature'])
+@pytest.mark.parametrize('kwargs', [{}, {'factored': True}, {'solver': 'apg'}])
+def test_svp_sparse_matches_dense(option, kwargs):
+    X, Y = sparse_data()
+    dense = fit_svp(X, Y, option, **kwargs)
+    csr = fit_svp(sp.csr_matrix(X), Y, option, **kwargs)
+    for W_csr, W_dense in zip(csr.loading, dense.loading):
+        assert isinstance(W_csr, np.ndarray)
+        np.testing.assert_allclose(W_csr, W_dense, rtol=1e-6, atol=1e-8)
+    time_error_csr, time_error_dense = csr.result_dict['time_error'], dense.result_dict['time_error']
+    np.testing.assert_allclose(time_error_csr[1:], time_error_dense[1:], rtol=1e-8)
+
+
+@pytest.mark.parametrize('option', ['filter', 'feature'])
+def test_project_svp_sparse_dense_B(option):
+    X, Y = sparse_data()
+    model = SDL_SVP(X=[sp.csr_matrix(X), Y], X_test=[X, Y], n_components=3, xi=1)
+    rng = np.random.RandomState(1)
+    A = rng.randn(*((X.shape[0], 2) if option == 'filter' else (2, X.shape[1])))
+    B = rng.randn(*X.shape)
+    B_expected = 0.5 * B + 2 * X
+    model.project_SVP(A, B, 0.5, 2, option=option)
+    assert type(B) is np.ndarray
+    np.testing.assert_allclose(B, B_expected)